@@ -0,0 +1,147 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import itertools
+import json
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from devops.helpers.file_lock import FileLock
+
+
+class LibvirtDeviceNames(object):
+    """Allocator of bridge and network device names of a libvirt host
+
+    Names taken on the host are the bridges of libvirt networks and the
+    interfaces of node devices. They are requested once, later only new
+    networks and devices are requested: bridgeName() and XMLDesc() are
+    called once per network and device.
+
+    Allocated names are reserved in the reservations file in lock_dir,
+    which is changed under the file lock, so threads and processes on
+    one host never get the same name. A reservation is dropped when the
+    name appears on the host or when it expires in ttl seconds.
+    """
+
+    def __init__(self, connection_pool, lock_dir, ttl=600):
+        """Device names allocator
+
+        :type connection_pool: _ConnectionPool
+        :param lock_dir: directory for the reservations and lock files
+        :param ttl: seconds to keep a reserved name not used on the host
+        """
+        self.connection_pool = connection_pool
+        self.lock_dir = lock_dir
+        self.ttl = ttl
+        # {network uuid: bridge name}
+        self.__bridges = collections.OrderedDict()
+        # {device name: interface name or None}
+        self.__interfaces = collections.OrderedDict()
+        self.__lock = threading.Lock()
+
+    @property
+    def reservations_path(self):
+        return os.path.join(self.lock_dir, 'reservations.json')
+
+    def _lock(self):
+        return FileLock(os.path.join(self.lock_dir, 'reservations.lock'))
+
+    def refresh(self):
+        """Update names taken on the host
+
+        :rtype: list
+        :return: interface names of node devices and bridge names
+        """
+        conn = self.connection_pool.get()
+        with self.__lock:
+            interfaces = collections.OrderedDict()
+            for dev in conn.listAllDevices(
+                    libvirt.VIR_CONNECT_LIST_NODE_DEVICES_CAP_NET):
+                name = dev.name()
+                if name in self.__interfaces:
+                    interfaces[name] = self.__interfaces[name]
+                    continue
+                xml = ET.fromstring(dev.XMLDesc())
+                name_el = xml.find('./capability/interface')
+                interfaces[name] = None
+                if name_el is not None:
+                    interfaces[name] = name_el.text
+            self.__interfaces = interfaces
+
+            bridges = collections.OrderedDict()
+            for net in conn.listAllNetworks():
+                uuid = net.UUIDString()
+                if uuid in self.__bridges:
+                    bridges[uuid] = self.__bridges[uuid]
+                else:
+                    bridges[uuid] = net.bridgeName()
+            self.__bridges = bridges
+
+            names = [name for name in interfaces.values() if name is not None]
+            return names + list(bridges.values())
+
+    def _read_reservations(self):
+        try:
+            with open(self.reservations_path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_reservations(self, reservations):
+        tmp_path = self.reservations_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(reservations, f, indent=1, sort_keys=True)
+        os.rename(tmp_path, self.reservations_path)
+
+    def reserve(self, prefix):
+        """Reserve the first free name '<prefix><N>'
+
+        :type prefix: str
+        :rtype: str
+        """
+        uri = self.connection_pool.connection_string
+        with self._lock():
+            taken = set(self.refresh())
+            now = time.time()
+            all_reservations = self._read_reservations()
+            reservations = {
+                name: expires
+                for name, expires in all_reservations.get(uri, {}).items()
+                if expires > now and name not in taken}
+
+            for num in itertools.count():
+                name = '{0}{1}'.format(prefix, num)
+                if name not in taken and name not in reservations:
+                    break
+
+            reservations[name] = now + self.ttl
+            all_reservations[uri] = reservations
+            self._write_reservations(all_reservations)
+        return name
+
+    def release(self, name):
+        """Drop reservation of the name
+
+        :type name: str
+        """
+        uri = self.connection_pool.connection_string
+        with self._lock():
+            all_reservations = self._read_reservations()
+            if all_reservations.get(uri, {}).pop(name, None) is not None:
+                self._write_reservations(all_reservations)
@@ -12,10 +12,15 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
 import datetime
+import functools
 import itertools
 import os
 import shutil
+import threading
+import time
 from time import sleep
 import uuid
 from warnings import warn
@@ -27,9 +32,14 @@ from django.utils.functional import cached_property
 import libvirt
 import netaddr
 
+from devops.driver.libvirt.libvirt_device_names import LibvirtDeviceNames
+from devops.driver.libvirt.libvirt_image_cache import LibvirtImageCache
+from devops.driver.libvirt.libvirt_volume_upload import \
+    LibvirtVolumeUploader
 from devops.driver.libvirt.libvirt_xml_builder import LibvirtXMLBuilder
 from devops.error import DevopsCalledProcessError
 from devops.error import DevopsError
+from devops.error import TimeoutError
 from devops.helpers.cloud_image_settings import generate_cloud_image_settings
 from devops.helpers.helpers import deepgetattr
 from devops.helpers.helpers import get_file_size
@@ -49,24 +59,492 @@ from devops.models.volume import DiskDevice
 from devops.models.volume import Volume
 
 
-class _LibvirtManager(object):
+class DomainInventory(object):
+    """State of the domain returned by LibvirtDriver.inventory()
+
+    VNC port is read from the domain XML on first access, so XMLDesc()
+    is not requested for domains which ports are not needed.
+    """
+
+    __slots__ = ['uuid', 'name', 'state', 'active', 'vcpu', 'memory',
+                 'block', 'interfaces', '__domain', '__vnc_port']
+
+    def __init__(self, domain, uuid, name, state, active, vcpu, memory,
+                 block, interfaces):
+        """State of the domain
+
+        :type domain: libvirt.virDomain
+        """
+        self.uuid = uuid
+        self.name = name
+        self.state = state
+        self.active = active
+        self.vcpu = vcpu
+        self.memory = memory
+        self.block = block
+        self.interfaces = interfaces
+        self.__domain = domain
+        self.__vnc_port = None
+
+    @property
+    def vnc_port(self):
+        """VNC port of the running domain, '-1' for inactive domain
+
+        :rtype: str
+        """
+        if not self.active:
+            return '-1'
+        if self.__vnc_port is None:
+            xml_desc = ET.fromstring(self.__domain.XMLDesc(0))
+            vnc_element = xml_desc.find(
+                'devices/graphics[@type="vnc"][@port]')
+            if vnc_element is None:
+                return None
+            self.__vnc_port = vnc_element.get('port')
+        return self.__vnc_port
+
+
+class _HandleCache(object):
+    """Cache of libvirt object handles of one connection
+
+    Handles are stored by object kind ('domain', 'network', 'volume') and
+    libvirt identifier (UUID for domains and networks, key for volumes).
+    """
 
     def __init__(self):
+        self.__handles = {}
+        self.__lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, kind, key, lookup):
+        """Get cached handle or look it up and cache it
+
+        :type kind: str
+        :type key: str
+        :param lookup: function to call with the key on cache miss
+        :raises: libvirt.libvirtError if lookup failed
+        """
+        with self.__lock:
+            handle = self.__handles.get((kind, key))
+            if handle is not None:
+                self.hits += 1
+                return handle
+            self.misses += 1
+        handle = lookup(key)
+        self.put(kind, key, handle)
+        return handle
+
+    def put(self, kind, key, handle):
+        with self.__lock:
+            self.__handles[(kind, key)] = handle
+
+    def invalidate(self, kind, key):
+        with self.__lock:
+            if self.__handles.pop((kind, key), None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.__lock:
+            self.invalidations += len(self.__handles)
+            self.__handles.clear()
+
+    def __len__(self):
+        return len(self.__handles)
+
+    @property
+    def stats(self):
+        """Cache counters
+
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                'size': len(self.__handles),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+            }
+
+
+class _HostInfoCache(object):
+    """Cache of host information of one connection
+
+    Capabilities, domain capabilities, emulator paths and libvirt version
+    are requested once and kept for ttl seconds (forever if ttl is None)
+    or until refresh() is called.
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl
+        self.__values = {}
+        self.__lock = threading.Lock()
+
+    def get(self, key, request):
+        """Get cached value or request it and cache it
+
+        :param key: hashable key of the value
+        :param request: function to call on cache miss
+        """
+        now = time.time()
+        with self.__lock:
+            item = self.__values.get(key)
+            if item is not None:
+                value, requested = item
+                if self.ttl is None or now - requested < self.ttl:
+                    return value
+        value = request()
+        with self.__lock:
+            self.__values[key] = (value, now)
+        return value
+
+    def refresh(self):
+        """Drop all cached values"""
+        with self.__lock:
+            self.__values.clear()
+
+
+class _ConnectionPool(object):
+    """Pool of libvirt connections to one URI
+
+    Connections are opened on demand, up to `size` connections. Every
+    thread is bound to one connection of the pool, so concurrent threads
+    are spread over different connections. Connections closed by libvirtd
+    (restart, failed keepalive) are reopened on the next request.
+    """
+
+    def __init__(self, connection_string, size=1, keepalive=None,
+                 on_open=None):
+        """Connection pool
+
+        :type connection_string: str
+        :type size: int
+        :param keepalive: (interval, count) to pass to setKeepAlive()
+        :param on_open: function(pool, slot, conn, reconnect) called
+                        after a connection has been opened
+        """
+        self.connection_string = connection_string
+        self.size = max(1, int(size))
+        self.keepalive = keepalive
+        self.on_open = on_open
+        self.opened = 0
+        self.reconnects = 0
+        self.checkouts = 0
+        self.__conns = [None] * self.size
+        self.__states = [None] * self.size
+        self.__users = [0] * self.size
+        self.__lock = threading.RLock()
+        self.__local = threading.local()
+        self.__slots = itertools.count()
+
+    def _thread_slot(self):
+        slot = getattr(self.__local, 'slot', None)
+        if slot is None:
+            slot = self.__local.slot = next(self.__slots) % self.size
+        return slot
+
+    def get(self):
+        """Get connection bound to the current thread
+
+        :rtype: libvirt.virConnect
+        """
+        return self._get(self._thread_slot())
+
+    @contextlib.contextmanager
+    def checkout(self):
+        """Use the least busy connection of the pool
+
+        Example of usage::
+
+            with pool.checkout() as conn:
+                conn.lookupByName(name)
+        """
+        with self.__lock:
+            slot = min(range(self.size), key=self.__users.__getitem__)
+            self.__users[slot] += 1
+            self.checkouts += 1
+        try:
+            yield self._get(slot)
+        finally:
+            with self.__lock:
+                self.__users[slot] -= 1
+
+    def _get(self, slot):
+        with self.__lock:
+            conn = self.__conns[slot]
+            if conn is not None and self._is_alive(slot):
+                return conn
+            return self._open(slot, reconnect=conn is not None)
+
+    def _is_alive(self, slot):
+        if self.__states[slot]['closed']:
+            return False
+        try:
+            return bool(self.__conns[slot].isAlive())
+        except libvirt.libvirtError:
+            return False
+
+    def _open(self, slot, reconnect=False):
+        if reconnect:
+            logger.info('Connection to {} has been lost, '
+                        'reconnecting'.format(self.connection_string))
+            self._close(slot)
+
+        conn = libvirt.open(self.connection_string)
+        state = {'closed': False}
+
+        def closed(_conn, reason, _opaque):
+            logger.debug('Connection to {} closed, reason: {}'.format(
+                self.connection_string, reason))
+            state['closed'] = True
+
+        try:
+            conn.registerCloseCallback(closed, None)
+            if self.keepalive is not None:
+                conn.setKeepAlive(*self.keepalive)
+        except libvirt.libvirtError:
+            logger.debug('Keepalive is not supported by {}'.format(
+                self.connection_string))
+
+        self.__conns[slot] = conn
+        self.__states[slot] = state
+        self.opened += 1
+        if reconnect:
+            self.reconnects += 1
+        if self.on_open is not None:
+            self.on_open(self, slot, conn, reconnect)
+        return conn
+
+    def _close(self, slot):
+        conn = self.__conns[slot]
+        self.__conns[slot] = None
+        try:
+            conn.unregisterCloseCallback()
+            conn.close()
+        except libvirt.libvirtError:
+            pass
+
+    def close(self):
+        """Close all connections of the pool"""
+        with self.__lock:
+            for slot in range(self.size):
+                if self.__conns[slot] is not None:
+                    self._close(slot)
+
+    @property
+    def stats(self):
+        """Pool counters
+
+        :rtype: dict
+        """
+        with self.__lock:
+            return {
+                'size': self.size,
+                'connected': sum(1 for c in self.__conns if c is not None),
+                'in_use': sum(self.__users),
+                'opened': self.opened,
+                'reconnects': self.reconnects,
+                'checkouts': self.checkouts,
+            }
+
+
+class _LibvirtManager(object):
+
+    def __init__(self, use_events=False):
+        """Libvirt connections manager
+
+        :param use_events: run libvirt event loop to receive object
+                           lifecycle events on opened connections
+        """
         libvirt.virInitialize()
         libvirt.registerErrorHandler(_LibvirtManager._error_handler, self)
-        self.connections = {}
+        self.pools = {}
+        self.handle_caches = {}
+        self.device_names = {}
+        self.host_infos = {}
+        self._pools_lock = threading.Lock()
+        self.use_events = use_events
+        self._event_loop = None
+        self._event_connections = set()
+        self._domain_waiters = {}
+        self._waiters_lock = threading.Lock()
+
+    def get_pool(self, connection_string):
+        """Get pool of libvirt connections for connection string
+
+        Pool size and keepalive are configured with LIBVIRT_POOL_SIZE,
+        LIBVIRT_KEEPALIVE_INTERVAL and LIBVIRT_KEEPALIVE_COUNT settings.
+
+        :type connection_string: str
+        :rtype: _ConnectionPool
+        """
+        with self._pools_lock:
+            if connection_string not in self.pools:
+                keepalive = None
+                if self.use_events:
+                    self._start_event_loop()
+                    # keepalive messages are sent by the event loop
+                    keepalive = (settings.LIBVIRT_KEEPALIVE_INTERVAL,
+                                 settings.LIBVIRT_KEEPALIVE_COUNT)
+                self.pools[connection_string] = _ConnectionPool(
+                    connection_string,
+                    size=settings.LIBVIRT_POOL_SIZE,
+                    keepalive=keepalive,
+                    on_open=self._on_open)
+            return self.pools[connection_string]
 
     def get_connection(self, connection_string):
         """Get libvirt connection for connection string
 
         :type connection_string: str
+        :rtype: libvirt.virConnect
         """
-        if connection_string not in self.connections:
-            conn = libvirt.open(connection_string)
-            self.connections[connection_string] = conn
-        else:
-            conn = self.connections[connection_string]
-        return conn
+        return self.get_pool(connection_string).get()
+
+    def _on_open(self, pool, slot, conn, reconnect):
+        if reconnect:
+            # handles of the closed connection are not usable anymore
+            self.get_handle_cache(pool.connection_string).clear()
+            # libvirtd could be upgraded or reconfigured
+            self.get_host_info(pool.connection_string).refresh()
+        if self.use_events and slot == 0:
+            # all connections receive the same events, listen to one
+            self._register_events(pool.connection_string, conn)
+
+    def get_handle_cache(self, connection_string):
+        """Get cache of object handles for connection string
+
+        :type connection_string: str
+        :rtype: _HandleCache
+        """
+        if connection_string not in self.handle_caches:
+            self.handle_caches[connection_string] = _HandleCache()
+        return self.handle_caches[connection_string]
+
+    def get_host_info(self, connection_string):
+        """Get cache of host information for connection string
+
+        Cached values expire in LIBVIRT_HOST_INFO_TTL seconds.
+
+        :type connection_string: str
+        :rtype: _HostInfoCache
+        """
+        if connection_string not in self.host_infos:
+            self.host_infos[connection_string] = _HostInfoCache(
+                ttl=settings.LIBVIRT_HOST_INFO_TTL)
+        return self.host_infos[connection_string]
+
+    def get_device_names(self, connection_string):
+        """Get allocator of device names for connection string
+
+        Reservations are stored in LIBVIRT_DEVICE_NAMES_DIR and expire in
+        LIBVIRT_DEVICE_NAMES_TTL seconds.
+
+        :type connection_string: str
+        :rtype: LibvirtDeviceNames
+        """
+        pool = self.get_pool(connection_string)
+        with self._pools_lock:
+            if connection_string not in self.device_names:
+                self.device_names[connection_string] = LibvirtDeviceNames(
+                    pool,
+                    lock_dir=settings.LIBVIRT_DEVICE_NAMES_DIR,
+                    ttl=settings.LIBVIRT_DEVICE_NAMES_TTL)
+            return self.device_names[connection_string]
+
+    def _start_event_loop(self):
+        # default event implementation must be registered before
+        # the first connection is opened
+        if self._event_loop is not None:
+            return
+        libvirt.virEventRegisterDefaultImpl()
+        self._event_loop = threading.Thread(
+            target=self._run_event_loop, name='libvirt event loop')
+        self._event_loop.daemon = True
+        self._event_loop.start()
+
+    @staticmethod
+    def _run_event_loop():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    def _register_events(self, connection_string, conn):
+        handles = self.get_handle_cache(connection_string)
+
+        def domain_lifecycle(_conn, dom, event, _detail, _opaque):
+            uuid = dom.UUIDString()
+            if event == libvirt.VIR_DOMAIN_EVENT_UNDEFINED:
+                handles.invalidate('domain', uuid)
+            self._notify_domain_waiters(connection_string, uuid)
+
+        def network_lifecycle(_conn, net, event, _detail, _opaque):
+            if event == libvirt.VIR_NETWORK_EVENT_UNDEFINED:
+                handles.invalidate('network', net.UUIDString())
+
+        try:
+            conn.domainEventRegisterAny(
+                None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE,
+                domain_lifecycle, None)
+            self._event_connections.add(connection_string)
+            if hasattr(conn, 'networkEventRegisterAny'):
+                conn.networkEventRegisterAny(
+                    None, libvirt.VIR_NETWORK_EVENT_ID_LIFECYCLE,
+                    network_lifecycle, None)
+        except libvirt.libvirtError:
+            logger.debug('Lifecycle events are not supported by {}'.format(
+                connection_string))
+
+    def _notify_domain_waiters(self, connection_string, uuid):
+        with self._waiters_lock:
+            for event in self._domain_waiters.get((connection_string, uuid),
+                                                  []):
+                event.set()
+
+    def wait_for_domain(self, connection_string, uuid, predicate,
+                        timeout=60, interval=5,
+                        timeout_msg='Waiting timed out'):
+        """Wait until predicate for domain becomes True
+
+        Predicate is checked on every lifecycle event of the domain. If
+        lifecycle events are not available for the connection, predicate
+        is polled every `interval` seconds, the same interval is used as
+        a safety net for missed events.
+
+        :type connection_string: str
+        :type uuid: str
+        :type predicate: callable
+        :type timeout: int
+        :type interval: int
+        :type timeout_msg: str
+        :rtype: float
+        :return: number of seconds that is left
+        :raises: TimeoutError
+        """
+        if connection_string not in self._event_connections:
+            interval = min(interval, 1)
+
+        key = (connection_string, uuid)
+        event = threading.Event()
+        with self._waiters_lock:
+            self._domain_waiters.setdefault(key, []).append(event)
+
+        deadline = time.time() + timeout
+        try:
+            while True:
+                event.clear()
+                if predicate():
+                    return deadline - time.time()
+                left = deadline - time.time()
+                if left <= 0:
+                    logger.debug(timeout_msg)
+                    raise TimeoutError(timeout_msg)
+                event.wait(min(left, interval))
+        finally:
+            with self._waiters_lock:
+                self._domain_waiters[key].remove(event)
+                if not self._domain_waiters[key]:
+                    del self._domain_waiters[key]
 
     def _error_handler(self, error):
         # this handler redirects libvirt messages to debug logger
@@ -76,13 +554,113 @@ class _LibvirtManager(object):
             logger.debug(error)
 
 
-LibvirtManager = _LibvirtManager()
+LibvirtManager = _LibvirtManager(use_events=True)
+
+
+SnapshotInfo = collections.namedtuple(
+    'SnapshotInfo',
+    ['name', 'created', 'type', 'state', 'disks', 'memory_file', 'parent',
+     'children_num'])
 
 
 class Snapshot(object):
+    """Libvirt domain snapshot
+
+    Snapshot XML is requested from libvirt only once and parsed into
+    immutable :class:`SnapshotInfo` record which is used by all properties.
+    Call :meth:`invalidate` to re-read snapshot data from libvirt.
+    """
 
-    def __init__(self, snapshot):
+    def __init__(self, snapshot, xml=None, children_num=None):
+        """Snapshot
+
+        :type snapshot: libvirt.virDomainSnapshot
+        :param xml: snapshot XML if it has been already requested
+        :param children_num: number of children if already known
+        """
         self._snapshot = snapshot
+        self.__raw_xml = xml
+        self.__children_num = children_num
+        self.__xml = None
+        self.__info = None
+
+    def invalidate(self):
+        """Drop cached snapshot data"""
+        self.__raw_xml = None
+        self.__children_num = None
+        self.__xml = None
+        self.__info = None
+
+    @property
+    def _raw_xml(self):
+        """Snapshot XML as it is returned by libvirt
+
+        :rtype: str
+        """
+        if self.__raw_xml is None:
+            self.__raw_xml = self._snapshot.getXMLDesc(0)
+        return self.__raw_xml
+
+    @property
+    def info(self):
+        """Parsed snapshot data
+
+        :rtype: SnapshotInfo
+        """
+        if self.__info is None:
+            self.__info = self._parse_info(
+                name=self._snapshot.getName(),
+                xml_tree=ET.fromstring(self._raw_xml),
+                children_num=self.__children_num)
+        if self.__info.children_num is None:
+            self.__info = self.__info._replace(
+                children_num=self._snapshot.numChildren())
+        return self.__info
+
+    @staticmethod
+    def _parse_info(name, xml_tree, children_num=None):
+        """Build SnapshotInfo from snapshot XML
+
+        :type name: str
+        :type xml_tree: ET
+        :type children_num: int
+        :rtype: SnapshotInfo
+        """
+        created = None
+        timestamp = xml_tree.find('./creationTime')
+        if timestamp is not None:
+            created = datetime.datetime.utcfromtimestamp(
+                float(timestamp.text))
+
+        disks = []
+        for xml_disk in xml_tree.findall('./disks/disk'):
+            if xml_disk.get('snapshot') == 'external':
+                disks.append((xml_disk.get('name'),
+                              xml_disk.find('source').get('file')))
+
+        snap_type = 'internal'
+        memory_file = None
+        snap_memory = xml_tree.find('./memory')
+        if snap_memory is not None:
+            memory_file = snap_memory.get('file')
+            if snap_memory.get('snapshot') == 'external':
+                snap_type = 'external'
+        for disk in xml_tree.iter('disk'):
+            if disk.get('snapshot') == 'external':
+                snap_type = 'external'
+
+        state = xml_tree.find('./state')
+        parent = xml_tree.find('./parent/name')
+
+        return SnapshotInfo(
+            name=name,
+            created=created,
+            type=snap_type,
+            state=state.text if state is not None else None,
+            disks=tuple(disks),
+            memory_file=memory_file,
+            parent=parent.text if parent is not None else None,
+            children_num=children_num)
 
     @property
     def __snapshot_files(self):
@@ -91,9 +669,8 @@ class Snapshot(object):
         :rtype: list
         """
         snap_files = []
-        snap_memory = self._xml_tree.findall('./memory')[0]
-        if snap_memory.get('file') is not None:
-            snap_files.append(snap_memory.get('file'))
+        if self.memory_file is not None:
+            snap_files.append(self.memory_file)
         return snap_files
 
     def delete_snapshot_files(self):
@@ -119,8 +696,10 @@ class Snapshot(object):
 
         :rtype: str
         """
-        xml = self._snapshot.getXMLDesc(0)
-        snapshot_xmltree = ET.fromstring(xml)
+        if self.__xml is not None:
+            return self.__xml
+
+        snapshot_xmltree = ET.fromstring(self._raw_xml)
 
         # Get cpu model from domain definition as it is not available
         # in snapshot XML for host-passthrough cpu mode
@@ -137,45 +716,34 @@ class Snapshot(object):
                 domain_element.remove(domain_element.findall('./cpu')[0])
                 domain_element.append(cpu_element)
 
-        return xml_tostring(snapshot_xmltree)
+        self.__xml = xml_tostring(snapshot_xmltree)
+        return self.__xml
 
     @property
     def _xml_tree(self):
+        # new tree every time: callers are allowed to modify it
         return ET.fromstring(self.xml)
 
     @property
     def children_num(self):
-        return self._snapshot.numChildren()
+        return self.info.children_num
 
     @property
     def created(self):
-        timestamp = self._xml_tree.findall('./creationTime')[0].text
-        return datetime.datetime.utcfromtimestamp(float(timestamp))
+        return self.info.created
 
     @property
     def disks(self):
-        disks = {}
-        xml_snapshot_disks = self._xml_tree.find('./disks')
-        for xml_disk in xml_snapshot_disks:
-            if xml_disk.get('snapshot') == 'external':
-                disks[xml_disk.get('name')] = xml_disk.find(
-                    'source').get('file')
-        return disks
+        return dict(self.info.disks)
 
     @property
     def get_type(self):
         """Return snapshot type"""
-        snap_memory = self._xml_tree.findall('./memory')[0]
-        if snap_memory.get('snapshot') == 'external':
-            return 'external'
-        for disk in self._xml_tree.iter('disk'):
-            if disk.get('snapshot') == 'external':
-                return 'external'
-        return 'internal'
+        return self.info.type
 
     @property
     def memory_file(self):
-        return self._xml_tree.findall('./memory')[0].get('file')
+        return self.info.memory_file
 
     @property
     def name(self):
@@ -185,11 +753,16 @@ class Snapshot(object):
     def parent(self):
         return self._snapshot.getParent()
 
+    @property
+    def parent_name(self):
+        return self.info.parent
+
     @property
     def state(self):
-        return self._xml_tree.findall('state')[0].text
+        return self.info.state
 
     def delete(self, flags):
+        self.invalidate()
         return self._snapshot.delete(flags)
 
     def __repr__(self):
@@ -218,13 +791,52 @@ class LibvirtDriver(Driver):
     use_hugepages = ParamField(default=False)
     vnc_password = ParamField()
 
-    _device_name_generators = {}
-
-    @cached_property
+    @property
     def conn(self):
-        """Connection to libvirt api"""
+        """Connection to libvirt api
+
+        Every thread gets its own connection from the connection pool.
+        """
         return LibvirtManager.get_connection(self.connection_string)
 
+    @cached_property
+    def connection_pool(self):
+        """Pool of connections to libvirt api
+
+        :rtype: _ConnectionPool
+        """
+        return LibvirtManager.get_pool(self.connection_string)
+
+    @cached_property
+    def handles(self):
+        """Cache of domain, network and volume handles of the connection
+
+        :rtype: _HandleCache
+        """
+        return LibvirtManager.get_handle_cache(self.connection_string)
+
+    @cached_property
+    def device_names(self):
+        """Allocator of bridge and network device names on the host
+
+        :rtype: LibvirtDeviceNames
+        """
+        return LibvirtManager.get_device_names(self.connection_string)
+
+    @property
+    def image_cache(self):
+        """Cache of source images in the storage pool of the driver
+
+        :rtype: LibvirtImageCache
+        """
+        return LibvirtImageCache(
+            self.conn, self.storage_pool_name,
+            cache_dir=settings.LIBVIRT_IMAGE_CACHE_DIR,
+            min_free=settings.LIBVIRT_IMAGE_CACHE_MIN_FREE,
+            upload_kwargs=dict(
+                buffer_size=settings.LIBVIRT_UPLOAD_BUFFER_SIZE,
+                segment_size=settings.LIBVIRT_UPLOAD_SEGMENT_SIZE))
+
     def get_capabilities(self):
         """Get host capabilities
 
@@ -234,9 +846,137 @@ class LibvirtDriver(Driver):
         """
         return self.capabilities
 
-    @cached_property
+    @property
+    def host_info(self):
+        """Cache of host information shared by drivers of the connection
+
+        :rtype: _HostInfoCache
+        """
+        return LibvirtManager.get_host_info(self.connection_string)
+
+    def refresh_host_info(self):
+        """Request capabilities and libvirt version again"""
+        self.host_info.refresh()
+
+    @property
     def capabilities(self):
-        return ET.fromstring(self.conn.getCapabilities())
+        return self.host_info.get(
+            'capabilities',
+            lambda: ET.fromstring(self.conn.getCapabilities()))
+
+    def get_domain_capabilities(self, emulator=None, arch=None,
+                                machine=None, virttype=None):
+        """Get domain capabilities
+
+        :rtype : ET
+        """
+        return self.host_info.get(
+            ('domain_capabilities', emulator, arch, machine, virttype),
+            lambda: ET.fromstring(self.conn.getDomainCapabilities(
+                emulator, arch, machine, virttype, 0)))
+
+    def get_emulator(self, architecture, hypervisor):
+        """Get path of the emulator from host capabilities
+
+        :type architecture: str
+        :type hypervisor: str
+        :rtype : str
+        """
+        def find_emulator():
+            emulator = self.capabilities.find(
+                'guest/arch[@name="{0:>s}"]/'
+                'domain[@type="{1:>s}"]/emulator'.format(
+                    architecture, hypervisor))
+            if emulator is None:
+                raise DevopsError(
+                    'Emulator for {0} domain of {1} architecture is not '
+                    'found'.format(hypervisor, architecture))
+            return emulator.text
+
+        return self.host_info.get(
+            ('emulator', architecture, hypervisor), find_emulator)
+
+    _inventory_stats = (
+        'VIR_DOMAIN_STATS_STATE',
+        'VIR_DOMAIN_STATS_BALLOON',
+        'VIR_DOMAIN_STATS_VCPU',
+        'VIR_DOMAIN_STATS_INTERFACE',
+        'VIR_DOMAIN_STATS_BLOCK',
+    )
+
+    def inventory(self):
+        """State of all domains of the hypervisor indexed by UUID
+
+        All domains with their statistics are requested with one
+        getAllDomainStats() call, domain XML is requested only when
+        VNC port of the running domain is accessed. Handles of the listed
+        domains are stored in the handle cache.
+
+        :rtype: dict of DomainInventory
+        """
+        try:
+            stats = 0
+            for name in self._inventory_stats:
+                stats |= getattr(libvirt, name)
+            records = self.conn.getAllDomainStats(stats, 0)
+        except (AttributeError, libvirt.libvirtError):
+            # getAllDomainStats is not supported by libvirt or by
+            # the hypervisor driver
+            records = [(dom, self._get_domain_stats(dom))
+                       for dom in self.conn.listAllDomains()]
+
+        inventory = {}
+        for dom, dom_stats in records:
+            uuid = dom.UUIDString()
+            self.handles.put('domain', uuid, dom)
+            state = dom_stats.get('state.state')
+            active = state not in (libvirt.VIR_DOMAIN_SHUTOFF,
+                                   libvirt.VIR_DOMAIN_CRASHED)
+            memory = dom_stats.get('balloon.maximum')
+            inventory[uuid] = DomainInventory(
+                domain=dom,
+                uuid=uuid,
+                name=dom.name(),
+                state=state,
+                active=active,
+                vcpu=dom_stats.get('vcpu.current'),
+                memory=memory // 1024 if memory is not None else None,
+                block=self._group_stats(dom_stats, 'block'),
+                interfaces=self._group_stats(dom_stats, 'net'),
+            )
+        return inventory
+
+    @staticmethod
+    def _get_domain_stats(dom):
+        """Minimal domain stats in getAllDomainStats() format
+
+        :type dom: libvirt.virDomain
+        :rtype: dict
+        """
+        state, max_memory, _, vcpu, _ = dom.info()
+        return {
+            'state.state': state,
+            'balloon.maximum': max_memory,
+            'vcpu.current': vcpu,
+        }
+
+    @staticmethod
+    def _group_stats(dom_stats, prefix):
+        """Convert '<prefix>.<N>.<stat>' records to dict by device name
+
+        :type dom_stats: dict
+        :type prefix: str
+        :rtype: dict
+        """
+        devices = {}
+        for num in range(dom_stats.get('{}.count'.format(prefix), 0)):
+            head = '{}.{}.'.format(prefix, num)
+            name = dom_stats.get(head + 'name', str(num))
+            devices[name] = {
+                key[len(head):]: value
+                for key, value in dom_stats.items()
+                if key.startswith(head) and key != head + 'name'}
+        return devices
 
     def node_list(self):
         # virConnect.listDefinedDomains() only returns stopped domains
@@ -264,42 +1004,20 @@ class LibvirtDriver(Driver):
 
         :rtype : List
         """
-        names = []
-
-        # Local Network Devices
-        for dev in self.conn.listAllDevices():
-            xml = ET.fromstring(dev.XMLDesc())
-            name_el = xml.find('./capability/interface')
-            if name_el is None:
-                continue
-            name = name_el.text
-            names.append(name)
-
-        # Network Bridges
-        for net in self.conn.listAllNetworks():
-            names.append(net.bridgeName())
-
-        return names
+        return self.device_names.refresh()
 
     def get_available_device_name(self, prefix):
         """Get available name for network device or bridge
 
+        The name is reserved on the host, see LibvirtDeviceNames.
+
         :type prefix: str
         :rtype : String
         """
-        allocated_names = self.get_allocated_device_names()
-        if prefix not in self._device_name_generators:
-            self._device_name_generators[prefix] = (
-                '{}{}'.format(prefix, i) for i in itertools.count())
-        all_names = self._device_name_generators[prefix]
-
-        for name in all_names:
-            if name in allocated_names:
-                continue
-            return name
+        return self.device_names.reserve(prefix)
 
     def get_libvirt_version(self):
-        return self.conn.getLibVersion()
+        return self.host_info.get('version', self.conn.getLibVersion)
 
 
 class LibvirtL2NetworkDevice(L2NetworkDevice):
@@ -453,7 +1171,9 @@ class LibvirtL2NetworkDevice(L2NetworkDevice):
     @property
     def _libvirt_network(self):
         try:
-            return self.driver.conn.networkLookupByUUIDString(self.uuid)
+            return self.driver.handles.get(
+                'network', self.uuid,
+                self.driver.conn.networkLookupByUUIDString)
         except libvirt.libvirtError:
             logger.error("Network not found by UUID: {}".format(self.uuid))
             return None
@@ -542,6 +1262,7 @@ class LibvirtL2NetworkDevice(L2NetworkDevice):
         ret = self.driver.conn.networkDefineXML(xml)
         ret.setAutostart(True)
         self.uuid = ret.UUIDString()
+        self.driver.handles.put('network', self.uuid, ret)
 
         super(LibvirtL2NetworkDevice, self).define()
 
@@ -606,6 +1327,7 @@ class LibvirtL2NetworkDevice(L2NetworkDevice):
                 # Remove network
                 if self._libvirt_network:
                     self._libvirt_network.undefine()
+                self.driver.handles.invalidate('network', self.uuid)
                 # Remove nwfiler
                 if self.driver.enable_nwfilters:
                     if self._nwfilter:
@@ -623,6 +1345,7 @@ class LibvirtL2NetworkDevice(L2NetworkDevice):
             return True
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_NETWORK:
+                self.driver.handles.invalidate('network', self.uuid)
                 return False
             else:
                 raise
@@ -722,11 +1445,20 @@ class LibvirtVolume(Volume):
     @property
     def _libvirt_volume(self):
         try:
-            return self.driver.conn.storageVolLookupByKey(self.uuid)
+            return self.driver.handles.get(
+                'volume', self.uuid, self.driver.conn.storageVolLookupByKey)
         except libvirt.libvirtError:
             logger.error("Volume not found by UUID: {}".format(self.uuid))
             return None
 
+    def _lookup_libvirt_volume(self, name):
+        # the cached handle could belong to a lost connection
+        pool = self.driver.conn.storagePoolLookupByName(
+            self.driver.storage_pool_name)
+        libvirt_volume = pool.storageVolLookupByName(name)
+        self.driver.handles.put('volume', self.uuid, libvirt_volume)
+        return libvirt_volume
+
     @retry(libvirt.libvirtError)
     def define(self):
         # Generate libvirt volume name
@@ -757,10 +1489,24 @@ class LibvirtVolume(Volume):
             backing_store_path = self.backing_store.get_path()
             backing_store_format = self.backing_store.format
 
+        # Create thin child of the cached source image instead of upload
+        base_image = None
+        if (settings.LIBVIRT_IMAGE_CACHE and self.source_image is not None and
+                not self.backing_store and self.format == 'qcow2'):
+            base_image = self.driver.image_cache.get_image(
+                self.source_image, self.format)
+            backing_store_path = base_image.path()
+            backing_store_format = self.format
+
         # Select capacity
         if self.capacity:
             # if capacity specified, use it first
             capacity = int(self.capacity * 1024 ** 3)
+            if base_image is not None:
+                # qcow2 child can't be smaller than its backing store
+                capacity = max(capacity, base_image.info()[1])
+        elif base_image is not None:
+            capacity = base_image.info()[1]
         elif self.source_image is not None:
             # limit capacity to the sorse image file size
             capacity = get_file_size(self.source_image)
@@ -787,6 +1533,7 @@ class LibvirtVolume(Volume):
 
         # Save uuid
         self.uuid = libvirt_volume.key()
+        self.driver.handles.put('volume', self.uuid, libvirt_volume)
 
         # Set serial and wwn
         if not self.serial:
@@ -797,7 +1544,7 @@ class LibvirtVolume(Volume):
         super(LibvirtVolume, self).define()
 
         # Upload predefined image to the volume
-        if self.source_image is not None:
+        if self.source_image is not None and base_image is None:
             self.upload(self.source_image, capacity)
 
     @retry(libvirt.libvirtError)
@@ -805,6 +1552,7 @@ class LibvirtVolume(Volume):
         if self.uuid:
             if self.exists():
                 self._libvirt_volume.delete(0)
+            self.driver.handles.invalidate('volume', self.uuid)
         super(LibvirtVolume, self).remove()
 
     def get_capacity(self):
@@ -823,11 +1571,20 @@ class LibvirtVolume(Volume):
         warn(msg, DeprecationWarning)
         logger.debug(msg)
 
-    @retry(libvirt.libvirtError, count=2)
-    def upload(self, path, capacity=0):
-        def chunk_render(_, _size, _fd):
-            return _fd.read(_size)
+    def upload(self, path, capacity=0, progress=None):
+        """Upload file to the volume
+
+        Buffer and segment sizes of the upload are configured with
+        LIBVIRT_UPLOAD_BUFFER_SIZE and LIBVIRT_UPLOAD_SEGMENT_SIZE
+        settings. Zero regions are sent as holes if LIBVIRT_UPLOAD_SPARSE
+        is set and libvirt supports sparse streams. Failed segments are
+        uploaded again by LibvirtVolumeUploader, the upload is never
+        restarted from the beginning.
 
+        :type path: str
+        :type capacity: int
+        :param progress: function(uploaded, total) to report progress
+        """
         size = get_file_size(path)
         current_size = self._libvirt_volume.info()[1]
 
@@ -837,13 +1594,19 @@ class LibvirtVolume(Volume):
             self._libvirt_volume.resize(size)
             self.save()
 
+        sparse = (settings.LIBVIRT_UPLOAD_SPARSE and
+                  hasattr(libvirt, 'VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM') and
+                  self.driver.get_libvirt_version() >= 3004000)
+        uploader = LibvirtVolumeUploader(
+            self._libvirt_volume,
+            buffer_size=settings.LIBVIRT_UPLOAD_BUFFER_SIZE,
+            segment_size=settings.LIBVIRT_UPLOAD_SEGMENT_SIZE,
+            sparse=sparse,
+            progress=progress,
+            lookup=functools.partial(self._lookup_libvirt_volume,
+                                     self._libvirt_volume.name()))
         with open(path, 'rb') as fd:
-            stream = self.driver.conn.newStream(0)
-            self._libvirt_volume.upload(
-                stream=stream, offset=0,
-                length=size, flags=0)
-            stream.sendAll(chunk_render, fd)
-            stream.finish()
+            uploader.upload(fd, size)
 
         if capacity > size:
             # Resize the uploaded image to specified capacity
@@ -874,6 +1637,7 @@ class LibvirtVolume(Volume):
             return True
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_STORAGE_VOL:
+                self.driver.handles.invalidate('volume', self.uuid)
                 return False
             else:
                 raise
@@ -937,7 +1701,8 @@ class LibvirtNode(Node):
     @property
     def _libvirt_node(self):
         try:
-            return self.driver.conn.lookupByUUIDString(self.uuid)
+            return self.driver.handles.get(
+                'domain', self.uuid, self.driver.conn.lookupByUUIDString)
         except libvirt.libvirtError:
             logger.error("Domain not found by UUID: {}".format(self.uuid))
             return None
@@ -967,6 +1732,7 @@ class LibvirtNode(Node):
             return True
         except libvirt.libvirtError as e:
             if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                self.driver.handles.invalidate('domain', self.uuid)
                 return False
             else:
                 raise
@@ -978,6 +1744,39 @@ class LibvirtNode(Node):
         """
         return bool(self._libvirt_node.isActive())
 
+    _domain_states = {
+        'running': (libvirt.VIR_DOMAIN_RUNNING,),
+        'paused': (libvirt.VIR_DOMAIN_PAUSED,),
+        'shutoff': (libvirt.VIR_DOMAIN_SHUTOFF,
+                    libvirt.VIR_DOMAIN_CRASHED),
+    }
+
+    def wait_for_state(self, state, timeout=60, interval=5):
+        """Wait until node comes to the state
+
+        Returns as soon as the domain lifecycle event is received.
+
+        :param state: 'running', 'paused' or 'shutoff'
+        :type timeout: int
+        :type interval: int
+        :rtype: float
+        :return: number of seconds that is left
+        """
+        if state not in self._domain_states:
+            raise DevopsError(
+                'Unknown node state {!r}, expected one of: {}'.format(
+                    state, ', '.join(sorted(self._domain_states))))
+        expected = self._domain_states[state]
+
+        def predicate():
+            return self._libvirt_node.state(0)[0] in expected
+
+        return LibvirtManager.wait_for_domain(
+            self.driver.connection_string, self.uuid, predicate,
+            timeout=timeout, interval=interval,
+            timeout_msg="Node {0} wasn't {1} in {2} sec".format(
+                self.name, state, timeout))
+
     def send_keys(self, keys):
         """Send keys to node
 
@@ -1042,10 +1841,8 @@ class LibvirtNode(Node):
                 interface_filter=filter_name,
             ))
 
-        emulator = self.driver.get_capabilities().find(
-            'guest/arch[@name="{0:>s}"]/'
-            'domain[@type="{1:>s}"]/emulator'.format(
-                self.architecture, self.hypervisor)).text
+        emulator = self.driver.get_emulator(
+            self.architecture, self.hypervisor)
         node_xml = LibvirtXMLBuilder.build_node_xml(
             name=name,
             hypervisor=self.hypervisor,
@@ -1068,7 +1865,9 @@ class LibvirtNode(Node):
             numa=self.numa,
         )
         logger.debug(node_xml)
-        self.uuid = self.driver.conn.defineXML(node_xml).UUIDString()
+        domain = self.driver.conn.defineXML(node_xml)
+        self.uuid = domain.UUIDString()
+        self.driver.handles.put('domain', self.uuid, domain)
 
         if self.cloud_init_volume_name is not None:
             self._create_cloudimage_settings_iso()
@@ -1103,6 +1902,7 @@ class LibvirtNode(Node):
                 if self._libvirt_node:
                     self._libvirt_node.undefineFlags(
                         libvirt.VIR_DOMAIN_UNDEFINE_SNAPSHOTS_METADATA)
+            self.driver.handles.invalidate('domain', self.uuid)
         super(LibvirtNode, self).remove()
 
     def suspend(self, *args, **kwargs):
@@ -1240,6 +2040,7 @@ class LibvirtNode(Node):
             snapshot.xml,
             libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_REDEFINE |
             libvirt.VIR_DOMAIN_SNAPSHOT_CREATE_CURRENT)
+        self.invalidate_snapshots()
 
     @retry(libvirt.libvirtError)
     def snapshot(self, name=None, force=False, description=None,
@@ -1318,6 +2119,8 @@ class LibvirtNode(Node):
         logger.debug(domain.state(0))
 
         domain.snapshotCreateXML(xml, create_xml_flag)
+        # parent snapshot has got a new child
+        self.invalidate_snapshots()
 
         if external:
             self.set_snapshot_current(name)
@@ -1410,6 +2213,7 @@ class LibvirtNode(Node):
                 volume_xml = volume.XMLDesc()
                 volume_pool = volume.storagePoolLookupByVolume()
                 volume.delete()
+                self.driver.handles.invalidate('volume', s_disk_data)
                 volume_pool.createXML(volume_xml)
 
     def _revert_external_snapshot(self, name=None):
@@ -1483,6 +2287,8 @@ class LibvirtNode(Node):
            revert to snapshot without childs and create new snapshot point
            when reverting to snapshots with childs.
         """
+        # snapshots could be changed outside since the last access
+        self.invalidate_snapshots()
         if self.has_snapshot(name):
             snapshot = self._get_snapshot(name)
 
@@ -1494,6 +2300,7 @@ class LibvirtNode(Node):
                 logger.info("Revert {0} ({1}) to internal snapshot {2}".format(
                     self.name, snapshot.state, name))
                 self._libvirt_node.revertToSnapshot(snapshot._snapshot, 0)
+                self.invalidate_snapshots()
 
         else:
             raise DevopsError(
@@ -1510,6 +2317,18 @@ class LibvirtNode(Node):
                                 iface.l2_network_device.name))
                 iface.unblock()
 
+    @cached_property
+    def _snapshots_cache(self):
+        """Parsed snapshots of the node by name
+
+        :rtype: dict
+        """
+        return {}
+
+    def invalidate_snapshots(self):
+        """Drop cached snapshots, must be called after snapshot tree change"""
+        self._snapshots_cache.clear()
+
     def _get_snapshot(self, name):
         """Get snapshot
 
@@ -1518,16 +2337,42 @@ class LibvirtNode(Node):
         """
         if name is None:
             return Snapshot(self._libvirt_node.snapshotCurrent(0))
-        else:
-            return Snapshot(self._libvirt_node.snapshotLookupByName(name, 0))
+        snapshot = self._snapshots_cache.get(name)
+        if snapshot is None:
+            snapshot = Snapshot(
+                self._libvirt_node.snapshotLookupByName(name, 0))
+            self._snapshots_cache[name] = snapshot
+        return snapshot
 
     def get_snapshots(self):
-        """Return full snapshots objects"""
+        """Return full snapshots objects
+
+        All snapshots are listed and parsed in one pass, number of children
+        is calculated from parent references instead of separate requests.
+
+        :rtype: list of Snapshot
+        """
         snapshots = self._libvirt_node.listAllSnapshots(0)
-        return [Snapshot(snap) for snap in snapshots]
+        xmls = [snap.getXMLDesc(0) for snap in snapshots]
+
+        children = collections.Counter()
+        for xml in xmls:
+            parent = ET.fromstring(xml).find('./parent/name')
+            if parent is not None:
+                children[parent.text] += 1
+
+        result = []
+        self.invalidate_snapshots()
+        for snap, xml in zip(snapshots, xmls):
+            snapshot = Snapshot(snap, xml=xml,
+                                children_num=children[snap.getName()])
+            self._snapshots_cache[snapshot.name] = snapshot
+            result.append(snapshot)
+        return result
 
     @retry(libvirt.libvirtError)
     def erase_snapshot(self, name):
+        self.invalidate_snapshots()
         if self.has_snapshot(name):
 
             snapshot = self._get_snapshot(name)
@@ -1546,6 +2391,7 @@ class LibvirtNode(Node):
                 self.driver.conn.defineXML(xml_tostring(xml_domain))
                 snapshot.delete_snapshot_files()
                 snapshot.delete(2)
+                self.invalidate_snapshots()
 
                 for disk in self.disk_devices:
                     if disk.device == 'disk':
@@ -1558,6 +2404,7 @@ class LibvirtNode(Node):
             else:
                 # ORIGINAL DELETE
                 snapshot.delete(0)
+                self.invalidate_snapshots()
 
     def set_vcpu(self, vcpu):
         """Set vcpu count on node
@@ -1596,25 +2443,24 @@ class LibvirtNode(Node):
         if target is not None:
             return target.get('dev')
 
-    def attach_volume(self, volume, device='disk', type='file',
-                      bus='virtio', target_dev=None):
-        """Attach volume to node
+    def build_disk_devices(self, volume, disk_names, device='disk',
+                           type='file', bus='virtio', target_dev=None):
+        """Build disk devices attaching the volume, without saving them
+
+        Multipath volume is attached by multipath_count scsi disks.
 
-        :rtype : DiskDevice
+        :rtype: list of DiskDevice
         """
-        cls = self.driver.get_model_class('DiskDevice')
+        if not volume.multipath_count:
+            return super(LibvirtNode, self).build_disk_devices(
+                volume, disk_names, device=device, type=type, bus=bus,
+                target_dev=target_dev)
 
-        if volume.multipath_count:
-            for _ in range(volume.multipath_count):
-                cls.objects.create(
-                    device=device, type=type, bus='scsi',
-                    target_dev=target_dev or self.next_disk_name(),
+        cls = self.driver.get_model_class('DiskDevice')
+        return [cls(device=device, type=type, bus='scsi',
+                    target_dev=target_dev or next(disk_names, None),
                     volume=volume, node=self)
-        else:
-            return cls.objects.create(
-                device=device, type=type, bus=bus,
-                target_dev=target_dev or self.next_disk_name(),
-                volume=volume, node=self)
+                for _ in range(volume.multipath_count)]
 
     def set_boot(self, boot):
         """Set boot order on node
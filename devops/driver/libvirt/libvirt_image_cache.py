@@ -0,0 +1,308 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import hashlib
+import json
+import os
+import time
+import xml.etree.ElementTree as ET
+
+import libvirt
+
+from devops.driver.libvirt.libvirt_volume_upload import LibvirtVolumeUploader
+from devops.driver.libvirt.libvirt_xml_builder import LibvirtXMLBuilder
+from devops.error import TimeoutError
+from devops.helpers.file_lock import FileLock
+from devops import logger
+
+
+CachedImage = collections.namedtuple(
+    'CachedImage', ['name', 'path', 'capacity', 'allocation', 'refcount',
+                    'last_used'])
+
+
+class LibvirtImageCache(object):
+    """Content-addressed cache of base images in a storage pool
+
+    Every source image is uploaded to the pool once, to a read-only volume
+    named by sha256 of the image content. Volumes created from the same
+    image are thin qcow2 children of the cached volume.
+
+    Number of references to a cached image is the number of volumes in the
+    pool which use it as a backing store. Images without references are
+    removed in LRU order when free space of the pool drops below
+    min_free percent of its capacity.
+
+    Image digests and usage times are stored in the index file in cache_dir,
+    all changes of the index and of the cached volumes are serialized by
+    file locks in the same directory.
+    """
+
+    PREFIX = 'devops_image_'
+
+    # permissions of the cached volumes
+    MODE = '0444'
+
+    def __init__(self, conn, pool_name, cache_dir, min_free=10,
+                 upload_kwargs=None):
+        """Image cache
+
+        :type conn: libvirt.virConnect
+        :type pool_name: str
+        :param cache_dir: directory for the index and lock files
+        :param min_free: minimal free space of the pool, in percents
+        :param upload_kwargs: arguments of LibvirtVolumeUploader
+        """
+        self.conn = conn
+        self.pool_name = pool_name
+        self.cache_dir = cache_dir
+        self.min_free = min_free
+        self.upload_kwargs = upload_kwargs or {}
+
+    @property
+    def pool(self):
+        return self.conn.storagePoolLookupByName(self.pool_name)
+
+    @property
+    def index_path(self):
+        return os.path.join(self.cache_dir, 'index.json')
+
+    def _lock(self, name='index', timeout=None):
+        return FileLock(os.path.join(self.cache_dir, name + '.lock'),
+                        timeout=timeout)
+
+    def _image_key(self, name):
+        return '{0} {1} {2}'.format(self.conn.getURI(), self.pool_name, name)
+
+    def _read_index(self):
+        try:
+            with open(self.index_path) as f:
+                index = json.load(f)
+        except (IOError, ValueError):
+            index = {}
+        index.setdefault('digests', {})
+        index.setdefault('images', {})
+        return index
+
+    def _update_index(self, update):
+        """Apply function to the index under the lock and save it"""
+        with self._lock():
+            index = self._read_index()
+            result = update(index)
+            tmp_path = self.index_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(index, f, indent=1, sort_keys=True)
+            os.rename(tmp_path, self.index_path)
+        return result
+
+    def digest(self, path):
+        """Get sha256 of the file content
+
+        Digest is calculated once for every version of the file, versions
+        are distinguished by size and modification time.
+
+        :type path: str
+        :rtype: str
+        """
+        path = os.path.realpath(path)
+        stat = os.stat(path)
+        version = [stat.st_size, stat.st_mtime]
+        cached = self._read_index()['digests'].get(path)
+        if cached and cached[:2] == version:
+            return cached[2]
+
+        logger.info('Calculating checksum of {0}'.format(path))
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for data in iter(lambda: f.read(4 * 1024 ** 2), b''):
+                sha.update(data)
+        digest = sha.hexdigest()
+
+        def update(index):
+            index['digests'][path] = version + [digest]
+
+        self._update_index(update)
+        return digest
+
+    def image_name(self, digest, vol_format):
+        return '{0}{1}_{2}'.format(self.PREFIX, digest[:32], vol_format)
+
+    def _lookup(self, name):
+        try:
+            return self.pool.storageVolLookupByName(name)
+        except libvirt.libvirtError:
+            return None
+
+    def get_image(self, source_image, vol_format='qcow2'):
+        """Get cached volume with the image, upload it if required
+
+        :type source_image: str
+        :type vol_format: str
+        :rtype: libvirt.virStorageVol
+        """
+        name = self.image_name(self.digest(source_image), vol_format)
+        key = self._image_key(name)
+
+        with self._lock(name):
+            volume = self._lookup(name)
+            if volume is not None:
+                complete = self._read_index()['images'].get(
+                    key, {}).get('complete')
+                if complete or self.refcounts().get(volume.path()):
+                    logger.debug('Using cached image {0} for {1}'.format(
+                        name, source_image))
+                    self._touch(key)
+                    return volume
+                # upload has been interrupted
+                logger.warning('Removing incomplete cached image {0}'.format(
+                    name))
+                volume.delete(0)
+
+            size = os.stat(source_image).st_size
+            self.evict(required=size)
+            volume = self._upload(name, source_image, size, vol_format)
+            self._touch(key, complete=True)
+            return volume
+
+    def _upload(self, name, source_image, size, vol_format):
+        logger.info('Uploading {0} to image cache as {1}'.format(
+            source_image, name))
+        xml = LibvirtXMLBuilder.build_volume_xml(
+            name=name,
+            capacity=size,
+            vol_format=vol_format,
+            backing_store_path=None,
+            backing_store_format=None,
+            mode=self.MODE,
+        )
+        pool = self.pool
+        volume = pool.createXML(xml, 0)
+        try:
+            uploader = LibvirtVolumeUploader(volume, **self.upload_kwargs)
+            with open(source_image, 'rb') as fd:
+                uploader.upload(fd, size)
+        except Exception:
+            volume.delete(0)
+            raise
+        # update capacity of the volume from the image header
+        pool.refresh(0)
+        return self._lookup(name)
+
+    def _touch(self, key, complete=None):
+        def update(index):
+            image = index['images'].setdefault(key, {})
+            image['last_used'] = time.time()
+            if complete is not None:
+                image['complete'] = complete
+
+        self._update_index(update)
+
+    def refcounts(self):
+        """Count volumes which use cached images as backing store
+
+        :rtype: dict
+        :return: path of the backing store -> number of volumes
+        """
+        counts = collections.defaultdict(int)
+        for volume in self.pool.listAllVolumes(0):
+            try:
+                xml = ET.fromstring(volume.XMLDesc(0))
+            except libvirt.libvirtError:
+                # volume has been removed in the meantime
+                continue
+            path = xml.findtext('backingStore/path')
+            if path:
+                counts[path] += 1
+        return counts
+
+    def list_images(self):
+        """List cached images
+
+        :rtype: list of CachedImage
+        """
+        images = self._read_index()['images']
+        refcounts = self.refcounts()
+        result = []
+        for volume in self.pool.listAllVolumes(0):
+            name = volume.name()
+            if not name.startswith(self.PREFIX):
+                continue
+            path = volume.path()
+            _, capacity, allocation = volume.info()
+            result.append(CachedImage(
+                name=name, path=path, capacity=capacity,
+                allocation=allocation, refcount=refcounts.get(path, 0),
+                last_used=images.get(
+                    self._image_key(name), {}).get('last_used', 0)))
+        return result
+
+    def evict(self, required=0):
+        """Remove unused images until the pool has enough free space
+
+        :param required: number of bytes which will be allocated
+        :rtype: list
+        :return: names of removed images
+        """
+        pool = self.pool
+        pool.refresh(0)
+        _, capacity, _, available = pool.info()
+        min_available = capacity * self.min_free // 100 + required
+        if available >= min_available:
+            return []
+
+        started = time.time()
+        removed = []
+        unused = [image for image in self.list_images() if image.refcount == 0]
+        for image in sorted(unused, key=lambda i: i.last_used):
+            if available >= min_available:
+                break
+            # get_image() calls evict() holding the lock of another image,
+            # so waiting for the lock could deadlock with other processes
+            lock = self._lock(image.name, timeout=0)
+            try:
+                lock.acquire()
+            except TimeoutError:
+                logger.debug('Cached image {0} is locked, skipping'.format(
+                    image.name))
+                continue
+            try:
+                volume = self._lookup(image.name)
+                last_used = self._read_index()['images'].get(
+                    self._image_key(image.name), {}).get('last_used', 0)
+                # image could be taken by another process
+                if (volume is None or last_used > started or
+                        self.refcounts().get(image.path)):
+                    continue
+                logger.info('Evicting cached image {0} ({1} bytes)'.format(
+                    image.name, image.allocation))
+                volume.delete(0)
+            finally:
+                lock.release()
+            available += image.allocation
+            removed.append(image.name)
+
+        if removed:
+            key_names = set(self._image_key(name) for name in removed)
+
+            def update(index):
+                for key in key_names:
+                    index['images'].pop(key, None)
+
+            self._update_index(update)
+        if available < min_available:
+            logger.warning(
+                'Storage pool {0} has {1} bytes available, {2} bytes '
+                'required'.format(self.pool_name, available, min_available))
+        return removed
@@ -0,0 +1,178 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import time
+
+import libvirt
+
+from devops import logger
+
+
+class LibvirtVolumeUploader(object):
+    """Upload file data to libvirt storage volume
+
+    The file is sent in segments, every segment is a separate upload
+    stream which is finished before the next one is started. Failed
+    segment is uploaded again from its offset, so transient errors don't
+    restart the whole upload. Before the retry the volume is looked up
+    again, because the handle belongs to a connection which could be
+    lost.
+
+    Data is read with large buffers and sent by chunks which fit into
+    a single libvirt stream message. If sparse streams are enabled, chunks
+    filled with zeros are sent as holes.
+    """
+
+    # maximum payload of a libvirt stream message
+    CHUNK_SIZE = 256 * 1024 - 24
+
+    def __init__(self, volume, buffer_size=4 * 1024 ** 2,
+                 segment_size=1024 ** 3, sparse=False, retries=3,
+                 progress=None, progress_interval=30, lookup=None):
+        """Volume uploader
+
+        :type volume: libvirt.virStorageVol
+        :param buffer_size: size of data read from the file at once
+        :param segment_size: size of data sent by one upload stream,
+                             0 to send the whole file in one stream
+        :param sparse: send zero chunks as holes, requires libvirt >= 3.4.0
+        :param retries: number of attempts to upload failed segment again
+        :param progress: function(uploaded, total) to call after every
+                         sent buffer
+        :param progress_interval: seconds between progress log messages
+        :param lookup: function() returning a new handle of the volume
+                       on an alive connection, called before a failed
+                       segment is uploaded again
+        """
+        self.volume = volume
+        self.buffer_size = max(int(buffer_size), self.CHUNK_SIZE)
+        self.segment_size = int(segment_size)
+        self.sparse = sparse
+        self.retries = retries
+        self.progress = progress
+        self.progress_interval = progress_interval
+        self.lookup = lookup
+        self.flags = 0
+        if sparse:
+            self.flags = libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM
+        self._zeros = b'\0' * self.CHUNK_SIZE
+        self._total = 0
+        self._uploaded = 0
+        self._holes = 0
+        self._started = None
+        self._reported = None
+
+    def upload(self, fd, size, offset=0):
+        """Upload data from file object to the volume
+
+        Upload stops at the end of file even if it is less than size.
+
+        :param fd: file object opened in binary mode
+        :param size: number of bytes to upload
+        :param offset: position in file and in volume to start from
+        :rtype: int
+        :return: number of uploaded bytes
+        """
+        self._total = size
+        self._uploaded = 0
+        self._holes = 0
+        self._started = self._reported = time.time()
+
+        end = offset + size
+        while offset < end:
+            length = end - offset
+            if self.segment_size:
+                length = min(length, self.segment_size)
+            sent = self._upload_segment(fd, offset, length)
+            offset += sent
+            if sent < length:
+                # end of file
+                break
+
+        spent = max(time.time() - self._started, 0.001)
+        logger.debug(
+            'Uploaded {0} bytes ({1} bytes as holes) to {2} in {3:0.3f}s, '
+            '{4:0.1f} MiB/s'.format(
+                self._uploaded, self._holes, self.volume.name(), spent,
+                self._uploaded / spent / 1024 ** 2))
+        return self._uploaded
+
+    def _upload_segment(self, fd, offset, length):
+        uploaded = self._uploaded
+        attempt = 0
+        while True:
+            stream = None
+            try:
+                if attempt and self.lookup is not None:
+                    self.volume = self.lookup()
+                stream = self.volume.connect().newStream(0)
+                fd.seek(offset)
+                self.volume.upload(stream=stream, offset=offset,
+                                   length=length, flags=self.flags)
+                sent = self._send(stream, fd, length)
+                stream.finish()
+                return sent
+            except libvirt.libvirtError:
+                if stream is not None:
+                    try:
+                        stream.abort()
+                    except libvirt.libvirtError:
+                        pass
+                attempt += 1
+                if attempt > self.retries:
+                    raise
+                logger.warning(
+                    'Upload to {0} failed at offset {1}, retrying from '
+                    'offset {2} ({3}/{4})'.format(
+                        self.volume.name(), offset + self._uploaded - uploaded,
+                        offset, attempt, self.retries))
+                self._uploaded = uploaded
+
+    def _send(self, stream, fd, length):
+        left = length
+        while left > 0:
+            data = fd.read(min(self.buffer_size, left))
+            if not data:
+                break
+            left -= len(data)
+            for pos in range(0, len(data), self.CHUNK_SIZE):
+                chunk = data[pos:pos + self.CHUNK_SIZE]
+                if self.sparse and self._is_zero(chunk):
+                    stream.sendHole(len(chunk), 0)
+                    self._holes += len(chunk)
+                else:
+                    stream.send(chunk)
+            self._uploaded += len(data)
+            self._report()
+        return length - left
+
+    def _is_zero(self, chunk):
+        if len(chunk) == self.CHUNK_SIZE:
+            return chunk == self._zeros
+        return chunk == self._zeros[:len(chunk)]
+
+    def _report(self):
+        if self.progress is not None:
+            self.progress(self._uploaded, self._total)
+
+        now = time.time()
+        if now - self._reported < self.progress_interval:
+            return
+        self._reported = now
+        logger.info(
+            'Uploading to {0}: {1}% ({2} of {3} MiB), {4:0.1f} MiB/s'.format(
+                self.volume.name(),
+                self._uploaded * 100 // max(self._total, 1),
+                self._uploaded // 1024 ** 2, self._total // 1024 ** 2,
+                self._uploaded / max(now - self._started, 0.001) / 1024 ** 2))
@@ -92,7 +92,7 @@ class LibvirtXMLBuilder(object):
 
     @classmethod
     def build_volume_xml(cls, name, capacity, vol_format, backing_store_path,
-                         backing_store_format):
+                         backing_store_format, mode='0644'):
         """Generate volume XML
 
         :type volume: Volume
@@ -103,7 +103,7 @@ class LibvirtXMLBuilder(object):
         volume_xml.capacity(str(capacity))
         with volume_xml.target:
             volume_xml.format(type=vol_format)
-            volume_xml.permissions.mode("0644")
+            volume_xml.permissions.mode(mode)
         if backing_store_path:
             with volume_xml.backingStore:
                 volume_xml.path(backing_store_path)
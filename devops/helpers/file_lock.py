@@ -0,0 +1,101 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import absolute_import
+
+import errno
+import fcntl
+import os
+import time
+
+from devops.error import TimeoutError
+
+
+class FileLock(object):
+    """Exclusive advisory lock on a file
+
+    The lock is shared by all processes on the host which use the same
+    path, and it also serializes threads of one process because every
+    acquire() opens the file again. The lock file is created if it
+    doesn't exist and is never removed.
+
+    Example of usage::
+
+        with FileLock('/tmp/devops.lock', timeout=60):
+            ...
+    """
+
+    def __init__(self, path, timeout=None, interval=0.1):
+        """File lock
+
+        :type path: str
+        :param timeout: seconds to wait for the lock, None to wait forever
+        :param interval: seconds between attempts to take the lock
+        """
+        self.path = path
+        self.timeout = timeout
+        self.interval = interval
+        self._fd = None
+
+    @property
+    def locked(self):
+        return self._fd is not None
+
+    def acquire(self):
+        """Take the lock
+
+        :raises: TimeoutError if the lock wasn't taken in timeout seconds
+        """
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        start = time.time()
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except (IOError, OSError) as e:
+                if e.errno not in (errno.EAGAIN, errno.EACCES):
+                    os.close(fd)
+                    raise
+            if (self.timeout is not None and
+                    time.time() - start >= self.timeout):
+                os.close(fd)
+                raise TimeoutError(
+                    'Failed to lock {0} in {1}s'.format(
+                        self.path, self.timeout))
+            time.sleep(self.interval)
+        self._fd = fd
+
+    def release(self):
+        if self._fd is None:
+            return
+        fd, self._fd = self._fd, None
+        try:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
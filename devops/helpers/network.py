@@ -11,28 +11,116 @@
 #    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
 #    License for the specific language governing permissions and limitations
 #    under the License.
-from netaddr import IPSet
+import bisect
+
+from netaddr import IPAddress
+from netaddr import IPNetwork
+from netaddr import IPRange
+
+
+class AllocatedNetworks(object):
+    """Allocated IP space as sorted non-overlapping ranges
+
+    Ranges are kept per IP version as sorted lists of their first and last
+    addresses, so an overlap is found by binary search.
+    """
+
+    def __init__(self, networks=None):
+        # {version: ([first, ...], [last, ...])}
+        self._ranges = {}
+        for network in networks or []:
+            self.add(network)
+
+    def _get_ranges(self, version):
+        return self._ranges.setdefault(version, ([], []))
+
+    def add(self, network):
+        """Mark the network as allocated
+
+        :type network: IPNetwork
+        """
+        network = IPNetwork(network)
+        starts, ends = self._get_ranges(network.version)
+        first = network.first
+        last = network.last
+        # merge with overlapping and adjacent ranges
+        i = bisect.bisect_left(ends, first - 1)
+        j = bisect.bisect_right(starts, last + 1)
+        if i < j:
+            first = min(first, starts[i])
+            last = max(last, ends[j - 1])
+        starts[i:j] = [first]
+        ends[i:j] = [last]
+
+    def find_overlap(self, version, first, last):
+        """Find allocated range overlapping the range of addresses
+
+        :param version: IP version
+        :param first: int, first address of the range
+        :param last: int, last address of the range
+        :return: int, last address of the overlapping range, or None
+        """
+        starts, ends = self._get_ranges(version)
+        i = bisect.bisect_left(ends, first)
+        if i < len(starts) and starts[i] <= last:
+            return ends[i]
+        return None
+
+    def overlaps(self, network):
+        """Check if the network overlaps allocated ones
+
+        :type network: IPNetwork
+        :rtype: bool
+        """
+        return self.find_overlap(
+            network.version, network.first, network.last) is not None
+
+    def __repr__(self):
+        return "{}({})".format(self.__class__.__name__, [
+            IPRange(IPAddress(first, version), IPAddress(last, version))
+            for version, (starts, ends) in sorted(self._ranges.items())
+            for first, last in zip(starts, ends)])
 
 
 class IpNetworksPool(object):
+    """Subnets of the networks which don't overlap allocated networks
+
+    allocated_networks could be an AllocatedNetworks object shared by
+    several pools, networks allocated by allocate() are skipped by all
+    of them.
+    """
 
     def __init__(self, networks, prefix, allocated_networks=None):
-        if allocated_networks is None:
-            allocated_networks = []
+        if not isinstance(allocated_networks, AllocatedNetworks):
+            allocated_networks = AllocatedNetworks(allocated_networks)
 
         self.networks = networks
         self.prefix = prefix
         self.allocated_networks = allocated_networks
 
-    @staticmethod
-    def _overlaps(network, allocated_networks):
-        return any((IPSet(network) & IPSet(an)) for an in allocated_networks)
+    def allocate(self, network):
+        """Mark the network as allocated
+
+        :type network: IPNetwork
+        """
+        self.allocated_networks.add(network)
 
     def __iter__(self):
         for network in self.networks:
-            for sub_net in network.subnet(prefixlen=self.prefix):
-                if not self._overlaps(sub_net, self.allocated_networks):
-                    yield sub_net
+            if self.prefix < network.prefixlen:
+                continue
+            size = network.size >> (self.prefix - network.prefixlen)
+            first = network.first
+            while first + size - 1 <= network.last:
+                allocated_last = self.allocated_networks.find_overlap(
+                    network.version, first, first + size - 1)
+                if allocated_last is None:
+                    yield IPNetwork('{0}/{1}'.format(
+                        IPAddress(first, network.version), self.prefix))
+                    first += size
+                else:
+                    # skip subnets overlapping the allocated range
+                    first += ((allocated_last - first) // size + 1) * size
 
     def __repr__(self):
         return "{}(networks={}, prefix={}, allocated_networks={})".format(
@@ -0,0 +1,251 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import unicode_literals
+
+import collections
+import sys
+from threading import Condition
+from threading import Thread
+import time
+
+from django.db import connections
+import six
+
+from devops.error import DevopsError
+from devops import logger
+
+
+class _Task(object):
+    __slots__ = ['key', 'phase', 'func', 'args', 'kwargs', 'deps',
+                 'dependents', 'started', 'finished']
+
+    def __init__(self, key, phase, func, args, kwargs, deps):
+        self.key = key
+        self.phase = phase
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.deps = deps
+        self.dependents = []
+        self.started = None
+        self.finished = None
+
+    def __call__(self):
+        self.started = time.time()
+        try:
+            return self.func(*self.args, **self.kwargs)
+        finally:
+            self.finished = time.time()
+
+
+class TaskGraph(object):
+    """Dependency-aware executor for environment-wide operations
+
+    Tasks are identified by a hashable key and may depend on other tasks
+    from the same graph. A task is started only after all its dependencies
+    have been completed, independent tasks are executed concurrently by a
+    bounded pool of worker threads.
+
+    Dependencies on keys which are not registered in the graph are ignored:
+    the corresponding objects are considered to be already processed.
+
+    Each task belongs to a named phase (e.g. 'networks', 'volumes',
+    'domains'); wall-clock time of every phase is logged after the run
+    and available in :attr:`timings`, time spent by every task is
+    available in :attr:`durations`.
+
+    Example of usage::
+
+        graph = TaskGraph(workers=4)
+        graph.add('net', net.define, phase='networks')
+        graph.add('vol', vol.define, phase='volumes')
+        graph.add('node', node.define, phase='domains',
+                  deps=['net', 'vol'])
+        graph.run()
+    """
+
+    def __init__(self, workers=1, serial=False):
+        """Task graph
+
+        :type workers: int
+        :param workers: maximum number of concurrently executed tasks
+        :type serial: bool
+        :param serial: execute all tasks one by one in the current thread
+        """
+        self.workers = max(1, int(workers))
+        self.serial = serial or self.workers == 1
+        self.timings = collections.OrderedDict()
+        self.durations = collections.OrderedDict()
+        self.__tasks = collections.OrderedDict()
+
+    @classmethod
+    def from_settings(cls):
+        """Create graph configured with PARALLEL_* settings
+
+        :rtype: TaskGraph
+        """
+        from django.conf import settings
+        return cls(workers=settings.PARALLEL_WORKERS,
+                   serial=settings.PARALLEL_SERIAL_MODE)
+
+    def __contains__(self, key):
+        return key in self.__tasks
+
+    def __iter__(self):
+        return iter(self.__tasks)
+
+    def __len__(self):
+        return len(self.__tasks)
+
+    def add(self, key, func, phase='default', deps=None, args=(),
+            kwargs=None):
+        """Register task in the graph
+
+        Task with already registered key is not added twice.
+
+        :type key: hashable
+        :type func: callable
+        :type phase: str
+        :type deps: list
+        :type args: tuple
+        :type kwargs: dict
+        :rtype: bool
+        :return: True if the task has been added
+        """
+        if key in self.__tasks:
+            return False
+        self.__tasks[key] = _Task(
+            key=key, phase=phase, func=func, args=args, kwargs=kwargs or {},
+            deps=list(deps or []))
+        return True
+
+    def _link(self):
+        """Resolve dependencies and return number of unfinished deps"""
+        pending = {}
+        for task in self.__tasks.values():
+            task.dependents = []
+        for task in self.__tasks.values():
+            deps = [dep for dep in set(task.deps) if dep in self.__tasks]
+            pending[task.key] = len(deps)
+            for dep in deps:
+                self.__tasks[dep].dependents.append(task)
+        return pending
+
+    def run(self):
+        """Execute all registered tasks
+
+        :raises: DevopsError if dependencies could not be resolved,
+                 the first exception raised by a task otherwise
+        """
+        if not self.__tasks:
+            return
+        pending = self._link()
+        if self.serial:
+            self.__run_serial(pending)
+        else:
+            self.__run_parallel(pending)
+        self.__collect_timings()
+
+    def __run_serial(self, pending):
+        remaining = list(self.__tasks.values())
+        while remaining:
+            for task in remaining:
+                if pending[task.key] == 0:
+                    break
+            else:
+                raise DevopsError(
+                    'Circular dependency between tasks: {}'.format(
+                        ', '.join(repr(t.key) for t in remaining)))
+            remaining.remove(task)
+            task()
+            for dependent in task.dependents:
+                pending[dependent.key] -= 1
+
+    def __run_parallel(self, pending):
+        cond = Condition()
+        ready = collections.deque(
+            t for t in self.__tasks.values() if pending[t.key] == 0)
+        state = {'running': 0, 'left': len(self.__tasks), 'error': None}
+
+        def worker():
+            try:
+                while True:
+                    with cond:
+                        while (not ready and state['running'] and
+                               state['error'] is None):
+                            cond.wait()
+                        if state['error'] is not None or not ready:
+                            cond.notify_all()
+                            return
+                        task = ready.popleft()
+                        state['running'] += 1
+                    try:
+                        task()
+                    except Exception:
+                        with cond:
+                            if state['error'] is None:
+                                state['error'] = sys.exc_info()
+                            state['running'] -= 1
+                            cond.notify_all()
+                        return
+                    with cond:
+                        state['running'] -= 1
+                        state['left'] -= 1
+                        for dependent in task.dependents:
+                            pending[dependent.key] -= 1
+                            if pending[dependent.key] == 0:
+                                ready.append(dependent)
+                        cond.notify_all()
+            finally:
+                # each thread has its own db connection
+                connections.close_all()
+
+        threads = []
+        for num in range(min(self.workers, len(self.__tasks))):
+            thread = Thread(target=worker,
+                            name='TaskGraph worker {}'.format(num))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+
+        if state['error'] is not None:
+            six.reraise(*state['error'])
+        if state['left']:
+            raise DevopsError(
+                'Circular dependency between tasks: {}'.format(
+                    ', '.join(repr(t.key) for t in self.__tasks.values()
+                              if t.finished is None)))
+
+    def __collect_timings(self):
+        phases = collections.OrderedDict()
+        for task in self.__tasks.values():
+            if task.started is None or task.finished is None:
+                continue
+            self.durations[task.key] = task.finished - task.started
+            start, end, count = phases.get(
+                task.phase, (task.started, task.finished, 0))
+            phases[task.phase] = (min(start, task.started),
+                                  max(end, task.finished),
+                                  count + 1)
+        for phase, (start, end, count) in phases.items():
+            self.timings[phase] = end - start
+            logger.info(
+                "Phase '{phase}': {count} task(s) done in {spent:0.3f}s "
+                "({mode})".format(
+                    phase=phase, count=count, spent=end - start,
+                    mode='serial' if self.serial else
+                    '{} workers'.format(self.workers)))
@@ -0,0 +1,78 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+
+class QueryCounter(object):
+    """Count database queries executed inside of the block
+
+    Queries of the connections of the current thread and of connections
+    opened by other threads inside of the block (e.g. by workers of
+    TaskGraph) are counted. Connections are switched to the debug cursor
+    which logs queries, so the counter is limited by queries_limit of
+    the connection (9000 by default).
+
+    .. code-block::
+
+        with QueryCounter() as counter:
+            env.define()
+        print(counter.count)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tracked = []
+        self._count = None
+
+    def _track(self, connection):
+        with self._lock:
+            if any(conn is connection for conn, _, _ in self._tracked):
+                return
+            self._tracked.append((connection, len(connection.queries_log),
+                                  connection.force_debug_cursor))
+            connection.force_debug_cursor = True
+
+    def _on_connection_created(self, sender, connection, **kwargs):
+        self._track(connection)
+
+    @property
+    def count(self):
+        """Number of queries executed so far
+
+        :rtype: int
+        """
+        if self._count is not None:
+            return self._count
+        with self._lock:
+            return sum(len(conn.queries_log) - start
+                       for conn, start, _ in self._tracked)
+
+    def __enter__(self):
+        self._count = None
+        for connection in connections.all():
+            self._track(connection)
+        connection_created.connect(self._on_connection_created)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        connection_created.disconnect(self._on_connection_created)
+        self._count = self.count
+        with self._lock:
+            for connection, _, force_debug_cursor in self._tracked:
+                connection.force_debug_cursor = force_debug_cursor
+            self._tracked = []
@@ -15,23 +15,38 @@
 from __future__ import unicode_literals
 
 import base64
+import collections
+from contextlib import closing
+import functools
 import os
 import posixpath
+import select
 import stat
-from sys import getrefcount
+import tarfile
 from threading import RLock
+from threading import Thread
+import time
 from warnings import warn
 
+import netaddr
 import paramiko
 import six
+# noinspection PyUnresolvedReferences
+from six.moves import shlex_quote
 
 from devops.error import DevopsCalledProcessError
+from devops.error import DevopsNotImplementedError
 from devops.error import TimeoutError
 from devops.helpers.exec_result import ExecResult
 from devops.helpers.proc_enums import ExitCodes
 from devops.helpers.retry import retry
 from devops import logger
 
+try:
+    import asyncio
+except ImportError:  # python 2.7
+    asyncio = None
+
 
 class SSHAuth(object):
     __slots__ = ['__username', '__password', '__key', '__keys']
@@ -208,6 +223,16 @@ class _MemorizedSSH(type):
         cmd1 = "cd <some dir> && <command1>"
         cmd2 = "cd <some dir> && <command2>"
 
+    Cache is limited by SSHClient.cache_max_size connections, least recently
+      requested are removed first. Connections not requested during
+      SSHClient.cache_idle_timeout seconds are removed too.
+      Removed connection is closed, when it is not referenced anymore.
+      Connection requested during SSHClient.cache_check_interval seconds
+      after previous request is not checked for alive.
+
+    Cache is thread-safe: connections to different hosts are opened in
+      parallel, only one connection to the same host and port is opened.
+
     Close cached connections is allowed per-client and all stored:
       connection will be closed, but still stored in cache for faster reconnect
 
@@ -215,7 +240,11 @@ class _MemorizedSSH(type):
       from this moment all open connections should be managed manually,
       duplicates is possible.
     """
-    __cache = {}
+    __cache = collections.OrderedDict()  # least recently used first
+    __last_used = {}
+    __key_locks = {}
+    __lock = RLock()
+    __stats = collections.Counter()
 
     def __call__(
             cls,
@@ -233,32 +262,87 @@ class _MemorizedSSH(type):
         :type auth: SSHAuth
         :rtype: SSHClient
         """
-        if (host, port) in cls.__cache:
-            key = host, port
+        key = host, port
+        with cls.__lock:
+            key_lock = cls.__key_locks.setdefault(key, RLock())
+        with key_lock:
             if auth is None:
-                auth = SSHAuth(
+                cached_auth = SSHAuth(
                     username=username, password=password, keys=private_keys)
-            if hash((cls, host, port, auth)) == hash(cls.__cache[key]):
-                ssh = cls.__cache[key]
-                # noinspection PyBroadException
-                try:
-                    ssh.execute('cd ~', timeout=5)
-                except BaseException:  # Note: Do not change to lower level!
-                    logger.debug('Reconnect {}'.format(ssh))
-                    ssh.reconnect()
+            else:
+                cached_auth = auth
+            ssh, idle = cls.__get_cached(
+                key, hash((cls, host, port, cached_auth)))
+            if ssh is not None:
+                if idle >= ssh.cache_check_interval or not ssh.is_alive:
+                    # Note: Do not change BaseException to lower level!
+                    # noinspection PyBroadException
+                    try:
+                        ssh.execute('cd ~', timeout=5)
+                    except BaseException:
+                        logger.debug('Reconnect {}'.format(ssh))
+                        ssh.reconnect()
+                        cls.__count('reconnects')
+                cls.__count('reuses')
                 return ssh
-            if getrefcount(cls.__cache[key]) == 2:
-                # If we have only cache reference and temporary getrefcount
-                # reference: close connection before deletion
-                logger.debug('Closing {} as unused'.format(cls.__cache[key]))
-                cls.__cache[key].close()
-            del cls.__cache[key]
-        # noinspection PyArgumentList
-        return super(
-            _MemorizedSSH, cls).__call__(
-            host=host, port=port,
-            username=username, password=password, private_keys=private_keys,
-            auth=auth)
+            # noinspection PyArgumentList
+            return super(
+                _MemorizedSSH, cls).__call__(
+                host=host, port=port,
+                username=username, password=password,
+                private_keys=private_keys, auth=auth)
+
+    def __get_cached(cls, key, ssh_hash):
+        """Get cached connection and seconds since its previous request
+
+        :type key: tuple
+        :type ssh_hash: int
+        :rtype: tuple
+        """
+        with cls.__lock:
+            _MemorizedSSH.__expire()
+            if key not in cls.__cache:
+                return None, None
+            if ssh_hash != hash(cls.__cache[key]):
+                _MemorizedSSH.__remove(key, 'credentials changed')
+                return None, None
+            ssh = cls.__cache.pop(key)
+            cls.__cache[key] = ssh
+            now = time.time()
+            idle = now - cls.__last_used[key]
+            cls.__last_used[key] = now
+            return ssh, idle
+
+    @classmethod
+    def __remove(mcs, key, reason):
+        """Remove connection from cache
+
+        Connection is closed by SSHClient destructor, when other
+        references are released.
+        """
+        logger.debug('Removing {} from cache: {}'.format(
+            mcs.__cache[key], reason))
+        del mcs.__cache[key]
+        del mcs.__last_used[key]
+        mcs.__stats['evictions'] += 1
+
+    @classmethod
+    def __expire(mcs):
+        """Remove idle connections and least recently used over max size"""
+        now = time.time()
+        for key, ssh in list(mcs.__cache.items()):
+            if now - mcs.__last_used[key] > ssh.cache_idle_timeout:
+                mcs.__remove(key, 'idle')
+        while mcs.__cache:
+            ssh = next(iter(mcs.__cache.values()))
+            if len(mcs.__cache) <= ssh.cache_max_size:
+                break
+            mcs.__remove((ssh.hostname, ssh.port), 'cache is full')
+
+    @classmethod
+    def __count(mcs, name, value=1):
+        with mcs.__lock:
+            mcs.__stats[name] += value
 
     @classmethod
     def record(mcs, ssh):
@@ -266,36 +350,307 @@ class _MemorizedSSH(type):
 
         :type ssh: SSHClient
         """
-        mcs.__cache[(ssh.hostname, ssh.port)] = ssh
+        key = ssh.hostname, ssh.port
+        with mcs.__lock:
+            mcs.__cache.pop(key, None)
+            mcs.__cache[key] = ssh
+            mcs.__last_used[key] = time.time()
+            mcs.__expire()
+
+    @classmethod
+    def record_connect(mcs, duration):
+        """Count connection open
+
+        :param duration: seconds spent to connect
+        """
+        with mcs.__lock:
+            mcs.__stats['connects'] += 1
+            mcs.__stats['connect_time'] += duration
+
+    @classmethod
+    def stats(mcs):
+        """Cache counters
+
+        :rtype: dict
+        """
+        with mcs.__lock:
+            stats = dict.fromkeys(
+                ('connects', 'connect_time', 'reconnects', 'reuses',
+                 'evictions'), 0)
+            stats.update(mcs.__stats)
+            stats['size'] = len(mcs.__cache)
+            return stats
 
     @classmethod
     def clear_cache(mcs):
-        """Clear cached connections for initialize new instance on next call"""
-        n_count = 3 if six.PY3 else 4
-        # PY3: cache, ssh, temporary
-        # PY4: cache, values mapping, ssh, temporary
-        for ssh in mcs.__cache.values():
-            if getrefcount(ssh) == n_count:
-                logger.debug('Closing {} as unused'.format(ssh))
-                ssh.close()
-        mcs.__cache = {}
+        """Clear cached connections for initialize new instance on next call
+
+        Connections are closed by SSHClient destructor, when other
+        references are released.
+        """
+        with mcs.__lock:
+            mcs.__cache.clear()
+            mcs.__last_used.clear()
+            mcs.__key_locks.clear()
+            mcs.__stats.clear()
+
+    @staticmethod
+    def __in_networks(host, networks):
+        try:
+            address = netaddr.IPAddress(host)
+        except (netaddr.AddrFormatError, ValueError):
+            # hostname is not an IP address
+            return False
+        return any(address in network for network in networks)
 
     @classmethod
-    def close_connections(mcs, hostname=None):
+    def close_connections(mcs, hostname=None, networks=None):
         """Close connections for selected or all cached records
 
         :type hostname: str
+        :param networks: close connections to addresses of the networks
+        :type networks: list of netaddr.IPNetwork
         """
-        if hostname is None:
-            keys = [key for key, ssh in mcs.__cache.items() if ssh.is_alive]
+        with mcs.__lock:
+            clients = [
+                ssh for (host, _), ssh in mcs.__cache.items()
+                if (hostname is None or host == hostname) and
+                (networks is None or mcs.__in_networks(host, networks)) and
+                ssh.is_alive]
+        for ssh in clients:
+            ssh.close()
+
+
+class _OutputLines(object):
+    """Lines of the command output with limited retention"""
+
+    __slots__ = ['__head', '__tail', '__max_head', '__dropped', '__partial',
+                 '__callback']
+
+    def __init__(self, max_lines=None, callback=None):
+        """Lines of the command output with limited retention
+
+        :param max_lines: amount of first and last lines to keep in memory,
+                          by default all lines are kept
+        :param callback: function called with every line
+        """
+        if max_lines is None:
+            self.__max_head = None
+            self.__tail = collections.deque()
         else:
-            keys = [
-                (host, port)
-                for (host, port), ssh
-                in mcs.__cache.items() if host == hostname and ssh.is_alive]
-        # raise ValueError(keys)
-        for key in keys:
-            mcs.__cache[key].close()
+            self.__max_head = max_lines // 2
+            self.__tail = collections.deque(
+                maxlen=max_lines - self.__max_head)
+        self.__head = []
+        self.__dropped = 0
+        self.__partial = b''
+        self.__callback = callback
+
+    def __add(self, line):
+        if self.__callback is not None:
+            self.__callback(line)
+        if self.__max_head is None or len(self.__head) < self.__max_head:
+            self.__head.append(line)
+            return
+        if len(self.__tail) == self.__tail.maxlen:
+            self.__dropped += 1
+        self.__tail.append(line)
+
+    def feed(self, data):
+        """Add data read from the stream
+
+        :type data: bytes
+        """
+        lines = (self.__partial + data).split(b'\n')
+        self.__partial = lines.pop()
+        for line in lines:
+            self.__add(line + b'\n')
+
+    def close(self):
+        """Add the last line if it is not terminated"""
+        if self.__partial:
+            self.__add(self.__partial)
+            self.__partial = b''
+
+    @property
+    def dropped(self):
+        """Amount of lines not kept in memory
+
+        :rtype: int
+        """
+        return self.__dropped
+
+    @property
+    def lines(self):
+        """Kept lines, dropped lines are replaced with '...'
+
+        :rtype: list
+        """
+        if self.__dropped:
+            return self.__head + [b'...\n'] + list(self.__tail)
+        return self.__head + list(self.__tail)
+
+
+class _ChannelReader(object):
+    """Reader of output of the command running on the remote"""
+
+    __slots__ = ['remote', 'channel', 'deadline', '__stdout', '__stderr']
+
+    chunk_size = 32768
+
+    def __init__(self, remote, channel, deadline=None,
+                 max_lines=None, callback=None):
+        """Reader of output of the command running on the remote
+
+        :type remote: SSHClient
+        :type channel: paramiko.channel.Channel
+        :param deadline: time when the command should be finished
+        :param max_lines: amount of first and last lines of every stream
+                          to keep in memory
+        :param callback: function called with every line and
+                         stderr=True|False
+        """
+        self.remote = remote
+        self.channel = channel
+        self.deadline = deadline
+        stdout_callback = stderr_callback = None
+        if callback is not None:
+            stdout_callback = functools.partial(callback, stderr=False)
+            stderr_callback = functools.partial(callback, stderr=True)
+        self.__stdout = _OutputLines(max_lines, stdout_callback)
+        self.__stderr = _OutputLines(max_lines, stderr_callback)
+
+    def fileno(self):
+        return self.channel.fileno()
+
+    def read(self):
+        """Read available output from the channel
+
+        :rtype: bool
+        :return: True if command is finished and all output is read
+        """
+        # Output is sent before exit status, so check status first
+        finished = self.channel.exit_status_ready()
+        while self.channel.recv_ready():
+            self.__stdout.feed(self.channel.recv(self.chunk_size))
+        while self.channel.recv_stderr_ready():
+            self.__stderr.feed(self.channel.recv_stderr(self.chunk_size))
+        return finished
+
+    def finish(self, command, timed_out=False):
+        """Close the channel and get result
+
+        :type command: str
+        :type timed_out: bool
+        :rtype: ExecResult
+        """
+        self.__stdout.close()
+        self.__stderr.close()
+        result = ExecResult(
+            cmd=command,
+            stdout=self.__stdout.lines,
+            stderr=self.__stderr.lines)
+        if not timed_out:
+            result.exit_code = self.channel.recv_exit_status()
+        self.channel.close()
+        return result
+
+
+class _AsyncExecution(object):
+    """Command executed on the remote in asyncio event loop
+
+    Channel is opened in the default executor of the loop, output is read
+    by the loop when paramiko signals that channel has data.
+    """
+
+    def __init__(self, remote, command, timeout=None, max_lines=None,
+                 timeout_result=False, loop=None, **kwargs):
+        """Start the command on the remote
+
+        :type remote: SSHClient
+        :type command: str
+        :type timeout: int
+        :type max_lines: int
+        :param timeout_result: set result with ExitCodes.EX_INVALID instead
+                               of TimeoutError if command is not finished
+        :type loop: asyncio.AbstractEventLoop
+        """
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        self.remote = remote
+        self.command = command
+        self.timeout = timeout
+        self.max_lines = max_lines
+        self.timeout_result = timeout_result
+        self.loop = loop
+        self.future = asyncio.Future(loop=loop)
+        self.future.add_done_callback(self.__on_done)
+        self.__reader = None
+        self.__timer = None
+        if timeout is not None:
+            self.__timer = loop.call_later(timeout, self.__on_timeout)
+        start = loop.run_in_executor(
+            None, functools.partial(remote.execute_async, command, **kwargs))
+        start.add_done_callback(self.__on_started)
+
+    def __on_started(self, start):
+        if start.cancelled():
+            self.future.cancel()
+            return
+        if start.exception() is not None:
+            if not self.future.done():
+                self.future.set_exception(start.exception())
+            return
+        chan = start.result()[0]
+        if self.future.done():
+            chan.close()
+            return
+        self.__reader = _ChannelReader(
+            self.remote, chan, max_lines=self.max_lines)
+        self.loop.add_reader(self.__reader.fileno(), self.__on_ready)
+        self.__on_ready()
+
+    def __on_ready(self):
+        if self.future.done():
+            return
+        # noinspection PyBroadException
+        try:
+            finished = self.__reader.read()
+        except Exception as e:
+            self.future.set_exception(e)
+            return
+        if finished:
+            self.future.set_result(self.__close())
+
+    def __on_timeout(self):
+        self.__timer = None
+        if self.future.done():
+            return
+        if self.__reader is not None:
+            result = self.__close(timed_out=True)
+        else:
+            result = ExecResult(cmd=self.command)
+        if self.timeout_result:
+            logger.warning(
+                "Command '{cmd}' is not finished on {remote} "
+                "in time".format(cmd=self.command, remote=self.remote))
+            self.future.set_result(result)
+        else:
+            self.future.set_exception(SSHClient._timeout_error(
+                self.command, self.timeout, result))
+
+    def __close(self, timed_out=False):
+        reader, self.__reader = self.__reader, None
+        self.loop.remove_reader(reader.fileno())
+        return reader.finish(self.command, timed_out=timed_out)
+
+    def __on_done(self, future):
+        if self.__timer is not None:
+            self.__timer.cancel()
+            self.__timer = None
+        if self.__reader is not None:
+            # Cancelled or failed while reading
+            self.__close(timed_out=True)
 
 
 class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
@@ -304,6 +659,23 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         '__lock'
     ]
 
+    # Connection cache: maximum amount of cached connections, seconds to
+    # keep connection which is not requested, seconds since previous request
+    # to check connection for alive before return it
+    cache_max_size = 256
+    cache_idle_timeout = 600
+    cache_check_interval = 5
+
+    # Directory transfer: amount of parallel SFTP sessions, amount of
+    # changed files to transfer them with tar over ssh instead of SFTP,
+    # maximum length of arguments of one command
+    transfer_channels = 4
+    transfer_tar_min_files = 100
+    transfer_max_cmd_size = 65536
+
+    # Maximum time to wait for output of concurrent commands in select()
+    _select_interval = 1.0
+
     class get_sudo(object):
         """Context manager for call commands with sudo"""
 
@@ -479,10 +851,12 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
     def __connect(self):
         """Main method for connection open"""
         with self.lock:
+            started = time.time()
             self.auth.connect(
                 client=self.__ssh,
                 hostname=self.hostname, port=self.port,
                 log=True)
+            _MemorizedSSH.record_connect(time.time() - started)
 
     def __connect_sftp(self):
         """SFTP connection opener"""
@@ -540,12 +914,28 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         _MemorizedSSH.clear_cache()
 
     @classmethod
-    def close_connections(cls, hostname=None):
+    def close_connections(cls, hostname=None, networks=None):
         """Close cached connections: if hostname is not set, then close all
 
         :type hostname: str
+        :param networks: close only connections to addresses of the networks
+        :type networks: list of netaddr.IPNetwork
+        """
+        _MemorizedSSH.close_connections(hostname=hostname, networks=networks)
+
+    @classmethod
+    def cache_stats(cls):
+        """Counters of cached connections
+
+        connects: amount of opened connections, connect_time: seconds spent
+        to open them, reconnects: amount of reopened broken cached
+        connections, reuses: amount of cached connections returned,
+        evictions: amount of connections removed from cache,
+        size: amount of cached connections
+
+        :rtype: dict
         """
-        _MemorizedSSH.close_connections(hostname=hostname)
+        return _MemorizedSSH.stats()
 
     def __del__(self):
         """Destructor helper: close channel and threads BEFORE closing others
@@ -671,6 +1061,169 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
                                                stderr=ret['stderr_str'])
         return ret
 
+    @classmethod
+    def execute_concurrent(
+            cls, remotes, command, timeout=None, host_timeout=None,
+            max_workers=100, **kwargs):
+        """Execute command on multiple remotes concurrently
+
+        Command is running on max_workers remotes at once, next remote is
+        started when command on any remote is finished. Output of all
+        channels is read in one select() loop while commands are running,
+        so big output could not block the channel.
+
+        :type remotes: list
+        :type command: str
+        :param timeout: seconds to wait for the command on all remotes
+        :param host_timeout: seconds to wait for the command on one remote
+        :param max_workers: maximum amount of commands running at once
+        :rtype: dict
+        :return: {SSHClient: ExecResult}. If command is not finished in
+                 time or is not started, exit code is ExitCodes.EX_INVALID
+        """
+        pending = collections.deque()
+        for remote in remotes:  # Use distinct remotes
+            if remote not in pending:
+                pending.append(remote)
+        deadline = None if timeout is None else time.time() + timeout
+        running = []
+        results = {}
+
+        while pending or running:
+            while pending and len(running) < max_workers:
+                remote = pending.popleft()
+                try:
+                    chan, _, _, _ = remote.execute_async(command, **kwargs)
+                except (paramiko.SSHException, EnvironmentError):
+                    logger.exception(
+                        "Command '{cmd}' is not started on {remote}".format(
+                            cmd=command, remote=remote))
+                    results[remote] = ExecResult(cmd=command)
+                    continue
+                running.append(_ChannelReader(
+                    remote, chan,
+                    None if host_timeout is None
+                    else time.time() + host_timeout))
+            if not running:
+                break
+
+            deadlines = [reader.deadline for reader in running
+                         if reader.deadline is not None]
+            if deadline is not None:
+                deadlines.append(deadline)
+            wait = cls._select_interval
+            if deadlines:
+                wait = max(0, min(wait, min(deadlines) - time.time()))
+            select.select(running, [], [], wait)
+
+            now = time.time()
+            expired = deadline is not None and now >= deadline
+            for reader in list(running):
+                if reader.read():
+                    running.remove(reader)
+                    results[reader.remote] = reader.finish(command)
+                elif expired or (reader.deadline is not None and
+                                 now >= reader.deadline):
+                    running.remove(reader)
+                    logger.warning(
+                        "Command '{cmd}' is not finished on {remote} "
+                        "in time".format(cmd=command, remote=reader.remote))
+                    results[reader.remote] = reader.finish(
+                        command, timed_out=True)
+            if expired:
+                for remote in pending:
+                    results[remote] = ExecResult(cmd=command)
+                pending.clear()
+        return results
+
+    def aexecute(self, command, timeout=None, max_lines=None, loop=None,
+                 **kwargs):
+        """Execute command in asyncio event loop
+
+        Usage: result = await ssh.aexecute(command)
+        (or yield from ssh.aexecute(command) in python 3.4)
+
+        :type command: str
+        :type timeout: int
+        :param max_lines: amount of first and last lines of stdout and
+                          stderr to keep in result
+        :type loop: asyncio.AbstractEventLoop
+        :rtype: asyncio.Future
+        :return: future of ExecResult, TimeoutError is set if command is
+                 not finished in time
+        :raises: DevopsNotImplementedError
+        """
+        if asyncio is None:
+            raise DevopsNotImplementedError(
+                'aexecute() requires asyncio (python 3.4+)')
+        return _AsyncExecution(
+            self, command, timeout=timeout, max_lines=max_lines,
+            loop=loop, **kwargs).future
+
+    @classmethod
+    def agather(cls, remotes, command, timeout=None, max_lines=None,
+                loop=None, **kwargs):
+        """Execute command on multiple remotes in asyncio event loop
+
+        Usage: results = await SSHClient.agather(remotes, command)
+
+        :type remotes: list
+        :type command: str
+        :param timeout: seconds to wait for the command on every remote
+        :param max_lines: amount of first and last lines of stdout and
+                          stderr to keep in every result
+        :type loop: asyncio.AbstractEventLoop
+        :rtype: asyncio.Future
+        :return: future of {SSHClient: ExecResult}. If command is not
+                 finished in time or is not started, exit code is
+                 ExitCodes.EX_INVALID
+        :raises: DevopsNotImplementedError
+        """
+        if asyncio is None:
+            raise DevopsNotImplementedError(
+                'agather() requires asyncio (python 3.4+)')
+        if loop is None:
+            loop = asyncio.get_event_loop()
+        executions = {}
+        for remote in remotes:  # Use distinct remotes
+            if remote not in executions:
+                executions[remote] = _AsyncExecution(
+                    remote, command, timeout=timeout, max_lines=max_lines,
+                    timeout_result=True, loop=loop, **kwargs).future
+        results = asyncio.Future(loop=loop)
+
+        def on_finished(_):
+            if results.done():
+                return
+            if not all(future.done() for future in executions.values()):
+                return
+            gathered = {}
+            for remote, future in executions.items():
+                if future.cancelled():
+                    results.cancel()
+                    return
+                if future.exception() is not None:
+                    logger.error(
+                        "Command '{cmd}' is not started on {remote}: "
+                        "{exc!r}".format(cmd=command, remote=remote,
+                                         exc=future.exception()))
+                    gathered[remote] = ExecResult(cmd=command)
+                else:
+                    gathered[remote] = future.result()
+            results.set_result(gathered)
+
+        def on_cancelled(_):
+            if results.cancelled():
+                for future in executions.values():
+                    future.cancel()
+
+        if not executions:
+            results.set_result({})
+        for future in executions.values():
+            future.add_done_callback(on_finished)
+        results.add_done_callback(on_cancelled)
+        return results
+
     @classmethod
     def execute_together(
             cls, remotes, command, expected=None, raise_on_err=True, **kwargs):
@@ -680,22 +1233,49 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         :type command: str
         :type expected: list
         :type raise_on_err: bool
+        :rtype: dict
+        :return: {SSHClient: ExecResult}, see execute_concurrent
         :raises: DevopsCalledProcessError
         """
         if expected is None:
             expected = [0]
-        futures = {}
-        errors = {}
-        for remote in set(remotes):  # Use distinct remotes
-            chan, _, _, _ = remote.execute_async(command, **kwargs)
-            futures[remote] = chan
-        for remote, chan in futures.items():
-            ret = chan.recv_exit_status()
-            chan.close()
-            if ret not in expected:
-                errors[remote.hostname] = ret
+        results = cls.execute_concurrent(remotes, command, **kwargs)
+        errors = {
+            remote.hostname: result.exit_code
+            for remote, result in results.items()
+            if result.exit_code not in expected}
         if errors and raise_on_err:
             raise DevopsCalledProcessError(command, errors)
+        return results
+
+    @classmethod
+    def _timeout_error(cls, command, timeout, result):
+        """Log output of not finished command and make an exception
+
+        :type command: str
+        :type timeout: int
+        :type result: ExecResult
+        :rtype: TimeoutError
+        """
+        status_tmpl = (
+            'Wait for {0} during {1}s: no return code!\n'
+            '\tSTDOUT:\n'
+            '{2}\n'
+            '\tSTDERR"\n'
+            '{3}')
+        logger.debug(
+            status_tmpl.format(
+                command, timeout,
+                result.stdout,
+                result.stderr
+            )
+        )
+        return TimeoutError(
+            status_tmpl.format(
+                command, timeout,
+                result.stdout_brief,
+                result.stderr_brief
+            ))
 
     @classmethod
     def __exec_command(
@@ -724,38 +1304,69 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         else:
 
             channel.close()
-            status_tmpl = (
-                'Wait for {0} during {1}s: no return code!\n'
-                '\tSTDOUT:\n'
-                '{2}\n'
-                '\tSTDERR"\n'
-                '{3}')
-            logger.debug(
-                status_tmpl.format(
-                    command, timeout,
-                    result.stdout,
-                    result.stderr
-                )
-            )
-            raise TimeoutError(
-                status_tmpl.format(
-                    command, timeout,
-                    result.stdout_brief,
-                    result.stderr_brief
-                ))
+            raise cls._timeout_error(command, timeout, result)
 
-    def execute(self, command, verbose=False, timeout=None, **kwargs):
+    def __exec_streaming(
+            self, command, timeout, callback, max_lines, **kwargs):
+        """Execute command and read its output while it is running
+
+        :type command: str
+        :type timeout: int
+        :type callback: callable
+        :type max_lines: int
+        :rtype: ExecResult
+        :raises: TimeoutError
+        """
+        chan, _, _, _ = self.execute_async(command, **kwargs)
+        reader = _ChannelReader(
+            self, chan,
+            deadline=None if timeout is None else time.time() + timeout,
+            max_lines=max_lines, callback=callback)
+        while not reader.read():
+            wait = self._select_interval
+            if reader.deadline is not None:
+                left = reader.deadline - time.time()
+                if left <= 0:
+                    result = reader.finish(command, timed_out=True)
+                    raise self._timeout_error(command, timeout, result)
+                wait = min(wait, left)
+            select.select([reader], [], [], wait)
+        return reader.finish(command)
+
+    def execute(self, command, verbose=False, timeout=None,
+                callback=None, tee=None, max_lines=None, **kwargs):
         """Execute command and wait for return code
 
+        If callback, tee or max_lines is set, output is read while the
+        command is running: remote does not wait for output to be read
+        and only max_lines of every stream are kept in ExecResult.
+
         :type command: str
         :type verbose: bool
         :type timeout: int
+        :param callback: function called with every line of output as
+                         callback(line, stderr=True|False)
+        :param tee: binary file to write every line of output
+        :param max_lines: amount of first and last lines of stdout and
+                          stderr to keep in result, the rest is replaced
+                          with '...'
         :rtype: ExecResult
         :raises: TimeoutError
         """
-        chan, _, stderr, stdout = self.execute_async(command, **kwargs)
+        if callback is None and tee is None and max_lines is None:
+            chan, _, stderr, stdout = self.execute_async(command, **kwargs)
+
+            result = self.__exec_command(
+                command, chan, stdout, stderr, timeout)
+        else:
+            def on_line(line, stderr):
+                if tee is not None:
+                    tee.write(line)
+                if callback is not None:
+                    callback(line, stderr=stderr)
 
-        result = self.__exec_command(command, chan, stdout, stderr, timeout)
+            result = self.__exec_streaming(
+                command, timeout, on_line, max_lines, **kwargs)
 
         if verbose:
             logger.info(
@@ -891,11 +1502,198 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         """
         return self._sftp.open(path, mode)
 
-    def upload(self, source, target):
+    @staticmethod
+    def __list_local(path):
+        """List directories and files of the local tree
+
+        :type path: str
+        :rtype: tuple
+        :return: set of directories and {file: (size, mtime)}, paths are
+                 relative to the path with '/' as separator
+        """
+        dirs = set()
+        files = {}
+        for rootdir, _, filenames in os.walk(path):
+            reldir = os.path.relpath(rootdir, path).replace(os.sep, '/')
+            if reldir == '.':
+                reldir = ''
+            dirs.add(reldir)
+            for filename in filenames:
+                st = os.stat(os.path.join(rootdir, filename))
+                files[posixpath.join(reldir, filename)] = (
+                    st.st_size, int(st.st_mtime))
+        return dirs, files
+
+    def __list_remote(self, path):
+        """List directories and files of the remote tree in one command
+
+        :type path: str
+        :rtype: tuple
+        :return: set of directories and {file: (size, mtime)}, paths are
+                 relative to the path
+        """
+        chunks = []
+
+        def collect(line, stderr):
+            if not stderr:
+                chunks.append(line)
+
+        # Output is read while find is running: listing could be huge
+        self.execute(
+            "find {} -printf '%y %s %T@ %P\\0'".format(shlex_quote(path)),
+            callback=collect, max_lines=10)
+        dirs = set()
+        files = {}
+        for entry in b''.join(chunks).split(b'\0'):
+            if not entry:
+                continue
+            kind, size, mtime, name = entry.decode('utf-8').split(' ', 3)
+            if kind == 'd':
+                dirs.add(name)
+            elif kind == 'f':
+                files[name] = int(size), int(float(mtime))
+        return dirs, files
+
+    def __mkdirs(self, paths):
+        """Create remote directories with as few commands as possible
+
+        :type paths: list
+        """
+        chunk = []
+        size = 0
+        for path in sorted(paths):
+            path = shlex_quote(path)
+            chunk.append(path)
+            size += len(path) + 1
+            if size > self.transfer_max_cmd_size:
+                self.check_call('mkdir -p {}'.format(' '.join(chunk)))
+                chunk = []
+                size = 0
+        if chunk:
+            self.check_call('mkdir -p {}'.format(' '.join(chunk)))
+
+    @staticmethod
+    def __put(sftp, source, target, mtime):
+        sftp.put(source, target)
+        sftp.utime(target, (mtime, mtime))
+
+    @staticmethod
+    def __get(sftp, source, target, mtime):
+        sftp.get(source, target)
+        os.utime(target, (mtime, mtime))
+
+    def __sftp_transfer(self, transfer, files, channels=None):
+        """Transfer files in parallel SFTP sessions
+
+        :param transfer: function(sftp, source, target, mtime)
+        :param files: list of (source, target, mtime)
+        :param channels: amount of SFTP sessions
+        """
+        if channels is None:
+            channels = self.transfer_channels
+        channels = max(1, min(channels, len(files)))
+        if channels == 1:
+            for args in files:
+                transfer(self._sftp, *args)
+            return
+
+        queue = six.moves.queue.Queue()
+        for args in files:
+            queue.put(args)
+        errors = []
+
+        def worker():
+            # noinspection PyBroadException
+            try:
+                with closing(self._ssh.open_sftp()) as sftp:
+                    while not errors:
+                        try:
+                            args = queue.get_nowait()
+                        except six.moves.queue.Empty:
+                            return
+                        transfer(sftp, *args)
+            except Exception as e:
+                logger.exception('SFTP transfer failed')
+                errors.append(e)
+
+        threads = [Thread(target=worker) for _ in range(channels)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def __check_tar(self, cmd, chan, stdout, stderr):
+        """Wait for tar and check its exit code
+
+        :raises: DevopsCalledProcessError
+        """
+        result = self.__exec_command(cmd, chan, stdout, stderr, None)
+        if result.exit_code != ExitCodes.EX_OK:
+            raise DevopsCalledProcessError(
+                cmd, result.exit_code,
+                stdout=result.stdout_brief,
+                stderr=result.stderr_brief)
+
+    def __tar_upload(self, source, target, names):
+        """Upload files in one tar stream
+
+        :type source: str
+        :type target: str
+        :param names: file paths relative to source and target
+        """
+        cmd = 'tar --no-same-owner -xf - -C {}'.format(shlex_quote(target))
+        chan, stdin, stderr, stdout = self.execute_async(cmd)
+        with closing(tarfile.open(fileobj=stdin, mode='w|')) as tar:
+            for name in names:
+                tar.add(os.path.join(source, *name.split('/')),
+                        arcname=name, recursive=False)
+        stdin.flush()
+        chan.shutdown_write()
+        self.__check_tar(cmd, chan, stdout, stderr)
+
+    def __tar_download(self, source, target, names):
+        """Download files in one tar stream
+
+        :type source: str
+        :type target: str
+        :param names: file paths relative to source and target
+        """
+        cmd = 'tar -cf - -C {} --null -T -'.format(shlex_quote(source))
+        chan, stdin, stderr, stdout = self.execute_async(cmd)
+
+        def send_names():
+            # tar starts to send archive before all names are read
+            for name in names:
+                stdin.write(name.encode('utf-8') + b'\0')
+            stdin.flush()
+            chan.shutdown_write()
+
+        sender = Thread(target=send_names)
+        sender.start()
+        extract_kwargs = {}
+        if hasattr(tarfile, 'data_filter'):
+            extract_kwargs['filter'] = 'data'
+        with closing(tarfile.open(fileobj=stdout, mode='r|')) as tar:
+            for member in tar:
+                tar.extract(member, target, **extract_kwargs)
+        sender.join()
+        self.__check_tar(cmd, chan, stdout, stderr)
+
+    def upload(self, source, target, channels=None, tar=None):
         """Upload file(s) from source to target using SFTP session
 
+        Directory is uploaded in parallel SFTP sessions or with tar over
+        ssh, if many files are changed. Files with the same size and
+        modification time on the remote are skipped.
+
         :type source: str
         :type target: str
+        :param channels: amount of parallel SFTP sessions,
+                         transfer_channels by default
+        :param tar: upload directory with tar, by default if at least
+                    transfer_tar_min_files files are changed
         """
         logger.debug("Copying '%s' -> '%s'", source, target)
 
@@ -907,26 +1705,77 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
             self._sftp.put(source, target)
             return
 
-        for rootdir, _, files in os.walk(source):
-            targetdir = os.path.normpath(
-                os.path.join(
-                    target,
-                    os.path.relpath(rootdir, source))).replace("\\", "/")
-
-            self.mkdir(targetdir)
+        local_dirs, local_files = self.__list_local(source)
+        remote_dirs, remote_files = self.__list_remote(target)
+        self.__mkdirs([posixpath.join(target, name) if name else target
+                       for name in local_dirs - remote_dirs])
+        changed = sorted(name for name, attrs in local_files.items()
+                         if remote_files.get(name) != attrs)
+        logger.debug('%s of %s files are changed in %s',
+                     len(changed), len(local_files), source)
+        if not changed:
+            return
+        if tar is None:
+            tar = len(changed) >= self.transfer_tar_min_files
+        if tar:
+            self.__tar_upload(source, target, changed)
+            return
+        self.__sftp_transfer(
+            self.__put,
+            [(os.path.join(source, *name.split('/')),
+              posixpath.join(target, name),
+              local_files[name][1])
+             for name in changed],
+            channels=channels)
 
-            for entry in files:
-                local_path = os.path.join(rootdir, entry)
-                remote_path = posixpath.join(targetdir, entry)
-                if self.exists(remote_path):
-                    self._sftp.unlink(remote_path)
-                self._sftp.put(local_path, remote_path)
+    def __download_dir(self, destination, target, channels=None, tar=None):
+        """Download directory like upload() does
 
-    def download(self, destination, target):
+        :type destination: str
+        :type target: str
+        :type channels: int
+        :type tar: bool
+        """
+        remote_dirs, remote_files = self.__list_remote(destination)
+        local_dirs, local_files = set(), {}
+        if os.path.isdir(target):
+            local_dirs, local_files = self.__list_local(target)
+        for name in sorted(remote_dirs - local_dirs):
+            path = os.path.join(target, *name.split('/'))
+            if not os.path.isdir(path):
+                os.makedirs(path)
+        changed = sorted(name for name, attrs in remote_files.items()
+                         if local_files.get(name) != attrs)
+        logger.debug('%s of %s files are changed in %s',
+                     len(changed), len(remote_files), destination)
+        if not changed:
+            return
+        if tar is None:
+            tar = len(changed) >= self.transfer_tar_min_files
+        if tar:
+            self.__tar_download(destination, target, changed)
+            return
+        self.__sftp_transfer(
+            self.__get,
+            [(posixpath.join(destination, name),
+              os.path.join(target, *name.split('/')),
+              remote_files[name][1])
+             for name in changed],
+            channels=channels)
+
+    def download(self, destination, target, channels=None, tar=None):
         """Download file(s) to target from destination
 
+        Directory is downloaded in parallel SFTP sessions or with tar over
+        ssh, if many files are changed. Local files with the same size and
+        modification time are skipped.
+
         :type destination: str
         :type target: str
+        :param channels: amount of parallel SFTP sessions,
+                         transfer_channels by default
+        :param tar: download directory with tar, by default if at least
+                    transfer_tar_min_files files are changed
         :rtype: bool
         """
         logger.debug(
@@ -937,16 +1786,14 @@ class SSHClient(six.with_metaclass(_MemorizedSSH, object)):
         if os.path.isdir(target):
             target = posixpath.join(target, os.path.basename(destination))
 
-        if not self.isdir(destination):
-            if self.exists(destination):
-                self._sftp.get(destination, target)
-            else:
-                logger.debug(
-                    "Can't download %s because it doesn't exist", destination
-                )
+        if self.isdir(destination):
+            self.__download_dir(
+                destination, target, channels=channels, tar=tar)
+        elif self.exists(destination):
+            self._sftp.get(destination, target)
         else:
             logger.debug(
-                "Can't download %s because it is a directory", destination
+                "Can't download %s because it doesn't exist", destination
             )
         return os.path.exists(target)
 
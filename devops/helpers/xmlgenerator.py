@@ -12,14 +12,80 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-from xml.dom import minidom
+import sys
 from xml.etree import ElementTree as ET
 
 import six
 
+# minidom sorted attributes before python 3.8, see _write_element()
+_SORT_ATTRIBUTES = sys.version_info < (3, 8)
+
+
+def _escape_text(data):
+    # line ends of text are normalized by XML parsers
+    return _escape(data.replace('\r\n', '\n').replace('\r', '\n'))
+
+
+def _escape(data):
+    return data.replace('&', '&amp;').replace('<', '&lt;').replace(
+        '"', '&quot;').replace('>', '&gt;')
+
+
+def _escape_attribute(data):
+    if six.PY2:
+        # ElementTree of python 2 escapes only '\n' of attributes, so XML
+        # parsers normalized tabs and carriage returns to spaces
+        data = data.replace('\t', ' ').replace('\r', ' ')
+    return _escape(data)
+
+
+def _write_element(elem, parts, indent):
+    """Serialize the element the way minidom's toprettyxml() does"""
+    attrib = elem.attrib
+    names = sorted(attrib) if _SORT_ATTRIBUTES else attrib
+    parts.append(indent + '<' + elem.tag)
+    for name in names:
+        parts.append(' {0}="{1}"'.format(
+            name, _escape_attribute(attrib[name])))
+
+    text = elem.text
+    if not len(elem):
+        if text:
+            # single text node is written inline
+            parts.append('>' + _escape_text(text) + '</' + elem.tag + '>\n')
+        else:
+            parts.append('/>\n')
+        return
+
+    parts.append('>\n')
+    child_indent = indent + '    '
+    if text:
+        parts.append(child_indent + _escape_text(text) + '\n')
+    for child in elem:
+        _write_element(child, parts, child_indent)
+        if child.tail:
+            parts.append(child_indent + _escape_text(child.tail) + '\n')
+    parts.append(indent + '</' + elem.tag + '>\n')
+
+
+def tostring_pretty(root):
+    """Serialize element tree with 4 spaces indentation
+
+    Output is the same as of minidom's toprettyxml() of the reparsed
+    tree, without serializing and parsing the tree again.
+
+    :type root: ET.Element
+    :rtype: str
+    """
+    parts = ['<?xml version="1.0" encoding="utf-8"?>\n']
+    _write_element(root, parts, '')
+    return ''.join(parts)
+
 
 class XMLGeneratorElement(object):
 
+    __slots__ = ('elem', 'parent', 'builder', 'prev_elem')
+
     def __init__(self, name, parent, builder):
         self.elem = ET.SubElement(parent, name)
         self.parent = parent
@@ -42,8 +108,9 @@ class XMLGeneratorElement(object):
 
     def __call__(self, txt=None, **kwargs):
         # update attributes
-        kwargs = {k: str(v) for k, v in kwargs.items()}
-        self.elem.attrib.update(kwargs)
+        attrib = self.elem.attrib
+        for k, v in kwargs.items():
+            attrib[k] = str(v)
 
         # update text if any
         if txt:
@@ -68,10 +135,4 @@ class XMLGenerator(object):
             builder=self)
 
     def __str__(self):
-        rough_string = ET.tostring(self.root, encoding='utf-8')
-        reparsed = minidom.parseString(rough_string)
-        s = reparsed.toprettyxml(indent='    ', encoding='utf-8')
-        if six.PY2:
-            return s
-        else:
-            return str(s, encoding='utf-8')
+        return tostring_pretty(self.root)
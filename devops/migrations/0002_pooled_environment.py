@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+# flake8: noqa
+# pylint: skip-file
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import datetime
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devops', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PooledEnvironment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('created', models.DateTimeField(default=datetime.datetime.utcnow)),
+                ('pool_name', models.CharField(max_length=255, db_index=True)),
+                ('env_name', models.CharField(max_length=255)),
+                ('snapshot_name', models.CharField(max_length=255)),
+                ('status', models.CharField(max_length=255, default='ready', choices=[('ready', 'ready'), ('checked_out', 'checked_out')])),
+                ('claimed_by', models.CharField(max_length=255, null=True)),
+                ('claimed_at', models.DateTimeField(null=True)),
+                ('environment', models.OneToOneField(to='devops.Environment')),
+            ],
+            options={
+                'db_table': 'devops_pooled_environment',
+            },
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# flake8: noqa
+# pylint: skip-file
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+# tables of ParamedModel subclasses
+PARAMED_TABLES = (
+    'devops_address_pool',
+    'devops_diskdevice',
+    'devops_driver',
+    'devops_interface',
+    'devops_l2_network_device',
+    'devops_node',
+    'devops_volume',
+)
+
+
+def _alter_params_type(schema_editor, db_type):
+    # only PostgreSQL has a native json type which could be indexed and
+    # used in lookups without casting, other backends keep text column
+    connection = schema_editor.connection
+    if connection.vendor != 'postgresql':
+        return
+    if db_type == 'jsonb' and connection.pg_version < 90400:
+        return
+    qn = connection.ops.quote_name
+    for table in PARAMED_TABLES:
+        schema_editor.execute(
+            'ALTER TABLE {table} ALTER COLUMN {column} TYPE {db_type} '
+            'USING {column}::{db_type}'.format(
+                table=qn(table), column=qn('params'), db_type=db_type))
+
+
+def params_to_jsonb(apps, schema_editor):
+    _alter_params_type(schema_editor, 'jsonb')
+
+
+def params_to_text(apps, schema_editor):
+    _alter_params_type(schema_editor, 'text')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devops', '0002_pooled_environment'),
+    ]
+
+    operations = [
+        migrations.RunPython(params_to_jsonb, params_to_text),
+    ]
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# flake8: noqa
+# pylint: skip-file
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('devops', '0003_params_jsonb'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pooledenvironment',
+            name='label',
+            field=models.CharField(max_length=255, null=True, unique=True),
+        ),
+    ]
@@ -27,6 +27,7 @@ except AppRegistryNotReady:
 
 from devops.models.driver import Driver
 from devops.models.environment import Environment
+from devops.models.environment_pool import PooledEnvironment
 from devops.models.group import Group
 from devops.models.network import Address
 from devops.models.network import Interface
@@ -39,4 +40,4 @@ from devops.models.volume import DiskDevice
 
 __all__ = ['Driver', 'Environment', 'Group', 'Address', 'Interface',
            'AddressPool', 'NetworkPool', 'L2NetworkDevice', 'Node',
-           'Volume', 'DiskDevice']
+           'Volume', 'DiskDevice', 'PooledEnvironment']
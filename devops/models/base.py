@@ -19,6 +19,7 @@ from functools import reduce
 # pylint: enable=redefined-builtin
 import operator
 
+from django.db import connections
 from django.db import models
 from django.db.models.base import ModelBase
 from django.db.models import query
@@ -28,6 +29,7 @@ import six
 from devops.error import DevopsError
 from devops.helpers.helpers import deepgetattr
 from devops.helpers import loader
+from devops.models import param_lookups
 
 
 def choices(*args, **kwargs):
@@ -37,6 +39,59 @@ def choices(*args, **kwargs):
     return models.CharField(**defaults)
 
 
+def get_prefetched(manager):
+    """Get objects of the related manager cached by prefetch_related()
+
+    :rtype: QuerySet or None
+    :return: evaluated QuerySet or None if objects were not prefetched
+    """
+    queryset = manager.all()
+    if queryset._result_cache is None:
+        return None
+    return queryset
+
+
+def set_prefetched(queryset, objects):
+    """Store objects in the result cache of the queryset
+
+    The queryset is not evaluated after that, the way prefetch_related()
+    caches related objects.
+
+    :rtype: QuerySet
+    """
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    return queryset
+
+
+def cache_related(instance, field, objects):
+    """Cache objects of the reverse relation of the ForeignKey
+
+    :param instance: model instance the ForeignKey points to
+    :param field: ForeignKey of the related model
+    :param objects: related objects ordered by id
+    """
+    manager = getattr(instance, field.rel.get_accessor_name())
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache[field.related_query_name()] = (
+        set_prefetched(manager.all(), objects))
+
+
+def filter_related(manager, *args, **kwargs):
+    """Filter objects of the related manager ordered by id
+
+    Objects cached by prefetch_related() are used if there are no filters.
+
+    :rtype: QuerySet
+    """
+    if not args and not kwargs:
+        queryset = get_prefetched(manager)
+        if queryset is not None:
+            return queryset
+    return manager.filter(*args, **kwargs).order_by('id')
+
+
 class BaseModel(models.Model):
     class Meta(object):
         abstract = True
@@ -44,6 +99,111 @@ class BaseModel(models.Model):
     created = models.DateTimeField(default=datetime.utcnow)
 
 
+class ParamedModelMetadata(object):
+    """Metadata of a ParamedModel class
+
+    Metadata is created by :class:`ParamedModelType` together with the
+    class, so constructor, save() and queryset don't walk MRO and django
+    fields on every call:
+    * param_fields - descriptors of ParamFields of the class and its bases
+      in MRO order
+    * param_names - names of the params
+    * defaults - default values of ParamFields by name
+    * field_names - names of django fields, computed on first use because
+      reverse relations are known only when all models are loaded
+    * get_param_field() - ParamField of the class or of its subclasses by
+      path of keys, used by queryset to find lookups of params
+    """
+
+    # class path -> ParamedModel class, used to restore polymorphic
+    # instances without import
+    classes = {}
+
+    # changed on creation of every ParamedModel class, lookups of params
+    # in subclasses are computed again after that
+    generation = 0
+
+    def __init__(self, model):
+        self.model = model
+        self.param_fields = []
+        for basecls in model.__mro__:
+            names = basecls.__dict__.get('_param_field_names', ())
+            self.param_fields.extend(basecls.__dict__[name] for name in names)
+        self.param_names = [field.param_key for field in self.param_fields]
+        self.param_name_set = frozenset(self.param_names)
+
+        self.defaults = {}
+        for field in reversed(self.param_fields):
+            if isinstance(field, ParamField):
+                self.defaults[field.param_key] = field.default_value
+
+        self._field_names = None
+        self._param_lookups = {}
+        self._generation = None
+
+        ParamedModelMetadata.classes[
+            '{0}:{1}'.format(model.__module__, model.__name__)] = model
+        ParamedModelMetadata.generation += 1
+
+    @property
+    def field_names(self):
+        """Names and attnames of django fields including reverse relations
+
+        :rtype: frozenset
+        """
+        if self._field_names is None:
+            # 'pk' is used by Model.save(), without it every save of
+            # an existing object filters the whole table in python
+            field_names = {'pk'}
+            # proxy models have the same fields as the concrete model
+            _meta = self.model._meta.concrete_model._meta
+            for field in _meta.get_fields():
+                # For backwards compatibility GenericForeignKey should not be
+                # included in the results.
+                if field.is_relation and field.many_to_one and \
+                        field.related_model is None:
+                    continue
+                # Relations to child proxy models should not be included.
+                if field.model != _meta.model and\
+                        field.model._meta.concrete_model == \
+                        _meta.concrete_model:
+                    continue
+
+                field_names.add(field.name)
+                if hasattr(field, 'attname'):
+                    field_names.add(field.attname)
+            self._field_names = frozenset(field_names)
+        return self._field_names
+
+    def get_param_field(self, path):
+        """Find ParamField of the model or of its subclasses by path
+
+        :type path: list
+        :rtype: ParamField or None
+        """
+        if self._generation != ParamedModelMetadata.generation:
+            self._param_lookups = {}
+            self._generation = ParamedModelMetadata.generation
+        key = tuple(path)
+        if key not in self._param_lookups:
+            self._param_lookups[key] = self._find_param_field(path)
+        return self._param_lookups[key]
+
+    def _find_param_field(self, path):
+        classes = [self.model]
+        for cls in classes:
+            classes.extend(cls.__subclasses__())
+            field = cls.__dict__.get(path[0])
+            for key in path[1:]:
+                if not isinstance(field, ParamMultiField):
+                    field = None
+                    break
+                field = field.proxy_fields.get(key)
+            if isinstance(field, ParamField):
+                return field
+        return None
+
+
 class ParamedModelType(ModelBase):
     """Metaclass of parameterizable class.
 
@@ -53,6 +213,7 @@ class ParamedModelType(ModelBase):
     * Initializes :class:`ParamFieldBase` classes with `param_key`.
     * Saves the keys of :class:`ParamFieldBase` attributes in
     `_param_field_names` list.
+    * Creates :class:`ParamedModelMetadata` of the class in `_paramed_meta`.
     * Gives an ability to set :class:`ParamFieldBase` values in
     constructor and combine the with other attributes defined in djano
     model.
@@ -91,6 +252,8 @@ class ParamedModelType(ModelBase):
                 attr.set_param_key(attr_name)
                 new_class._param_field_names.append(attr_name)
 
+        new_class._paramed_meta = ParamedModelMetadata(new_class)
+
         return new_class
 
     # pylint: enable=bad-mcs-classmethod-argument
@@ -99,17 +262,20 @@ class ParamedModelType(ModelBase):
         # split kwargs which django db are not aware of
         # to separete dict
         kwargs_for_params = {}
-        defined_params = cls.get_defined_params()
-        for param in defined_params:
-            if param in kwargs:
-                kwargs_for_params[param] = kwargs.pop(param)
+        if kwargs:
+            param_names = cls._paramed_meta.param_name_set
+            for param in list(kwargs):
+                if param in param_names:
+                    kwargs_for_params[param] = kwargs.pop(param)
 
         obj = super(ParamedModelType, cls).__call__(*args, **kwargs)
 
         if obj._class:
             # we store actual class name in _class attribute
             # so use it to load required class
-            Cls = loader.load_class(obj._class)
+            Cls = ParamedModelMetadata.classes.get(obj._class)
+            if Cls is None:
+                Cls = loader.load_class(obj._class)
             # replace base class
             obj.__class__ = Cls
 
@@ -270,25 +436,12 @@ class ParamMultiField(ParamFieldBase):
 class ParamedModelQuerySet(query.QuerySet):
     """Custom QuerySet for ParamedModel"""
 
-    def __get_all_field_names(self):
-        field_names = set()
-        _meta = self.model._meta
-        fields = _meta.get_fields()
-        for field in fields:
-            # For backwards compatibility GenericForeignKey should not be
-            # included in the results.
-            if field.is_relation and field.many_to_one and \
-                    field.related_model is None:
-                continue
-            # Relations to child proxy models should not be included.
-            if field.model != _meta.model and\
-                    field.model._meta.concrete_model == _meta.concrete_model:
-                continue
-
-            field_names.add(field.name)
-            if hasattr(field, 'attname'):
-                field_names.add(field.attname)
-        return field_names
+    def bulk_create(self, objs, batch_size=None):
+        # save() is not called, so params are prepared here
+        for obj in objs:
+            obj.prepare_params()
+        return super(ParamedModelQuerySet, self).bulk_create(
+            objs, batch_size=batch_size)
 
     def filter(self, *args, **kwargs):
         super_filter = super(ParamedModelQuerySet, self).filter
@@ -298,8 +451,7 @@ class ParamedModelQuerySet(query.QuerySet):
         kwargs_for_params = {}
         db_kwargs = {}
 
-        # Fix deprecated code usage from django
-        field_names = self.__get_all_field_names()
+        field_names = self.model._paramed_meta.field_names
 
         for param in kwargs.keys():
             first_subparam = param.split('__')[0]
@@ -315,20 +467,41 @@ class ParamedModelQuerySet(query.QuerySet):
             # return db queryset if there is no params
             return queryset
 
-        # filter using params
+        # translate lookups of ParamFields to json predicates
+        connection = connections[queryset.db]
+        where = []
+        where_params = []
+        python_lookups = []
+        for key, value in kwargs_for_params.items():
+            path, lookup = param_lookups.split_lookup(key)
+            predicate = None
+            if self.model._paramed_meta.get_param_field(path) is not None:
+                predicate = param_lookups.get_predicate(
+                    connection, self.model._meta.db_table, path, lookup,
+                    value)
+            if predicate is None:
+                python_lookups.append(('__'.join(path), lookup, value))
+            else:
+                where.append(predicate[0])
+                where_params.extend(predicate[1])
+
+        if where:
+            queryset = queryset.extra(where=where, params=where_params)
+
+        if not python_lookups:
+            return queryset
+
+        # filter the rest using params
         result_ids = []
         for item in queryset:
-            for key, value in kwargs_for_params.items():
-                # NOTE(astudenov): no support for 'gt', 'lt', 'in'
-                # and other django's filter stuff
-
+            for key, lookup, value in python_lookups:
                 if not isinstance(item, self.model):
                     # skip other classes
                     continue
 
                 item_val = deepgetattr(item, key, splitter='__',
                                        do_raise=True)
-                if item_val != value:
+                if not param_lookups.match(item_val, lookup, value):
                     break
             else:
                 result_ids.append(item.id)
@@ -375,22 +548,18 @@ class ParamedModel(six.with_metaclass(ParamedModelType, models.Model)):
 
     @classmethod
     def get_defined_params(cls):
-        param_names = []
-        for basecls in cls.__mro__:
-            if not hasattr(basecls, '_param_field_names'):
-                continue
-            param_names += basecls._param_field_names
-        return param_names
+        return list(cls._paramed_meta.param_names)
 
     def set_default_params(self):
-        for basecls in self.__class__.__mro__:
-            if not hasattr(basecls, '_param_field_names'):
-                continue
-            for param in basecls._param_field_names:
-                basecls.__dict__[param].set_default_value(self)
+        for field in self._paramed_meta.param_fields:
+            field.set_default_value(self)
 
-    def save(self, *args, **kwargs):
+    def prepare_params(self):
+        """Prepare params to be stored in the database"""
         # store current class to _class attribute
         self._class = loader.get_class_path(self)
         self.set_default_params()
+
+    def save(self, *args, **kwargs):
+        self.prepare_params()
         return super(ParamedModel, self).save(*args, **kwargs)
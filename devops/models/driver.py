@@ -41,3 +41,10 @@ class Driver(ParamedModel, BaseModel):
 
     def get_allocated_networks(self):
         return []
+
+    def inventory(self):
+        """State of all nodes of the driver indexed by node UUID
+
+        :return: None if the driver can't list its nodes
+        """
+        return None
@@ -12,12 +12,18 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import collections
+import contextlib
+import itertools
+import threading
 import time
 from warnings import warn
 
 from django.conf import settings
 from django.db import IntegrityError
 from django.db import models
+from django.db import transaction
+from django.db.models import Prefetch
 from netaddr import IPNetwork
 from paramiko import Agent
 from paramiko import RSAKey
@@ -25,18 +31,27 @@ from paramiko import RSAKey
 from devops.error import DevopsEnvironmentError
 from devops.error import DevopsError
 from devops.error import DevopsObjNotFound
+from devops.helpers.network import AllocatedNetworks
 from devops.helpers.network import IpNetworksPool
+from devops.helpers.parallel import TaskGraph
 from devops.helpers.ssh_client import SSHAuth
 from devops.helpers.ssh_client import SSHClient
 from devops.helpers.templates import create_devops_config
 from devops.helpers.templates import get_devops_config
 from devops import logger
 from devops.models.base import BaseModel
+from devops.models.base import cache_related
+from devops.models.base import filter_related
+from devops.models.base import get_prefetched
+from devops.models.base import set_prefetched
 from devops.models.driver import Driver
 from devops.models.group import Group
+from devops.models.materializer import TemplateMaterializer
 from devops.models.network import AddressPool
+from devops.models.network import Interface
 from devops.models.network import L2NetworkDevice
 from devops.models.node import Node
+from devops.models.volume import Volume
 
 
 def _numhosts(self):
@@ -73,12 +88,48 @@ class Environment(BaseModel):
     def __repr__(self):
         return 'Environment(name={name!r})'.format(name=self.name)
 
+    # snapshots of allocated networks by ids of environments, see
+    # allocation_snapshot(); transactions are bound to threads, so are they
+    _allocation_snapshots = threading.local()
+
     def get_allocated_networks(self):
         allocated_networks = []
         for group in self.get_groups():
             allocated_networks += group.get_allocated_networks()
         return allocated_networks
 
+    @contextlib.contextmanager
+    def allocation_snapshot(self):
+        """Transaction sharing one snapshot of allocated networks
+
+        Networks allocated by the drivers of the groups are requested once
+        when the block is entered, address pools created inside of the
+        block are added to the snapshot. The snapshot is dropped when the
+        transaction is committed or rolled back. Nested blocks share the
+        snapshot of the outer one, even if they are entered through
+        another instance of the same environment.
+
+        .. code-block::
+
+            with env.allocation_snapshot():
+                env.add_address_pool(name='admin', net='10.0.0.0/16:24')
+                env.add_address_pool(name='public', net='10.0.0.0/16:24')
+
+        :rtype: AllocatedNetworks
+        """
+        snapshots = self._allocation_snapshots.__dict__
+        if self.id in snapshots:
+            yield snapshots[self.id]
+            return
+
+        with transaction.atomic():
+            snapshots[self.id] = AllocatedNetworks(
+                self.get_allocated_networks())
+            try:
+                yield snapshots[self.id]
+            finally:
+                del snapshots[self.id]
+
     def get_address_pool(self, **kwargs):
         try:
             return self.addresspool_set.get(**kwargs)
@@ -86,7 +137,7 @@ class Environment(BaseModel):
             raise DevopsObjNotFound(AddressPool, **kwargs)
 
     def get_address_pools(self, **kwargs):
-        return self.addresspool_set.filter(**kwargs).order_by('id')
+        return filter_related(self.addresspool_set, **kwargs)
 
     def get_group(self, **kwargs):
         try:
@@ -95,7 +146,7 @@ class Environment(BaseModel):
             raise DevopsObjNotFound(Group, **kwargs)
 
     def get_groups(self, **kwargs):
-        return self.group_set.filter(**kwargs).order_by('id')
+        return filter_related(self.group_set, **kwargs)
 
     def add_groups(self, groups):
         for group_data in groups:
@@ -129,29 +180,37 @@ class Environment(BaseModel):
         )
 
     def add_address_pools(self, address_pools):
-        for name, data in address_pools.items():
-            self.add_address_pool(
-                name=name,
-                net=data['net'],
-                **data.get('params', {})
-            )
+        with self.allocation_snapshot():
+            for name, data in address_pools.items():
+                self.add_address_pool(
+                    name=name,
+                    net=data['net'],
+                    **data.get('params', {})
+                )
 
     def add_address_pool(self, name, net, **params):
+        """Create address pool with a free subnet of the net
+
+        Allocated networks are taken from allocation_snapshot().
 
+        :param net: <network>[,<network>]:<prefix>
+        :rtype: AddressPool
+        """
         networks, prefix = net.split(':')
         ip_networks = [IPNetwork(x) for x in networks.split(',')]
 
-        pool = IpNetworksPool(
-            networks=ip_networks,
-            prefix=int(prefix),
-            allocated_networks=self.get_allocated_networks())
+        with self.allocation_snapshot() as allocated_networks:
+            pool = IpNetworksPool(
+                networks=ip_networks,
+                prefix=int(prefix),
+                allocated_networks=allocated_networks)
 
-        return AddressPool.address_pool_create(
-            environment=self,
-            name=name,
-            pool=pool,
-            **params
-        )
+            return AddressPool.address_pool_create(
+                environment=self,
+                name=name,
+                pool=pool,
+                **params
+            )
 
     @classmethod
     def create(cls, name):
@@ -176,87 +235,258 @@ class Environment(BaseModel):
     def list_all(cls):
         return cls.objects.all()
 
+    @classmethod
+    def _graph_queryset(cls):
+        def ordered(model):
+            return model.objects.order_by('id')
+
+        return cls.objects.prefetch_related(
+            Prefetch('addresspool_set', queryset=ordered(AddressPool)),
+            Prefetch('group_set',
+                     queryset=ordered(Group).select_related('driver')),
+            Prefetch('group_set__l2networkdevice_set',
+                     queryset=ordered(L2NetworkDevice)),
+            Prefetch('group_set__volume_set', queryset=ordered(Volume)),
+            Prefetch('group_set__node_set', queryset=ordered(Node)),
+            Prefetch('group_set__node_set__volume_set',
+                     queryset=ordered(Volume)),
+            'group_set__node_set__diskdevice_set',
+            Prefetch('group_set__node_set__interface_set',
+                     queryset=ordered(Interface)),
+            'group_set__node_set__interface_set__address_set',
+            'group_set__node_set__networkconfig_set',
+        )
+
+    def _link_graph(self):
+        """Replace related objects loaded twice by the same instances
+
+        Objects are changed by define() of the other objects, e.g. uuid
+        of the volume is used by define() of the node, so the node should
+        see the same volume instance.
+        """
+        pools = {pool.id: pool for pool in self.get_address_pools()}
+        l2_network_devices = {}
+        volumes = {}
+        for group in self.get_groups():
+            l2_network_devices.update(
+                (l2_dev.id, l2_dev)
+                for l2_dev in group.get_l2_network_devices())
+            volumes.update((volume.id, volume)
+                           for volume in group.get_volumes())
+            for node in group.get_nodes():
+                volumes.update((volume.id, volume)
+                               for volume in node.get_volumes())
+
+        for l2_dev in l2_network_devices.values():
+            if l2_dev.address_pool_id in pools:
+                l2_dev.address_pool = pools[l2_dev.address_pool_id]
+        for volume in volumes.values():
+            if volume.backing_store_id in volumes:
+                volume.backing_store = volumes[volume.backing_store_id]
+
+        l2_interfaces = collections.defaultdict(list)
+        for node in self.get_nodes():
+            for disk in node.disk_devices:
+                if disk.volume_id in volumes:
+                    disk.volume = volumes[disk.volume_id]
+            for interface in node.interfaces:
+                l2_dev = l2_network_devices.get(
+                    interface.l2_network_device_id)
+                if l2_dev is not None:
+                    interface.l2_network_device = l2_dev
+                    l2_interfaces[l2_dev.id].append(interface)
+
+        field = Interface._meta.get_field('l2_network_device')
+        for l2_dev in l2_network_devices.values():
+            cache_related(l2_dev, field, sorted(
+                l2_interfaces[l2_dev.id], key=lambda iface: iface.id))
+
+    @classmethod
+    def get_graph(cls, *args, **kwargs):
+        """Get environment with all its objects loaded
+
+        Groups with drivers, address pools, l2 network devices, nodes,
+        volumes, disk devices, interfaces, addresses and network configs
+        are loaded by a fixed number of queries and are used by get_*()
+        methods and relations without further queries.
+
+        :rtype: Environment
+        """
+        try:
+            env = cls._graph_queryset().get(*args, **kwargs)
+        except Environment.DoesNotExist:
+            raise DevopsObjNotFound(Environment, *args, **kwargs)
+        env._link_graph()
+        return env
+
+    @classmethod
+    def list_all_graphs(cls):
+        """List all environments with all their objects loaded
+
+        :rtype: list
+        """
+        envs = list(cls._graph_queryset().order_by('id'))
+        for env in envs:
+            env._link_graph()
+        return envs
+
     # LEGACY
     def has_snapshot(self, name):
-        if self.get_nodes():
-            return all(n.has_snapshot(name) for n in self.get_nodes())
-        else:
+        if not self.get_nodes():
             return False
+        # one inventory request per driver instead of a request per group
+        inventories = {}
+        for group in self.get_groups():
+            if group.driver_id not in inventories:
+                inventories[group.driver_id] = group.driver.inventory()
+            if not group.has_snapshot(name, inventories[group.driver_id]):
+                return False
+        return True
 
     def define(self):
-        for group in self.get_groups():
-            group.define_networks()
-        for group in self.get_groups():
-            group.define_volumes()
-        for group in self.get_groups():
-            group.define_nodes()
+        graph = TaskGraph.from_settings()
+        groups = self.get_graph(id=self.id).get_groups()
+        for group in groups:
+            group.schedule_define_networks(graph)
+        for group in groups:
+            group.schedule_define_volumes(graph)
+        for group in groups:
+            group.schedule_define_nodes(graph)
+        graph.run()
 
     def start(self, nodes=None):
-        for group in self.get_groups():
-            group.start_networks()
-        for group in self.get_groups():
-            group.start_nodes(nodes)
+        graph = TaskGraph.from_settings()
+        groups = self.get_graph(id=self.id).get_groups()
+        for group in groups:
+            group.schedule_start_networks(graph)
+        for group in groups:
+            group.schedule_start_nodes(graph, nodes)
+        graph.run()
+
+    def close_remotes(self):
+        """Close cached SSH connections to hosts of the address pools
+
+        Nodes could get addresses which are not stored in devops, e.g.
+        from DHCP of the master node, so all connections to the networks
+        of the environment are closed.
+        """
+        SSHClient.close_connections(networks=[
+            address_pool.ip_network
+            for address_pool in self.get_address_pools()])
 
     def destroy(self):
+        graph = TaskGraph.from_settings()
         for group in self.get_groups():
-            group.destroy()
+            group.schedule_destroy(graph)
+        graph.run()
+        self.close_remotes()
 
     def erase(self):
-        for group in self.get_groups():
-            group.erase()
+        graph = TaskGraph.from_settings()
+        groups = list(self.get_groups())
+        for group in groups:
+            group.schedule_erase(graph)
+        graph.run()
+        for group in groups:
+            group.delete()
         self.delete()
 
     def suspend(self, **kwargs):
         for node in self.get_nodes():
             node.suspend()
+        self.close_remotes()
 
     def resume(self, **kwargs):
         for node in self.get_nodes():
             node.resume()
 
-    def snapshot(self, name=None, description=None, force=False):
+    @staticmethod
+    def _run_on_nodes(nodes, method, **kwargs):
+        """Call method of all nodes concurrently
+
+        :type nodes: list
+        :type method: str
+        :rtype: collections.OrderedDict
+        :return: seconds spent by every node by node name
+        """
+        graph = TaskGraph.from_settings()
+        for node in nodes:
+            graph.add(('node', node.id), getattr(node, method),
+                      phase=method, kwargs=kwargs)
+        graph.run()
+
+        durations = collections.OrderedDict()
+        for node in nodes:
+            spent = graph.durations.get(('node', node.id))
+            if spent is not None:
+                durations[node.name] = spent
+                logger.info("Node '{0}': {1} done in {2:0.3f}s".format(
+                    node.name, method, spent))
+        return durations
+
+    def snapshot(self, name=None, description=None, force=False,
+                 suspend=False):
+        """Snapshot all nodes of the environment
+
+        Nodes are snapshotted concurrently. If suspend is True, all active
+        nodes are suspended before the snapshot and resumed together
+        after it, so the snapshots of all nodes match the same moment.
+
+        :rtype: collections.OrderedDict
+        :return: seconds spent on snapshot of every node by node name
+        """
         if name is None:
             name = str(int(time.time()))
-        for node in self.get_nodes():
-            node.snapshot(name=name, description=description, force=force,
-                          external=settings.SNAPSHOTS_EXTERNAL)
+        nodes = list(self.get_nodes())
+
+        active_nodes = []
+        if suspend:
+            active_nodes = [node for node in nodes if node.is_active()]
+            self._run_on_nodes(active_nodes, 'suspend')
+        try:
+            return self._run_on_nodes(
+                nodes, 'snapshot', name=name, description=description,
+                force=force, external=settings.SNAPSHOTS_EXTERNAL)
+        finally:
+            if active_nodes:
+                self._run_on_nodes(active_nodes, 'resume')
+            self.close_remotes()
 
     def revert(self, name=None, flag=True):
+        """Revert all nodes of the environment to the snapshot concurrently
+
+        :rtype: collections.OrderedDict
+        :return: seconds spent on revert of every node by node name
+        """
         if flag and not self.has_snapshot(name):
             raise Exception("some nodes miss snapshot,"
                             " test should be interrupted")
-        for node in self.get_nodes():
-            node.revert(name)
+        durations = self._run_on_nodes(list(self.get_nodes()), 'revert',
+                                       name=name)
+        self.close_remotes()
 
         for group in self.get_groups():
             for l2netdev in group.get_l2_network_devices():
                 l2netdev.unblock()
 
-    # TO REWRITE FOR LIBVIRT DRIVER ONLY
+        return durations
+
     @classmethod
     def synchronize_all(cls):
-        driver = cls.get_driver()
-        nodes = {driver._get_name(e.name, n.name): n
-                 for e in cls.list_all()
-                 for n in e.get_nodes()}
-        domains = set(driver.node_list())
-
-        # FIXME (AWoodward) This willy nilly wacks domains when you run this
-        #  on domains that are outside the scope of devops, if anything this
-        #  should cause domains to be imported into db instead of undefined.
-        #  It also leaves network and volumes around too
-        #  Disabled until a safer implementation arrives
-
-        # Undefine domains without devops nodes
-        #
-        # domains_to_undefine = domains - set(nodes.keys())
-        # for d in domains_to_undefine:
-        #    driver.node_undefine_by_name(d)
+        # NOTE: domains without devops nodes are not undefined: they
+        # could be created outside of devops
 
         # Remove devops nodes without domains
-        nodes_to_remove = set(nodes.keys()) - domains
-        for n in nodes_to_remove:
-            nodes[n].delete()
+        nodes_to_remove = []
+        inventories = {}
+        for env in cls.list_all():
+            for group in env.get_groups():
+                if group.driver_id not in inventories:
+                    inventories[group.driver_id] = group.driver.inventory()
+                nodes_to_remove.extend(group.get_nodes_without_domains(
+                    inventories[group.driver_id]))
+        for node in nodes_to_remove:
+            node.delete()
         cls.erase_empty()
 
         logger.info('Undefined domains: {0}, removed nodes: {1}'.format(
@@ -314,47 +544,19 @@ class Environment(BaseModel):
     def create_environment(cls, full_config):
         """Create a new environment using full_config object
 
+        The whole template is validated first, then all objects are
+        created in one transaction, see TemplateMaterializer.
+
         :param full_config: object that describes all the parameters of
                             created environment
 
         :rtype: Environment
         """
-
-        config = full_config['template']['devops_settings']
-        environment = cls.create(config['env_name'])
-
-        # create groups and drivers
-        groups = config['groups']
-        environment.add_groups(groups)
-
-        # create address pools
-        address_pools = config['address_pools']
-        environment.add_address_pools(address_pools)
-
-        # process group items
-        for group_data in groups:
-            group = environment.get_group(name=group_data['name'])
-
-            # add l2_network_devices
-            group.add_l2_network_devices(
-                group_data.get('l2_network_devices', {}))
-
-            # add network_pools
-            group.add_network_pools(
-                group_data.get('network_pools', {}))
-
-        # Connect nodes to already created networks
-        for group_data in groups:
-            group = environment.get_group(name=group_data['name'])
-
-            # add group volumes
-            group.add_volumes(
-                group_data.get('group_volumes', []))
-
-            # add nodes
-            group.add_nodes(
-                group_data.get('nodes', []))
-
+        materializer = TemplateMaterializer(full_config)
+        materializer.validate()
+        with transaction.atomic():
+            environment = cls.create(materializer.config['env_name'])
+            materializer.materialize(environment)
         return environment
 
     # LEGACY - TO MODIFY BY GROUPS
@@ -520,5 +722,13 @@ class Environment(BaseModel):
 
     # LEGACY, for fuel-qa compatibility
     def get_nodes(self, *args, **kwargs):
+        groups = None if args or kwargs else get_prefetched(self.group_set)
+        if groups is not None:
+            node_sets = [get_prefetched(group.node_set) for group in groups]
+            if None not in node_sets:
+                nodes = sorted(itertools.chain(*node_sets),
+                               key=lambda node: node.id)
+                return set_prefetched(Node.objects.filter(
+                    group__environment=self).order_by('id'), nodes)
         return Node.objects.filter(
             *args, group__environment=self, **kwargs).order_by('id')
@@ -0,0 +1,202 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import copy
+from datetime import datetime
+import os
+import socket
+
+from django.db import IntegrityError
+from django.db import models
+from django.db import transaction
+
+from devops.error import DevopsError
+from devops import logger
+from devops.models.base import BaseModel
+from devops.models.base import choices
+from devops.models.environment import Environment
+
+
+class PooledEnvironment(BaseModel):
+    """Environment of a warm pool
+
+    Environments of the pool are created from the same template, defined,
+    started and snapshotted at the 'ready' point in advance. Checkout
+    claims a ready environment and optionally labels it, return reverts
+    the environment to the ready snapshot and puts it back to the pool.
+
+    The name of the environment never changes: libvirt networks, filters,
+    volumes and snapshot files are named after it, so the label of the
+    claim is stored in the pool entry instead.
+
+    Claim is a conditional update of the pool row, so concurrent checkouts
+    from several processes never get the same environment.
+    """
+
+    class Meta(object):
+        db_table = 'devops_pooled_environment'
+        app_label = 'devops'
+
+    READY = 'ready'
+    CHECKED_OUT = 'checked_out'
+
+    environment = models.OneToOneField('Environment')
+    pool_name = models.CharField(max_length=255, db_index=True)
+    env_name = models.CharField(max_length=255)
+    snapshot_name = models.CharField(max_length=255)
+    status = choices(READY, CHECKED_OUT, default=READY)
+    claimed_by = models.CharField(max_length=255, null=True)
+    claimed_at = models.DateTimeField(null=True)
+    label = models.CharField(max_length=255, null=True, unique=True)
+
+    def __repr__(self):
+        return 'PooledEnvironment(pool_name={0!r}, env_name={1!r})'.format(
+            self.pool_name, self.env_name)
+
+    @classmethod
+    def get_pool(cls, pool_name=None):
+        """List environments of the pool, or of all pools
+
+        :type pool_name: str
+        """
+        entries = cls.objects.select_related('environment')
+        if pool_name is not None:
+            entries = entries.filter(pool_name=pool_name)
+        return entries.order_by('pool_name', 'id')
+
+    @classmethod
+    def get_environment(cls, name):
+        """Find checked out environment by the label or by the name
+
+        :type name: str
+        :rtype: Environment
+        """
+        try:
+            return cls.objects.select_related('environment').get(
+                label=name).environment
+        except cls.DoesNotExist:
+            return Environment.get(name=name)
+
+    @classmethod
+    def _free_env_name(cls, pool_name):
+        names = set(Environment.objects.filter(
+            name__startswith=pool_name).values_list('name', flat=True))
+        names.update(cls.objects.filter(
+            pool_name=pool_name).values_list('env_name', flat=True))
+        num = 1
+        while '{0}_pool_{1}'.format(pool_name, num) in names:
+            num += 1
+        return '{0}_pool_{1}'.format(pool_name, num)
+
+    @classmethod
+    def fill(cls, pool_name, config, count, snapshot_name='ready',
+             prepare=None):
+        """Create environments until the pool has count of them
+
+        :type pool_name: str
+        :param config: environment template, env_name is replaced
+        :type count: int
+        :param snapshot_name: name of the snapshot of the ready point
+        :param prepare: function(env) called after the environment is
+                        started, e.g. to bootstrap the master node
+        :rtype: list of PooledEnvironment
+        """
+        created = []
+        for _ in range(count - cls.objects.filter(
+                pool_name=pool_name).count()):
+            env_name = cls._free_env_name(pool_name)
+            env_config = copy.deepcopy(config)
+            env_config['template']['devops_settings']['env_name'] = env_name
+
+            logger.info('Creating environment {0!r} for pool {1!r}'.format(
+                env_name, pool_name))
+            env = Environment.create_environment(env_config)
+            try:
+                env.define()
+                env.start()
+                if prepare is not None:
+                    prepare(env)
+                env.snapshot(snapshot_name, suspend=True)
+            except Exception:
+                logger.error('Failed to prepare environment {0!r}'.format(
+                    env_name))
+                env.erase()
+                raise
+
+            created.append(cls.objects.create(
+                environment=env, pool_name=pool_name, env_name=env_name,
+                snapshot_name=snapshot_name))
+        return created
+
+    @classmethod
+    def checkout(cls, pool_name, name=None, claimed_by=None):
+        """Claim ready environment of the pool
+
+        :param pool_name: name of the pool
+        :param name: label of the claim, the environment can be found by
+                     it with get_environment()
+        :param claimed_by: owner of the environment, hostname and pid of
+                           the current process by default
+        :rtype: Environment
+        """
+        if claimed_by is None:
+            claimed_by = '{0}:{1}'.format(socket.gethostname(), os.getpid())
+
+        candidates = list(cls.objects.filter(
+            pool_name=pool_name, status=cls.READY).order_by(
+            'id').values_list('id', flat=True))
+        for entry_id in candidates:
+            # conditional update locks the row, other processes which try
+            # to claim the same entry update nothing
+            try:
+                with transaction.atomic():
+                    claimed = cls.objects.filter(
+                        id=entry_id, status=cls.READY).update(
+                        status=cls.CHECKED_OUT, claimed_by=claimed_by,
+                        claimed_at=datetime.utcnow(), label=name)
+            except IntegrityError:
+                raise DevopsError(
+                    'Environment with label {!r} is already checked '
+                    'out'.format(name))
+            if not claimed:
+                continue
+            env = Environment.objects.get(pooledenvironment__id=entry_id)
+            logger.info('Environment {0!r} of pool {1!r} is checked out '
+                        'by {2} as {3!r}'.format(env.name, pool_name,
+                                                 claimed_by, name))
+            return env
+
+        raise DevopsError(
+            'There are no ready environments in pool {!r}'.format(pool_name))
+
+    @classmethod
+    def release(cls, env):
+        """Revert environment to the ready point and return it to the pool
+
+        :type env: Environment
+        """
+        try:
+            entry = cls.objects.get(environment=env, status=cls.CHECKED_OUT)
+        except cls.DoesNotExist:
+            raise DevopsError(
+                'Environment {!r} is not checked out from any '
+                'pool'.format(env.name))
+
+        env.revert(entry.snapshot_name, flag=False)
+        env.resume()
+
+        cls.objects.filter(id=entry.id).update(
+            status=cls.READY, claimed_by=None, claimed_at=None, label=None)
+        logger.info('Environment {0!r} is returned to pool {1!r}'.format(
+            env.name, entry.pool_name))
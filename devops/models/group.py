@@ -17,8 +17,10 @@ from copy import deepcopy
 from django.db import models
 
 from devops.error import DevopsObjNotFound
+from devops.helpers.parallel import TaskGraph
 from devops import logger
 from devops.models.base import BaseModel
+from devops.models.base import filter_related
 from devops.models.network import L2NetworkDevice
 from devops.models.network import NetworkPool
 from devops.models.node import Node
@@ -43,7 +45,7 @@ class Group(BaseModel):
             raise DevopsObjNotFound(L2NetworkDevice, **kwargs)
 
     def get_l2_network_devices(self, **kwargs):
-        return self.l2networkdevice_set.filter(**kwargs).order_by('id')
+        return filter_related(self.l2networkdevice_set, **kwargs)
 
     def get_network_pool(self, **kwargs):
         try:
@@ -61,7 +63,7 @@ class Group(BaseModel):
             raise DevopsObjNotFound(Node, **kwargs)
 
     def get_nodes(self, **kwargs):
-        return self.node_set.filter(**kwargs).order_by('id')
+        return filter_related(self.node_set, **kwargs)
 
     def get_allocated_networks(self):
         return self.driver.get_allocated_networks()
@@ -85,44 +87,161 @@ class Group(BaseModel):
     def list_all(cls):
         return cls.objects.all()
 
-    def has_snapshot(self, name):
+    def has_snapshot(self, name, inventory=None):
+        """Check that all nodes of the group have the snapshot
+
+        :type name: str
+        :param inventory: result of self.driver.inventory() if it has
+                          been already requested
+        :rtype: bool
+        """
+        # nodes without domains can't have snapshots, the rest of nodes
+        # reuse domain handles fetched by the inventory request
+        if inventory is None:
+            inventory = self.driver.inventory()
+        if self.get_nodes_without_domains(inventory):
+            return False
         return all(n.has_snapshot(name) for n in self.get_nodes())
 
-    def define_volumes(self):
-        for volume in self.get_volumes():
-            volume.define()
+    def schedule_define_networks(self, graph):
+        """Add definition of l2 network devices to the task graph
 
-    def define_networks(self):
+        :type graph: devops.helpers.parallel.TaskGraph
+        """
+        previous = [key for key in graph if key[0] == 'l2_network_device']
         for l2_network_device in self.get_l2_network_devices():
-            l2_network_device.define()
+            key = ('l2_network_device', l2_network_device.id)
+            # NOTE: names of bridges are allocated by the driver
+            # without locking, so networks are defined one by one
+            graph.add(key, l2_network_device.define, phase='networks',
+                      deps=previous[-1:])
+            previous.append(key)
 
-    def define_nodes(self):
-        for node in self.get_nodes():
-            for volume in node.get_volumes():
-                volume.define()
-            node.define()
+    def schedule_define_volumes(self, graph, volumes=None):
+        """Add definition of volumes to the task graph
 
-    def start_networks(self):
+        Volume is defined only after its backing store.
+
+        :type graph: devops.helpers.parallel.TaskGraph
+        :type volumes: list
+        """
+        if volumes is None:
+            volumes = self.get_volumes()
+        for volume in volumes:
+            deps = []
+            if volume.backing_store_id is not None:
+                deps.append(('volume', volume.backing_store_id))
+            graph.add(('volume', volume.id), volume.define,
+                      phase='volumes', deps=deps)
+
+    def schedule_define_nodes(self, graph):
+        """Add definition of nodes and their volumes to the task graph
+
+        Node is defined only after its volumes and l2 network devices.
+
+        :type graph: devops.helpers.parallel.TaskGraph
+        """
+        for node in self.get_nodes():
+            volumes = list(node.get_volumes())
+            self.schedule_define_volumes(graph, volumes=volumes)
+            deps = [('volume', volume.id) for volume in volumes]
+            deps += [('volume', disk.volume_id)
+                     for disk in node.disk_devices]
+            deps += [('l2_network_device', iface.l2_network_device_id)
+                     for iface in node.interfaces]
+            graph.add(('node', node.id), node.define,
+                      phase='domains', deps=deps)
+
+    def schedule_start_networks(self, graph):
+        """Add start of l2 network devices to the task graph
+
+        :type graph: devops.helpers.parallel.TaskGraph
+        """
         for l2_network_device in self.get_l2_network_devices():
-            l2_network_device.start()
+            graph.add(('l2_network_device', l2_network_device.id),
+                      l2_network_device.start, phase='networks')
 
-    def start_nodes(self, nodes=None):
+    def schedule_start_nodes(self, graph, nodes=None):
+        """Add start of nodes to the task graph
+
+        :type graph: devops.helpers.parallel.TaskGraph
+        :type nodes: list
+        """
         for node in nodes or self.get_nodes():
-            node.start()
+            deps = [('l2_network_device', iface.l2_network_device_id)
+                    for iface in node.interfaces]
+            graph.add(('node', node.id), node.start,
+                      phase='domains', deps=deps)
 
-    def destroy(self, **kwargs):
-        for node in self.get_nodes():
-            node.destroy()
+    def schedule_destroy(self, graph):
+        """Add destroy of nodes to the task graph
 
-    def erase(self):
+        :type graph: devops.helpers.parallel.TaskGraph
+        """
         for node in self.get_nodes():
-            node.erase()
+            graph.add(('node', node.id), node.destroy, phase='domains')
+
+    def schedule_erase(self, graph):
+        """Add erase of nodes, volumes and networks to the task graph
+
+        Group volumes and l2 network devices are erased only after
+        all nodes of the group.
 
-        for volume in self.get_volumes():
-            volume.erase()
+        :type graph: devops.helpers.parallel.TaskGraph
+        """
+        node_keys = []
+        for node in self.get_nodes():
+            key = ('node', node.id)
+            graph.add(key, node.erase, phase='domains')
+            node_keys.append(key)
+
+        volumes = list(self.get_volumes())
+        for volume in volumes:
+            # volume is erased only after volumes based on it
+            deps = node_keys + [('volume', child.id) for child in volumes
+                                if child.backing_store_id == volume.id]
+            graph.add(('volume', volume.id), volume.erase,
+                      phase='volumes', deps=deps)
 
         for l2_network_device in self.get_l2_network_devices():
-            l2_network_device.erase()
+            graph.add(('l2_network_device', l2_network_device.id),
+                      l2_network_device.erase,
+                      phase='networks', deps=node_keys)
+
+    def define_volumes(self):
+        graph = TaskGraph.from_settings()
+        self.schedule_define_volumes(graph)
+        graph.run()
+
+    def define_networks(self):
+        graph = TaskGraph.from_settings()
+        self.schedule_define_networks(graph)
+        graph.run()
+
+    def define_nodes(self):
+        graph = TaskGraph.from_settings()
+        self.schedule_define_nodes(graph)
+        graph.run()
+
+    def start_networks(self):
+        graph = TaskGraph.from_settings()
+        self.schedule_start_networks(graph)
+        graph.run()
+
+    def start_nodes(self, nodes=None):
+        graph = TaskGraph.from_settings()
+        self.schedule_start_nodes(graph, nodes)
+        graph.run()
+
+    def destroy(self, **kwargs):
+        graph = TaskGraph.from_settings()
+        self.schedule_destroy(graph)
+        graph.run()
+
+    def erase(self):
+        graph = TaskGraph.from_settings()
+        self.schedule_erase(graph)
+        graph.run()
         self.delete()
 
     @classmethod
@@ -131,31 +250,32 @@ class Group(BaseModel):
             if env.get_nodes().count() == 0:
                 env.erase()
 
-    # TO REWRITE FOR LIBVIRT DRIVER
+    def get_nodes_without_domains(self, inventory=None):
+        """Get nodes which don't exist on the hypervisor anymore
+
+        :param inventory: result of self.driver.inventory() if it has
+                          been already requested
+        :rtype: list
+        """
+        if inventory is None:
+            inventory = self.driver.inventory()
+        if inventory is None:
+            # driver can't list its nodes
+            return []
+        return [node for node in self.get_nodes()
+                if node.uuid not in inventory]
+
     @classmethod
     def synchronize_all(cls):
-        driver = cls.get_driver()
-        nodes = {driver._get_name(e.name, n.name): n
-                 for e in cls.list_all()
-                 for n in e.get_nodes()}
-        domains = set(driver.node_list())
-
-        # FIXME (AWoodward) This willy nilly wacks domains when you run this
-        #  on domains that are outside the scope of devops, if anything this
-        #  should cause domains to be imported into db instead of undefined.
-        #  It also leaves network and volumes around too
-        #  Disabled untill a safer implmentation arrives
-
-        # Undefine domains without devops nodes
-        #
-        # domains_to_undefine = domains - set(nodes.keys())
-        # for d in domains_to_undefine:
-        #    driver.node_undefine_by_name(d)
+        # NOTE: domains without devops nodes are not undefined: they
+        # could be created outside of devops
 
         # Remove devops nodes without domains
-        nodes_to_remove = set(nodes.keys()) - domains
-        for n in nodes_to_remove:
-            nodes[n].delete()
+        nodes_to_remove = []
+        for group in cls.list_all():
+            nodes_to_remove.extend(group.get_nodes_without_domains())
+        for node in nodes_to_remove:
+            node.delete()
         cls.erase_empty()
 
         logger.info('Undefined domains: {0}, removed nodes: {1}'.format(
@@ -244,4 +364,4 @@ class Group(BaseModel):
             raise DevopsObjNotFound(Volume, **kwargs)
 
     def get_volumes(self, **kwargs):
-        return self.volume_set.filter(**kwargs)
+        return filter_related(self.volume_set, **kwargs)
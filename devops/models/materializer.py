@@ -0,0 +1,432 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+from copy import deepcopy
+
+from django.db.models import Q
+from netaddr import IPNetwork
+
+from devops.error import DevopsError
+from devops.helpers.helpers import generate_mac
+from devops.helpers import loader
+from devops.models.network import Address
+from devops.models.network import Interface
+from devops.models.network import L2NetworkDevice
+from devops.models.network import NetworkConfig
+from devops.models.network import NetworkPool
+from devops.models.node import Node
+from devops.models.volume import DiskDevice
+from devops.models.volume import Volume
+
+
+# renamed driver, see Environment.add_groups()
+_LEGACY_DRIVERS = {
+    'devops.driver.libvirt.libvirt_driver': 'devops.driver.libvirt',
+}
+
+
+class TemplateMaterializer(object):
+    """Creates objects of the environment template with bulk inserts
+
+    The whole template is validated before any changes in the database.
+    Groups, drivers and address pools are created one by one, the rest of
+    objects are created by one bulk_create() per model: l2 network
+    devices, network pools, nodes, interfaces, addresses, network configs,
+    volumes and disk devices. MAC and IP addresses are allocated in memory.
+
+    Objects are the same as created by Group.add_nodes() and the other
+    add_*() methods, rows are inserted in the same order.
+    """
+
+    def __init__(self, full_config):
+        self.config = full_config['template']['devops_settings']
+
+    def validate(self):
+        """Check the whole template
+
+        :raises: DevopsError with all found problems
+        """
+        errors = []
+        config = self.config
+        if not config.get('env_name'):
+            errors.append("'env_name' is not set")
+
+        address_pools = config.get('address_pools')
+        if not isinstance(address_pools, dict):
+            errors.append("'address_pools' should be a dict")
+            address_pools = {}
+        for name, data in address_pools.items():
+            errors.extend(self._validate_address_pool(name, data))
+
+        groups = config.get('groups')
+        if not isinstance(groups, list):
+            errors.append("'groups' should be a list")
+            groups = []
+        # names of l2 network devices are looked up in the environment
+        l2_names = collections.Counter()
+        for group_data in groups:
+            l2_names.update(list(group_data.get('l2_network_devices') or {}))
+        group_names = set()
+        macs = set()
+        for group_data in groups:
+            name = group_data.get('name')
+            if name in group_names:
+                errors.append('Group {!r} is duplicated'.format(name))
+            group_names.add(name)
+            errors.extend(self._validate_group(
+                group_data, set(address_pools), l2_names, macs))
+
+        if errors:
+            raise DevopsError(
+                'Template of environment {0!r} is invalid:\n{1}'.format(
+                    config.get('env_name'), '\n'.join(errors)))
+
+    @staticmethod
+    def _validate_address_pool(name, data):
+        prefix = 'Address pool {!r}'.format(name)
+        try:
+            networks, net_prefix = data['net'].split(':')
+            for network in networks.split(','):
+                IPNetwork(network)
+            int(net_prefix)
+        except Exception:
+            return ["{0}: 'net' should be <network>[,<network>]:<prefix>, "
+                    "got {1!r}".format(prefix, data.get('net'))]
+        return []
+
+    def _validate_group(self, group_data, pool_names, l2_names, macs):
+        errors = []
+        prefix = 'Group {!r}'.format(group_data.get('name'))
+        if not group_data.get('name'):
+            errors.append("{}: 'name' is not set".format(prefix))
+
+        driver_name = (group_data.get('driver') or {}).get('name')
+        driver_name = _LEGACY_DRIVERS.get(driver_name, driver_name)
+        try:
+            loader.load_class('{}:Driver'.format(driver_name))
+        except (ImportError, AttributeError, ValueError):
+            errors.append('{0}: driver {1!r} could not be loaded'.format(
+                prefix, driver_name))
+
+        l2_network_devices = group_data.get('l2_network_devices') or {}
+        for name, params in l2_network_devices.items():
+            pool_name = params.get('address_pool')
+            if pool_name is not None and pool_name not in pool_names:
+                errors.append(
+                    '{0}: address pool {1!r} of l2 network device {2!r} is '
+                    'not found'.format(prefix, pool_name, name))
+
+        network_pools = group_data.get('network_pools') or {}
+        for name, pool_name in network_pools.items():
+            if pool_name not in pool_names:
+                errors.append(
+                    '{0}: address pool {1!r} of network pool {2!r} is not '
+                    'found'.format(prefix, pool_name, name))
+
+        volume_names = set()
+        for volume in group_data.get('group_volumes') or []:
+            if not volume.get('name'):
+                errors.append("{}: 'name' of volume is not set".format(
+                    prefix))
+            elif volume['name'] in volume_names:
+                errors.append('{0}: volume {1!r} is duplicated'.format(
+                    prefix, volume['name']))
+            elif 'backing_store' in volume:
+                errors.append('{0}: backing store of group volume {1!r} is '
+                              'not supported'.format(prefix, volume['name']))
+            volume_names.add(volume.get('name'))
+
+        node_names = set()
+        for node_cfg in group_data.get('nodes') or []:
+            name = node_cfg.get('name')
+            if not name:
+                errors.append("{}: 'name' of node is not set".format(prefix))
+            elif name in node_names:
+                errors.append('{0}: node {1!r} is duplicated'.format(
+                    prefix, name))
+            node_names.add(name)
+            errors.extend(self._validate_node(
+                node_cfg, '{0}, node {1!r}'.format(prefix, name),
+                volume_names, l2_names, macs))
+        return errors
+
+    @staticmethod
+    def _validate_node(node_cfg, prefix, group_volume_names, l2_names, macs):
+        errors = []
+        for key in ('role', 'params'):
+            if key not in node_cfg:
+                errors.append('{0}: {1!r} is not set'.format(prefix, key))
+        params = node_cfg.get('params') or {}
+
+        for interface in params.get('interfaces', []):
+            if 'label' not in interface:
+                errors.append("{}: 'label' of interface is not set".format(
+                    prefix))
+            l2_name = interface.get('l2_network_device')
+            if l2_name and l2_names[l2_name] != 1:
+                errors.append(
+                    '{0}: l2 network device {1!r} of interface {2!r} is {3}'
+                    ''.format(prefix, l2_name, interface.get('label'),
+                              'ambiguous' if l2_names[l2_name] else
+                              'not found'))
+            mac_address = interface.get('mac_address')
+            if mac_address:
+                if mac_address in macs:
+                    errors.append('{0}: MAC address {1!r} is duplicated'
+                                  ''.format(prefix, mac_address))
+                macs.add(mac_address)
+
+        volume_names = set()
+        for volume in params.get('volumes', []):
+            if not volume.get('name'):
+                errors.append("{}: 'name' of volume is not set".format(
+                    prefix))
+            elif volume['name'] in volume_names:
+                errors.append('{0}: volume {1!r} is duplicated'.format(
+                    prefix, volume['name']))
+            volume_names.add(volume.get('name'))
+            backing_store = volume.get('backing_store')
+            if (backing_store is not None and
+                    backing_store not in group_volume_names):
+                errors.append(
+                    '{0}: backing store {1!r} of volume {2!r} is not found '
+                    'in group volumes'.format(prefix, backing_store,
+                                              volume.get('name')))
+        return errors
+
+    def materialize(self, environment):
+        """Create all objects of the template in the environment
+
+        Should be called in a transaction after validate().
+
+        :type environment: Environment
+        """
+        config = self.config
+        environment.add_groups(config['groups'])
+        environment.add_address_pools(config['address_pools'])
+
+        groups = {group.name: group for group in
+                  environment.get_groups().select_related('driver')}
+        pools = {pool.name: pool
+                 for pool in environment.get_address_pools()}
+        group_list = [(groups[group_data['name']], group_data)
+                      for group_data in config['groups']]
+
+        l2_network_devices = self._create_l2_network_devices(
+            group_list, pools)
+        self._create_network_pools(group_list, pools)
+        nodes = self._create_nodes(group_list)
+        self._create_interfaces(nodes, l2_network_devices, pools)
+        self._create_network_configs(nodes)
+        self._create_volumes(group_list, nodes)
+
+    @staticmethod
+    def _bulk_create(model, objects, key_fields, *filters):
+        """Insert objects and set their ids
+
+        bulk_create() doesn't set ids, so they are requested by the fields
+        which are unique for the objects.
+
+        :param key_fields: names of fields unique for the objects
+        :param filters: Q objects to select inserted objects
+        """
+        if not objects:
+            return
+        model.objects.bulk_create(objects)
+        ids = {}
+        for row in model.objects.filter(*filters).values_list(
+                'id', *key_fields):
+            ids[row[1:]] = row[0]
+        for obj in objects:
+            obj.id = ids[tuple(getattr(obj, field) for field in key_fields)]
+            obj._state.adding = False
+            obj._state.db = model.objects.db
+
+    def _create_l2_network_devices(self, group_list, pools):
+        l2_network_devices = []
+        for group, group_data in group_list:
+            cls = group.driver.get_model_class('L2NetworkDevice')
+            for name, params in (
+                    group_data.get('l2_network_devices') or {}).items():
+                params = dict(params)
+                if 'address_pool' in params:
+                    params['address_pool'] = pools[params['address_pool']]
+                l2_network_devices.append(
+                    cls(group=group, name=name, **params))
+        self._bulk_create(
+            L2NetworkDevice, l2_network_devices, ('group_id', 'name'),
+            Q(group__in=[group for group, _ in group_list]))
+        return {l2_dev.name: l2_dev for l2_dev in l2_network_devices}
+
+    @staticmethod
+    def _create_network_pools(group_list, pools):
+        network_pools = [
+            NetworkPool(group=group, name=name,
+                        address_pool=pools[address_pool_name])
+            for group, group_data in group_list
+            for name, address_pool_name in (
+                group_data.get('network_pools') or {}).items()]
+        if network_pools:
+            NetworkPool.objects.bulk_create(network_pools)
+
+    def _create_nodes(self, group_list):
+        """Create nodes
+
+        :rtype: list
+        :return: (node, node params) tuples
+        """
+        nodes = []
+        for group, group_data in group_list:
+            cls = group.driver.get_model_class('Node')
+            for node_cfg in group_data.get('nodes') or []:
+                params = deepcopy(node_cfg['params'])
+                node_params = {
+                    'interfaces': params.pop('interfaces', []),
+                    'network_config': params.pop('network_config', {}),
+                    'volumes': params.pop('volumes', []),
+                }
+                node = cls(group=group, name=node_cfg['name'],
+                           role=node_cfg['role'], **params)
+                nodes.append((node, node_params))
+        self._bulk_create(
+            Node, [node for node, _ in nodes], ('group_id', 'name'),
+            Q(group__in=[group for group, _ in group_list]))
+        return nodes
+
+    def _create_interfaces(self, nodes, l2_network_devices, pools):
+        interfaces = []
+        # interfaces with generated MACs
+        generated = []
+        for node, node_params in nodes:
+            cls = node.driver.get_model_class('Interface')
+            for interface_data in node_params['interfaces']:
+                l2_network_device = None
+                if interface_data.get('l2_network_device'):
+                    l2_network_device = l2_network_devices[
+                        interface_data['l2_network_device']]
+                interface = cls(
+                    node=node,
+                    label=interface_data['label'],
+                    l2_network_device=l2_network_device,
+                    type='network',
+                    mac_address=interface_data.get('mac_address'),
+                    model=interface_data.get('interface_model', 'virtio'),
+                    features=interface_data.get('features') or [])
+                if not interface.mac_address:
+                    interface.mac_address = generate_mac()
+                    generated.append(interface)
+                interfaces.append(interface)
+        if not interfaces:
+            return
+
+        # generated MACs should not be used by other interfaces
+        used = set(Interface.objects.filter(
+            mac_address__in=[iface.mac_address for iface in generated]
+        ).values_list('mac_address', flat=True))
+        generated_ids = set(id(iface) for iface in generated)
+        used.update(iface.mac_address for iface in interfaces
+                    if id(iface) not in generated_ids)
+        for interface in generated:
+            while interface.mac_address in used:
+                interface.mac_address = generate_mac()
+            used.add(interface.mac_address)
+
+        self._bulk_create(Interface, interfaces, ('mac_address',),
+                          Q(node__in=[node for node, _ in nodes]))
+
+        # one allocation per address pool
+        pool_interfaces = collections.defaultdict(list)
+        for interface in interfaces:
+            l2_network_device = interface.l2_network_device
+            if (l2_network_device is not None and
+                    l2_network_device.address_pool_id is not None):
+                pool_interfaces[l2_network_device.address_pool_id].append(
+                    interface)
+        ips = {}
+        for pool in pools.values():
+            pool_ifaces = pool_interfaces.get(pool.id)
+            if pool_ifaces:
+                ips.update(zip([id(iface) for iface in pool_ifaces],
+                               pool.next_ips(len(pool_ifaces))))
+        addresses = [Address(interface=interface,
+                             ip_address=str(ips[id(interface)]))
+                     for interface in interfaces if id(interface) in ips]
+        if addresses:
+            Address.objects.bulk_create(addresses)
+
+    @staticmethod
+    def _create_network_configs(nodes):
+        network_configs = [
+            NetworkConfig(node=node, label=label,
+                          networks=data.get('networks', []),
+                          aggregation=data.get('aggregation'),
+                          parents=data.get('parents', []))
+            for node, node_params in nodes
+            for label, data in node_params['network_config'].items()]
+        if network_configs:
+            NetworkConfig.objects.bulk_create(network_configs)
+
+    def _create_volumes(self, group_list, nodes):
+        group_nodes = collections.defaultdict(list)
+        for node, node_params in nodes:
+            group_nodes[node.group_id].append((node, node_params))
+
+        volumes = []
+        # node volumes with (backing store, device, bus)
+        attachments = []
+        for group, group_data in group_list:
+            cls = group.driver.get_model_class('Volume')
+            group_volumes = {}
+            for volume_data in group_data.get('group_volumes') or []:
+                params = dict(volume_data)
+                name = params.pop('name')
+                group_volumes[name] = cls(group=group, name=name, **params)
+                volumes.append(group_volumes[name])
+
+            for node, node_params in group_nodes[group.id]:
+                for volume_data in node_params['volumes']:
+                    params = dict(volume_data)
+                    name = params.pop('name')
+                    device = params.pop('device', 'disk')
+                    bus = params.pop('bus', 'virtio')
+                    backing_store = params.pop('backing_store', None)
+                    volume = cls(node=node, name=name, **params)
+                    volumes.append(volume)
+                    attachments.append((volume, group_volumes.get(
+                        backing_store), device, bus))
+
+        self._bulk_create(
+            Volume, volumes, ('group_id', 'node_id', 'name'),
+            Q(group__in=[group for group, _ in group_list]) |
+            Q(node__in=[node for node, _ in nodes]))
+
+        based_on = collections.defaultdict(list)
+        disk_devices = []
+        disk_names = {}
+        for volume, backing_store, device, bus in attachments:
+            if backing_store is not None:
+                volume.backing_store = backing_store
+                based_on[backing_store.id].append(volume.id)
+            node = volume.node
+            if node.id not in disk_names:
+                disk_names[node.id] = node.free_disk_names(used=())
+            disk_devices += node.build_disk_devices(
+                volume, disk_names[node.id], device=device, bus=bus)
+
+        for backing_store_id, volume_ids in based_on.items():
+            Volume.objects.filter(id__in=volume_ids).update(
+                backing_store=backing_store_id)
+        if disk_devices:
+            DiskDevice.objects.bulk_create(disk_devices)
@@ -13,6 +13,7 @@
 #    under the License.
 
 from copy import deepcopy
+import itertools
 
 from django.db import IntegrityError
 from django.db import models
@@ -197,31 +198,93 @@ class AddressPool(ParamedModel, BaseModel):
             return None
 
     def next_ip(self):
-        for ip in self.ip_network.iter_hosts():
-            # if ip < self.ip_pool_start or ip > self.ip_pool_end:
-            # Skip net, gw and broadcast addresses in the address pool
-            if ip < self.ip_network[2] or ip > self.ip_network[-2]:
+        return self.next_ips(1)[0]
+
+    def next_ips(self, count):
+        """Return the first count free IPs of the address pool
+
+        Used IPs are requested by one query. The address pool row is locked
+        until the end of the current transaction, so concurrent allocators
+        wait for the addresses to be created.
+
+        :type count: int
+        :rtype: list of IPAddress
+        """
+        with transaction.atomic():
+            list(AddressPool.objects.select_for_update().filter(
+                pk=self.pk).values_list('pk', flat=True))
+            used = set(Address.objects.filter(
+                interface__l2_network_device__address_pool=self
+            ).values_list('ip_address', flat=True))
+
+        ips = list(itertools.islice(self.iter_free_ips(used), count))
+        if len(ips) < count:
+            raise DevopsError(
+                "No more free addresses in the address pool {0}"
+                " with CIDR {1}".format(self.name, self.net))
+        return ips
+
+    def iter_free_ips(self, used):
+        """Iterate over IPs of the address pool which are not used
+
+        :param used: set of str(IP) already used in the address pool
+        :rtype: iterator
+        """
+        ip_network = self.ip_network
+        # Skip net, gw and broadcast addresses in the address pool
+        first = ip_network[2]
+        last = ip_network[-2]
+        for ip in ip_network.iter_hosts():
+            if ip < first or ip > last:
                 continue
-            already_exists = Address.objects.filter(
-                interface__l2_network_device__address_pool=self,
-                ip_address=str(ip)).exists()
-            if already_exists:
+            if str(ip) in used:
                 continue
-            return ip
-        raise DevopsError("No more free addresses in the address pool {0}"
-                          " with CIDR {1}".format(self.name, self.net))
+            yield ip
+
+    @staticmethod
+    def _relative_to_ip(ip_network, ip_id):
+        """Get an IP from IPNetwork ip's list by index
+
+        :param ip_network: IPNetwork object
+        :param ip_id: string, if contains '+' or '-' then it is
+                      used as index of an IP address in ip_network,
+                      else it is considered as IP address.
+
+        :rtype : str(IP)
+        """
+        if isinstance(ip_id, int):
+            return str(ip_network[int(ip_id)])
+        else:
+            return str(ip_id)
+
+    @classmethod
+    def _translate_ips(cls, ip_network, params):
+        """Translate indexes into IP addresses in ip_reserved and ip_ranges
+
+        :type ip_network: IPNetwork
+        :type params: dict
+        """
+        for ip_res, ip_id in params.get('ip_reserved', {}).items():
+            params['ip_reserved'][ip_res] = cls._relative_to_ip(
+                ip_network, ip_id)
+        for ip_range, (start, end) in params.get('ip_ranges', {}).items():
+            params['ip_ranges'][ip_range] = (
+                cls._relative_to_ip(ip_network, start),
+                cls._relative_to_ip(ip_network, end))
 
     @classmethod
     def _safe_create_network(cls, name, pool, environment, **params):
+        existing_nets = set(cls.objects.values_list('net', flat=True))
         for ip_network in pool:
-            if cls.objects.filter(net=str(ip_network)).exists():
+            if str(ip_network) in existing_nets:
                 continue
 
             new_params = deepcopy(params)
             new_params['net'] = ip_network
+            cls._translate_ips(ip_network, new_params)
             try:
                 with transaction.atomic():
-                    return cls.objects.create(
+                    address_pool = cls.objects.create(
                         environment=environment,
                         name=name,
                         **new_params
@@ -234,6 +297,13 @@ class AddressPool(ParamedModel, BaseModel):
                         ''.format(name))
                 continue
 
+            pool.allocate(ip_network)
+            # Store translated IPs to template
+            for key in ('ip_reserved', 'ip_ranges'):
+                if key in params:
+                    params[key].update(new_params[key])
+            return address_pool
+
         raise DevopsError("There is no network pool available for creating "
                           "address pool {}".format(name))
 
@@ -243,53 +313,25 @@ class AddressPool(ParamedModel, BaseModel):
 
         :rtype : Network
         """
-        if pool is None:
+        if pool is not None:
+            return cls._safe_create_network(
+                environment=environment,
+                name=name,
+                pool=pool,
+                **params
+            )
+
+        with environment.allocation_snapshot() as allocated_networks:
             pool = IpNetworksPool(
                 networks=[IPNetwork('10.0.0.0/16')],
                 prefix=24,
-                allocated_networks=environment.get_allocated_networks())
-
-        address_pool = cls._safe_create_network(
-            environment=environment,
-            name=name,
-            pool=pool,
-            **params
-        )
-
-        # Translate indexes into IP addresses for ip_reserved and ip_ranges
-        def _relative_to_ip(ip_network, ip_id):
-            """Get an IP from IPNetwork ip's list by index
-
-            :param ip_network: IPNetwork object
-            :param ip_id: string, if contains '+' or '-' then it is
-                          used as index of an IP address in ip_network,
-                          else it is considered as IP address.
-
-            :rtype : str(IP)
-            """
-            if isinstance(ip_id, int):
-                return str(ip_network[int(ip_id)])
-            else:
-                return str(ip_id)
-
-        if 'ip_reserved' in params:
-            for ip_res in params['ip_reserved'].keys():
-                ip = _relative_to_ip(address_pool.ip_network,
-                                     params['ip_reserved'][ip_res])
-                params['ip_reserved'][ip_res] = ip      # Store to template
-                address_pool.ip_reserved[ip_res] = ip   # Store to the object
-
-        if 'ip_ranges' in params:
-            for ip_range in params['ip_ranges']:
-                ipr_start = _relative_to_ip(address_pool.ip_network,
-                                            params['ip_ranges'][ip_range][0])
-                ipr_end = _relative_to_ip(address_pool.ip_network,
-                                          params['ip_ranges'][ip_range][1])
-                params['ip_ranges'][ip_range] = (ipr_start, ipr_end)
-                address_pool.ip_ranges[ip_range] = (ipr_start, ipr_end)
-
-        address_pool.save()
-        return address_pool
+                allocated_networks=allocated_networks)
+            return cls._safe_create_network(
+                environment=environment,
+                name=name,
+                pool=pool,
+                **params
+            )
 
 
 class NetworkPool(BaseModel):
@@ -521,11 +563,13 @@ class Interface(ParamedModel):
         self.delete()
 
     def add_address(self):
-        ip = self.l2_network_device.address_pool.next_ip()
-        Address.objects.create(
-            ip_address=str(ip),
-            interface=self,
-        )
+        # address pool is locked by next_ip() until the address is created
+        with transaction.atomic():
+            ip = self.l2_network_device.address_pool.next_ip()
+            Address.objects.create(
+                ip_address=str(ip),
+                interface=self,
+            )
 
     @property
     def is_blocked(self):
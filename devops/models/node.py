@@ -18,16 +18,21 @@ from django.db import models
 from django.utils.functional import cached_property
 import six
 
+from devops.error import DevopsError
 from devops.error import DevopsObjNotFound
 from devops.helpers.helpers import tcp_ping_
+from devops.helpers.helpers import wait
 from devops.helpers.helpers import wait_pass
 from devops.helpers import loader
 from devops.helpers.ssh_client import SSHClient
 from devops import logger
 from devops.models.base import BaseModel
+from devops.models.base import filter_related
+from devops.models.base import get_prefetched
 from devops.models.base import ParamedModel
 from devops.models.base import ParamedModelType
 from devops.models.base import ParamField
+from devops.models.network import Address
 from devops.models.network import NetworkConfig
 from devops.models.volume import Volume
 
@@ -153,6 +158,9 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
     deploy_timeout = ParamField(default=3600)
     deploy_check_cmd = ParamField()
 
+    # target devices of disks, see next_disk_name() and free_disk_names()
+    DISK_NAMES = tuple('sd' + c for c in 'abcdefghijklmnopqrstuvwxyz')
+
     @property
     def driver(self):
         drv = self.group.driver
@@ -176,6 +184,12 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
                          ''.format(self.role))
             return None
 
+    def close_remotes(self):
+        """Close cached SSH connections to addresses of the node"""
+        for ip in Address.objects.filter(
+                interface__node=self).values_list('ip_address', flat=True):
+            SSHClient.close_connections(hostname=ip)
+
     def define(self, *args, **kwargs):
         for iface in self.interfaces:
             iface.define()
@@ -185,29 +199,29 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
         pass
 
     def destroy(self, *args, **kwargs):
-        SSHClient.close_connections()
+        self.close_remotes()
 
     def erase(self, *args, **kwargs):
         self.remove()
 
     def remove(self, *args, **kwargs):
-        SSHClient.close_connections()
+        self.close_remotes()
         self.erase_volumes()
         for iface in self.interfaces:
             iface.remove()
         self.delete()
 
     def suspend(self, *args, **kwargs):
-        SSHClient.close_connections()
+        self.close_remotes()
 
     def resume(self, *args, **kwargs):
         pass
 
     def snapshot(self, *args, **kwargs):
-        SSHClient.close_connections()
+        self.close_remotes()
 
     def revert(self, *args, **kwargs):
-        SSHClient.close_connections()
+        self.close_remotes()
 
     # for fuel-qa compatibility
     def has_snapshot(self, *args, **kwargs):
@@ -217,10 +231,36 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
         pass
 
     def shutdown(self):
-        SSHClient.close_connections()
+        self.close_remotes()
 
     def reset(self):
-        SSHClient.close_connections()
+        self.close_remotes()
+
+    def is_active(self):
+        return False
+
+    def wait_for_state(self, state, timeout=60, interval=5):
+        """Wait until node comes to the state
+
+        Drivers which are able to receive state change notifications
+        override this method, default implementation polls is_active().
+
+        :param state: 'running' or 'shutoff'
+        :type timeout: int
+        :type interval: int
+        :rtype: float
+        :return: number of seconds that is left
+        """
+        if state not in ('running', 'shutoff'):
+            raise DevopsError(
+                'Unknown node state {!r}, expected one of: '
+                'running, shutoff'.format(state))
+        expected = state == 'running'
+        return wait(
+            lambda: self.is_active() == expected,
+            interval=interval, timeout=timeout,
+            timeout_msg="Node {0} wasn't {1} in {2} sec".format(
+                self.name, state, timeout))
 
     def get_vnc_port(self):
         return None
@@ -236,7 +276,7 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
 
     @property
     def interfaces(self):
-        return self.interface_set.order_by('id')
+        return filter_related(self.interface_set)
 
     @property
     def network_configs(self):
@@ -253,8 +293,7 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
         return self.role == 'fuel_slave'
 
     def next_disk_name(self):
-        disk_names = ('sd' + c for c in list('abcdefghijklmnopqrstuvwxyz'))
-        for disk_name in disk_names:
+        for disk_name in self.DISK_NAMES:
             if not self.disk_devices.filter(target_dev=disk_name).exists():
                 return disk_name
 
@@ -280,9 +319,21 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
         return self.interface_set.get(label=label)
 
     def get_ip_address_by_network_name(self, name, interface=None):
-        interface = interface or self.interface_set.filter(
-            l2_network_device__name=name).order_by('id')[0]
-        return interface.address_set.get(interface=interface).ip_address
+        if interface is None:
+            interfaces = get_prefetched(self.interface_set)
+            if interfaces is None:
+                interfaces = self.interface_set.filter(
+                    l2_network_device__name=name).order_by('id')
+            else:
+                interfaces = [iface for iface in interfaces
+                              if iface.l2_network_device_id is not None and
+                              iface.l2_network_device.name == name]
+            interface = interfaces[0]
+        addresses = get_prefetched(interface.address_set)
+        if addresses is None or len(addresses) != 1:
+            # let the database raise DoesNotExist / MultipleObjectsReturned
+            return interface.address_set.get(interface=interface).ip_address
+        return addresses[0].ip_address
 
     def get_ip_address_by_nailgun_network_name(self, name):
         interface = self.get_interface_by_nailgun_network_name(name)
@@ -403,11 +454,36 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
 
         :rtype : DiskDevice
         """
+        disk_devices = self.build_disk_devices(
+            volume, self.free_disk_names(), device=device, type=type,
+            bus=bus, target_dev=target_dev)
+        for disk_device in disk_devices:
+            disk_device.save()
+        if len(disk_devices) == 1:
+            return disk_devices[0]
+
+    def free_disk_names(self, used=None):
+        """Iterate over disk names which are not used by the node
+
+        :param used: names of the disks of the node, requested from
+                     the database if None
+        :rtype: iterator
+        """
+        if used is None:
+            used = set(disk.target_dev for disk in self.disk_devices)
+        return (name for name in self.DISK_NAMES if name not in used)
+
+    def build_disk_devices(self, volume, disk_names, device='disk',
+                           type='file', bus='virtio', target_dev=None):
+        """Build disk devices attaching the volume, without saving them
+
+        :param disk_names: iterator of free disk names, see free_disk_names
+        :rtype: list of DiskDevice
+        """
         cls = self.driver.get_model_class('DiskDevice')
-        return cls.objects.create(
-            device=device, type=type, bus=bus,
-            target_dev=target_dev or self.next_disk_name(),
-            volume=volume, node=self)
+        return [cls(device=device, type=type, bus=bus,
+                    target_dev=target_dev or next(disk_names, None),
+                    volume=volume, node=self)]
 
     # NEW
     def get_volume(self, **kwargs):
@@ -418,7 +494,7 @@ class Node(six.with_metaclass(ExtendableNodeType, ParamedModel, BaseModel)):
 
     # NEW
     def get_volumes(self, **kwargs):
-        return self.volume_set.filter(**kwargs).order_by('id')
+        return filter_related(self.volume_set, **kwargs)
 
     # NEW
     def erase_volumes(self):
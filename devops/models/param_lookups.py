@@ -0,0 +1,204 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Lookups of ParamField values stored in the params json field
+
+Lookups are translated to SQL predicates for backends with json functions:
+* PostgreSQL >= 9.4: jsonb operators, params column is casted to jsonb
+  (no-op after migration 0003 which changes the column type to jsonb)
+* SQLite with JSON1 extension: json_extract() and json_each()
+
+Other backends and values which can't be compared in SQL are processed
+by :func:`match` in python.
+"""
+
+import json
+import operator
+
+from django.db import DatabaseError
+import six
+
+
+LOOKUPS = ('exact', 'in', 'gt', 'gte', 'lt', 'lte', 'contains')
+
+_OPERATORS = {
+    'gt': '>',
+    'gte': '>=',
+    'lt': '<',
+    'lte': '<=',
+}
+
+_PY_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+_SCALAR_TYPES = six.string_types + six.integer_types + (float, )
+
+# connection alias -> json functions are available
+_json_support = {}
+
+
+def split_lookup(key):
+    """Split filter key to the path of param keys and the lookup type
+
+    :type key: str
+    :rtype: tuple
+    :return: (['multi', 'sub'], 'exact') for 'multi__sub'
+    """
+    path = key.split('__')
+    lookup = 'exact'
+    if len(path) > 1 and path[-1] in LOOKUPS:
+        lookup = path.pop()
+    return path, lookup
+
+
+def match(item_val, lookup, value):
+    """Check the lookup in python
+
+    :rtype: bool
+    """
+    try:
+        if lookup == 'exact':
+            return item_val == value
+        if lookup == 'in':
+            return item_val in value
+        if lookup == 'contains':
+            return value in item_val
+        if item_val is None or value is None:
+            return False
+        return _PY_OPERATORS[lookup](item_val, value)
+    except TypeError:
+        return False
+
+
+def has_json_support(connection):
+    """Check if json predicates could be used with the connection"""
+    if connection.alias in _json_support:
+        return _json_support[connection.alias]
+
+    supported = False
+    if connection.vendor == 'postgresql':
+        supported = getattr(connection, 'pg_version', 0) >= 90400
+    elif connection.vendor == 'sqlite':
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT json_extract('{}', '$')")
+            supported = True
+        except DatabaseError:
+            supported = False
+    _json_support[connection.alias] = supported
+    return supported
+
+
+def _is_scalar(value):
+    return isinstance(value, _SCALAR_TYPES)
+
+
+def _sqlite_predicate(column, path, lookup, value):
+    json_path = '$' + ''.join('."{}"'.format(key) for key in path)
+    expr = 'json_extract({}, %s)'.format(column)
+
+    if lookup == 'exact':
+        if value is None:
+            return '{} IS NULL'.format(expr), [json_path]
+        if _is_scalar(value):
+            return '{} = %s'.format(expr), [json_path, value]
+    elif lookup == 'in':
+        values = list(value)
+        if not values:
+            return '0 = 1', []
+        if all(_is_scalar(v) for v in values):
+            return '{0} IN ({1})'.format(
+                expr, ', '.join(['%s'] * len(values))), [json_path] + values
+    elif lookup == 'contains':
+        if _is_scalar(value):
+            sql = ("CASE json_type({col}, %s) "
+                   "WHEN 'array' THEN EXISTS (SELECT 1 FROM json_each("
+                   "{col}, %s) WHERE json_each.value = %s) ".format(
+                       col=column))
+            params = [json_path, json_path, value]
+            if isinstance(value, six.string_types):
+                sql += "WHEN 'text' THEN instr({}, %s) > 0 ".format(expr)
+                params += [json_path, value]
+            return sql + 'ELSE 0 END', params
+    elif value is not None and _is_scalar(value):
+        # sqlite compares values of different types, python doesn't
+        if isinstance(value, six.string_types):
+            types = "'text'"
+        else:
+            types = "'integer', 'real', 'true', 'false'"
+        return ('json_type({col}, %s) IN ({types}) AND {expr} {op} %s'.format(
+            col=column, types=types, expr=expr, op=_OPERATORS[lookup]),
+            [json_path, json_path, value])
+    return None
+
+
+def _postgresql_predicate(column, path, lookup, value):
+    expr = '({}::jsonb #> %s)'.format(column)
+    path = list(path)
+
+    if lookup == 'exact':
+        if value is None:
+            return ("({0} IS NULL OR {0} = 'null'::jsonb)".format(expr),
+                    [path, path])
+        return '{} = %s::jsonb'.format(expr), [path, json.dumps(value)]
+    elif lookup == 'in':
+        values = list(value)
+        if not values:
+            return '1 = 0', []
+        if None not in values:
+            return '{0} IN ({1})'.format(
+                expr, ', '.join(['%s::jsonb'] * len(values))), (
+                [path] + [json.dumps(v) for v in values])
+    elif lookup == 'contains':
+        if _is_scalar(value):
+            sql = ("CASE jsonb_typeof({0}) "
+                   "WHEN 'array' THEN {0} @> %s::jsonb ".format(expr))
+            params = [path, path, json.dumps([value])]
+            if isinstance(value, six.string_types):
+                sql += ("WHEN 'string' THEN strpos({}::jsonb #>> %s, %s) "
+                        "> 0 ".format(column))
+                params += [path, value]
+            return sql + 'ELSE false END', params
+    elif value is not None and _is_scalar(value):
+        # jsonb values of different types are never equal, but could be
+        # compared, so check the type first like python does
+        return ('jsonb_typeof({0}) = jsonb_typeof(%s::jsonb) AND '
+                '{0} {1} %s::jsonb'.format(expr, _OPERATORS[lookup]),
+                [path, json.dumps(value), path, json.dumps(value)])
+    return None
+
+
+def get_predicate(connection, table, path, lookup, value):
+    """Translate the lookup to SQL predicate
+
+    :param connection: django db connection
+    :param table: table name of the model
+    :param path: list of param keys
+    :param lookup: one of LOOKUPS
+    :param value: value to compare with
+    :rtype: tuple or None
+    :return: (sql, params) for QuerySet.extra() or None if the lookup
+             could not be processed by the database
+    """
+    if not has_json_support(connection):
+        return None
+    qn = connection.ops.quote_name
+    column = '{0}.{1}'.format(qn(table), qn('params'))
+    if connection.vendor == 'postgresql':
+        return _postgresql_predicate(column, path, lookup, value)
+    return _sqlite_predicate(column, path, lookup, value)
@@ -292,3 +292,49 @@ CLOUD_IMAGE_DIR = os.environ.get(
 
 # Enable creating nwfilters for libvirt networks and interfaces
 ENABLE_LIBVIRT_NWFILTERS = get_var_as_bool('ENABLE_LIBVIRT_NWFILTERS', False)
+
+# Maximum number of concurrent define/start/destroy/erase operations
+# for the environment objects. Set PARALLEL_SERIAL_MODE to process
+# objects one by one.
+PARALLEL_WORKERS = int(os.environ.get('PARALLEL_WORKERS', 8))
+PARALLEL_SERIAL_MODE = get_var_as_bool('PARALLEL_SERIAL_MODE', False)
+
+# Number of libvirt connections opened to each hypervisor. Keepalive
+# messages are used to detect broken connections which are reopened
+# on the next request.
+LIBVIRT_POOL_SIZE = int(os.environ.get('LIBVIRT_POOL_SIZE', 1))
+LIBVIRT_KEEPALIVE_INTERVAL = int(
+    os.environ.get('LIBVIRT_KEEPALIVE_INTERVAL', 5))
+LIBVIRT_KEEPALIVE_COUNT = int(os.environ.get('LIBVIRT_KEEPALIVE_COUNT', 3))
+
+# Seconds to keep host capabilities and libvirt version requested from
+# the hypervisor, they are also requested again after reconnect
+LIBVIRT_HOST_INFO_TTL = int(os.environ.get('LIBVIRT_HOST_INFO_TTL', 600))
+
+# Volume upload: size of data read from the image at once, size of data
+# uploaded by one stream (failed stream is restarted from its offset,
+# 0 to upload the whole image in one stream), send zeros as holes
+LIBVIRT_UPLOAD_BUFFER_SIZE = int(
+    os.environ.get('LIBVIRT_UPLOAD_BUFFER_SIZE', 4 * 1024 ** 2))
+LIBVIRT_UPLOAD_SEGMENT_SIZE = int(
+    os.environ.get('LIBVIRT_UPLOAD_SEGMENT_SIZE', 1024 ** 3))
+LIBVIRT_UPLOAD_SPARSE = get_var_as_bool('LIBVIRT_UPLOAD_SPARSE', True)
+
+# Upload every source image to the storage pool once and create volumes
+# as thin qcow2 children of the cached image. Unused cached images are
+# removed when free space of the pool is less than
+# LIBVIRT_IMAGE_CACHE_MIN_FREE percents of its capacity.
+LIBVIRT_IMAGE_CACHE = get_var_as_bool('LIBVIRT_IMAGE_CACHE', False)
+LIBVIRT_IMAGE_CACHE_DIR = os.environ.get(
+    'LIBVIRT_IMAGE_CACHE_DIR', os.path.expanduser('~/.devops/image_cache'))
+LIBVIRT_IMAGE_CACHE_MIN_FREE = int(
+    os.environ.get('LIBVIRT_IMAGE_CACHE_MIN_FREE', 10))
+
+# Names of bridges and network devices reserved on the host are stored in
+# LIBVIRT_DEVICE_NAMES_DIR, so parallel processes don't take the same
+# name. A reservation expires in LIBVIRT_DEVICE_NAMES_TTL seconds if the
+# device doesn't appear on the host.
+LIBVIRT_DEVICE_NAMES_DIR = os.environ.get(
+    'LIBVIRT_DEVICE_NAMES_DIR', os.path.expanduser('~/.devops/device_names'))
+LIBVIRT_DEVICE_NAMES_TTL = int(
+    os.environ.get('LIBVIRT_DEVICE_NAMES_TTL', 600))
@@ -29,10 +29,13 @@ import devops
 from devops.error import DevopsObjNotFound
 from devops.helpers.helpers import utc_to_local
 from devops.helpers.ntp import sync_time
+from devops.helpers.queries import QueryCounter
 from devops.helpers.templates import create_devops_config
 from devops.helpers.templates import create_slave_config
 from devops.helpers.templates import get_devops_config
+from devops import logger
 from devops.models import Environment
+from devops.models import PooledEnvironment
 from devops import settings
 
 
@@ -52,26 +55,32 @@ class Shell(object):
                          "".format(self.params.name))
 
     def execute(self):
-        self.commands.get(self.params.command)(self)
+        with QueryCounter() as counter:
+            self.commands.get(self.params.command)(self)
+        logger.debug('Command {0!r}: {1} database queries'.format(
+            self.params.command, counter.count))
 
     def print_table(self, headers, columns):
         print(tabulate.tabulate(columns, headers=headers,
                                 tablefmt="simple"))
 
     def do_list(self):
-        env_list = Environment.list_all().values('name', 'created')
+        if self.params.list_ips:
+            env_list = Environment.list_all_graphs()
+        else:
+            env_list = Environment.list_all()
         columns = []
         for env in env_list:
-            column = collections.OrderedDict({'NAME': env['name']})
+            column = collections.OrderedDict({'NAME': env.name})
             if self.params.list_ips:
-                cur_env = Environment.get(name=env['name'])
                 admin_ip = ''
-                if 'admin' in [node.name for node in cur_env.get_nodes()]:
-                    admin_ip = (cur_env.get_node(name='admin').
-                                get_ip_address_by_network_name('admin'))
+                for node in env.get_nodes():
+                    if node.name == 'admin':
+                        admin_ip = node.get_ip_address_by_network_name(
+                            'admin')
                 column['ADMIN IP'] = admin_ip
             if self.params.timestamps:
-                column['CREATED'] = utc_to_local(env['created']).strftime(
+                column['CREATED'] = utc_to_local(env.created).strftime(
                     '%Y-%m-%d_%H:%M:%S')
             columns.append(column)
 
@@ -82,10 +91,22 @@ class Shell(object):
         return {'name': node.name,
                 'vnc': node.get_vnc_port()}
 
+    def get_vnc_port(self, node, inventories):
+        # one inventory request per driver instead of a request per node
+        if node.group.driver_id not in inventories:
+            inventories[node.group.driver_id] = node.driver.inventory()
+        inventory = inventories[node.group.driver_id]
+        if inventory is not None and node.uuid in inventory:
+            return inventory[node.uuid].vnc_port
+        return node.get_vnc_port()
+
     def do_show(self):
-        nodes = sorted(self.env.get_nodes(), key=lambda node: node.name)
+        env = self.env.get_graph(id=self.env.id)
+        nodes = sorted(env.get_nodes(), key=lambda node: node.name)
         headers = ("VNC", "NODE-NAME", "GROUP-NAME")
-        columns = [(node.get_vnc_port(), node.name, node.group.name)
+        inventories = {}
+        columns = [(self.get_vnc_port(node, inventories), node.name,
+                    node.group.name)
                    for node in nodes]
         self.print_table(headers=headers, columns=columns)
 
@@ -327,6 +348,41 @@ class Shell(object):
         self.check_param_show_help(self.params.node_name)
         self.env.get_node(name=self.params.node_name).reset()
 
+    def do_pool(self):
+        getattr(self, 'do_pool_' + self.params.pool_command)()
+
+    def do_pool_fill(self):
+        config = get_devops_config(self.params.env_config_name)
+        created = PooledEnvironment.fill(
+            pool_name=self.params.pool_name,
+            config=config,
+            count=self.params.env_count,
+            snapshot_name=self.params.pool_snapshot)
+        for entry in created:
+            print(entry.env_name)
+
+    def do_pool_checkout(self):
+        env = PooledEnvironment.checkout(
+            pool_name=self.params.pool_name,
+            name=self.params.new_env_name)
+        print(env.name)
+
+    def do_pool_return(self):
+        try:
+            env = PooledEnvironment.get_environment(self.params.env_name)
+        except DevopsObjNotFound:
+            sys.exit("Enviroment with name {} doesn't exist."
+                     "".format(self.params.env_name))
+        PooledEnvironment.release(env)
+
+    def do_pool_list(self):
+        headers = ("POOL", "ENVIRONMENT", "STATUS", "LABEL", "CLAIMED-BY")
+        columns = [(entry.pool_name, entry.environment.name, entry.status,
+                    entry.label or '', entry.claimed_by or '')
+                   for entry in PooledEnvironment.get_pool(
+                       self.params.pool_name)]
+        self.print_table(headers=headers, columns=columns)
+
     def check_param_show_help(self, parameter):
         if not parameter:
             self.args.append('-h')
@@ -358,7 +414,8 @@ class Shell(object):
         'admin-change': do_admin_change,
         'node-start': do_node_start,
         'node-destroy': do_node_destroy,
-        'node-reset': do_node_reset
+        'node-reset': do_node_reset,
+        'pool': do_pool,
     }
 
     def get_params(self):
@@ -619,6 +676,53 @@ class Shell(object):
                               help="Reset (restart) node in environment",
                               description="Reset a separate node in "
                                           "environment")
+        pool_parser = subparsers.add_parser(
+            'pool',
+            help="Manage warm pools of environments",
+            description="Prepare environments in advance, check them out "
+                        "and return them to the pool")
+        pool_subparsers = pool_parser.add_subparsers(
+            title="Pool commands", help='available commands',
+            dest='pool_command')
+        pool_fill_parser = pool_subparsers.add_parser(
+            'fill',
+            help="Create ready environments in the pool",
+            description="Create, start and snapshot environments from the "
+                        "template until the pool has the required number "
+                        "of them")
+        pool_fill_parser.add_argument('pool_name', help='pool name')
+        pool_fill_parser.add_argument('env_config_name',
+                                      help='environment template name')
+        pool_fill_parser.add_argument('--count', '-C', dest='env_count',
+                                      help='Number of environments in the '
+                                           'pool',
+                                      default=1, type=int)
+        pool_fill_parser.add_argument('--snapshot', dest='pool_snapshot',
+                                      help='Name of the snapshot to return '
+                                           'environments to',
+                                      default='ready')
+        pool_checkout_parser = pool_subparsers.add_parser(
+            'checkout',
+            help="Take ready environment from the pool",
+            description="Claim ready environment of the pool and print "
+                        "its name")
+        pool_checkout_parser.add_argument('pool_name', help='pool name')
+        pool_checkout_parser.add_argument('--env-name', dest='new_env_name',
+                                          help='Label the environment',
+                                          default=None)
+        pool_return_parser = pool_subparsers.add_parser(
+            'return',
+            help="Return environment to the pool",
+            description="Revert environment to the ready snapshot and "
+                        "return it to the pool")
+        pool_return_parser.add_argument('env_name',
+                                        help='environment name or label')
+        pool_list_parser = pool_subparsers.add_parser(
+            'list',
+            help="Show environments of the pools",
+            description="Show environments of the pools")
+        pool_list_parser.add_argument('pool_name', help='pool name',
+                                      nargs='?', default=None)
         if len(self.args) == 0:
             self.args = ['-h']
         return parser.parse_args(self.args)
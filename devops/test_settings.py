@@ -16,3 +16,6 @@ from devops.settings import *  # noqa
 
 # make tests faster
 DATABASES['default'] = {'ENGINE': 'django.db.backends.sqlite3'}
+
+# in-memory sqlite database is not shared between threads
+PARALLEL_SERIAL_MODE = True
@@ -0,0 +1,46 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Microbenchmarks
+
+Benchmarks are not collected by py.test, run them as modules, e.g.::
+
+    python -m devops.tests.benchmarks.bench_paramed_model
+"""
+
+from __future__ import print_function
+
+import os
+import timeit
+
+# benchmarks don't need the database, use the settings of unit tests
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'devops.test_settings')
+
+
+def run(benchmarks, number=10000, repeat=3):
+    """Run benchmarks and print time of a call
+
+    :param benchmarks: list of (name, function) pairs
+    :param number: number of calls in one measurement
+    :param repeat: number of measurements, the best one is reported
+    :rtype: dict
+    :return: microseconds per call by benchmark name
+    """
+    results = {}
+    width = max(len(name) for name, _ in benchmarks)
+    for name, func in benchmarks:
+        best = min(timeit.repeat(func, number=number, repeat=repeat))
+        results[name] = best / number * 10 ** 6
+        print('{0:<{1}}  {2:10.2f} us'.format(name, width, results[name]))
+    return results
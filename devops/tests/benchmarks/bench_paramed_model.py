@@ -0,0 +1,99 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per-call overhead of ParamedModel metadata
+
+'legacy' benchmarks repeat the computations which were done on every
+call before ParamedModelMetadata was introduced.
+"""
+
+from __future__ import print_function
+
+from devops.helpers import loader
+from devops.tests.benchmarks import run
+
+
+def legacy_field_names(model):
+    field_names = set()
+    _meta = model._meta
+    for field in _meta.get_fields():
+        if field.is_relation and field.many_to_one and \
+                field.related_model is None:
+            continue
+        if field.model != _meta.model and\
+                field.model._meta.concrete_model == _meta.concrete_model:
+            continue
+        field_names.add(field.name)
+        if hasattr(field, 'attname'):
+            field_names.add(field.attname)
+    return field_names
+
+
+def legacy_defined_params(cls):
+    param_names = []
+    for basecls in cls.__mro__:
+        if not hasattr(basecls, '_param_field_names'):
+            continue
+        param_names += basecls._param_field_names
+    return param_names
+
+
+def legacy_set_default_params(obj):
+    for basecls in obj.__class__.__mro__:
+        if not hasattr(basecls, '_param_field_names'):
+            continue
+        for param in basecls._param_field_names:
+            basecls.__dict__[param].set_default_value(obj)
+
+
+def main():
+    # models are imported after the benchmarks package sets up settings
+    from devops.models import Node
+
+    node = Node(name='node', role='fuel_slave')
+    node._class = loader.get_class_path(node)
+    class_path = node._class
+    meta = Node._paramed_meta
+
+    def legacy_init():
+        # params split and class lookup done by the constructor
+        kwargs = {'name': 'node', 'role': 'fuel_slave'}
+        for param in legacy_defined_params(Node):
+            if param in kwargs:
+                kwargs.pop(param)
+        loader.load_class(class_path)
+
+    def registry_init():
+        kwargs = {'name': 'node', 'role': 'fuel_slave'}
+        for param in list(kwargs):
+            if param in meta.param_name_set:
+                kwargs.pop(param)
+        meta.classes.get(class_path)
+
+    run([
+        ('legacy field names', lambda: legacy_field_names(Node)),
+        ('registry field names', lambda: meta.field_names),
+        ('legacy defined params', lambda: legacy_defined_params(Node)),
+        ('registry defined params', Node.get_defined_params),
+        ('legacy set_default_params',
+         lambda: legacy_set_default_params(node)),
+        ('registry set_default_params', node.set_default_params),
+        ('legacy constructor overhead', legacy_init),
+        ('registry constructor overhead', registry_init),
+        ('Node() constructor', lambda: Node(name='node', role='fuel_slave')),
+    ])
+
+
+if __name__ == '__main__':
+    main()
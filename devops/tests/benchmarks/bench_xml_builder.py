@@ -0,0 +1,178 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Generation of libvirt XML for environments of 1, 100 and 1000 nodes
+
+Every node gets domain, volume and snapshot XML, every 10 nodes share a
+network. 'legacy' benchmarks serialize XML by reparsing it with minidom
+as it was done before tostring_pretty() was introduced.
+"""
+
+from __future__ import print_function
+
+from xml.dom import minidom
+from xml.etree import ElementTree as ET
+
+import mock
+import six
+
+from devops.driver.libvirt import libvirt_xml_builder
+from devops.driver.libvirt.libvirt_xml_builder import LibvirtXMLBuilder
+from devops.helpers.xmlgenerator import XMLGenerator
+from devops.tests.benchmarks import run
+
+SIZES = (1, 100, 1000)
+
+
+class LegacyXMLGenerator(XMLGenerator):
+
+    def __str__(self):
+        rough_string = ET.tostring(self.root, encoding='utf-8')
+        reparsed = minidom.parseString(rough_string)
+        s = reparsed.toprettyxml(indent='    ', encoding='utf-8')
+        if six.PY2:
+            return s
+        else:
+            return str(s, encoding='utf-8')
+
+
+def build_node(num):
+    name = 'env_slave-{0:04d}'.format(num)
+    return LibvirtXMLBuilder.build_node_xml(
+        name=name,
+        hypervisor='kvm',
+        use_host_cpu=True,
+        vcpu=2,
+        memory=3072,
+        use_hugepages=False,
+        hpet=False,
+        os_type='hvm',
+        architecture='x86_64',
+        boot=['network', 'hd'],
+        reboot_timeout=None,
+        bootmenu_timeout=3000,
+        emulator='/usr/bin/qemu-system-x86_64',
+        has_vnc=True,
+        vnc_password=None,
+        local_disk_devices=[dict(
+            disk_type='file',
+            disk_device='disk',
+            disk_volume_format='qcow2',
+            disk_volume_path='/var/lib/libvirt/images/{0}_{1}'.format(
+                name, disk),
+            disk_bus='virtio',
+            disk_target_dev='vd' + disk[-1],
+            disk_serial='{0:032x}'.format(num),
+            disk_wwn=None,
+        ) for disk in ('system_a', 'cinder_b', 'swift_c')],
+        interfaces=[dict(
+            interface_type='network',
+            interface_mac_address='64:00:00:00:{0:02x}:{1:02x}'.format(
+                num % 256, iface),
+            interface_network_name='env_net{0}'.format(iface),
+            interface_target_dev=None,
+            interface_model='virtio',
+            interface_filter=None,
+        ) for iface in range(5)],
+        acpi=False,
+        numa=[],
+    )
+
+
+def build_volume(num):
+    return LibvirtXMLBuilder.build_volume_xml(
+        name='env_slave-{0:04d}_system'.format(num),
+        capacity=50 * 1024 ** 3,
+        vol_format='qcow2',
+        backing_store_path='/var/lib/libvirt/images/base.qcow2',
+        backing_store_format='qcow2')
+
+
+def build_snapshot(num):
+    return LibvirtXMLBuilder.build_snapshot_xml(
+        name='snap1',
+        description='snapshot of slave-{0:04d}'.format(num),
+        external=True,
+        memory_file='/var/lib/libvirt/snapshots/slave-{0:04d}'.format(num),
+        domain_isactive=True,
+        local_disk_devices=[dict(
+            disk_target_dev='vda',
+            disk_volume_path='/var/lib/libvirt/images/slave-{0:04d}.snap1'
+                             ''.format(num))])
+
+
+def build_network(num):
+    return LibvirtXMLBuilder.build_network_xml(
+        network_name='env_net{0}'.format(num),
+        bridge_name='virbr{0}'.format(num),
+        addresses=[dict(mac='64:00:00:00:{0:02x}:{1:02x}'.format(num, i),
+                        ip='10.109.{0}.{1}'.format(num % 256, i + 2),
+                        name='slave-{0:04d}'.format(i))
+                   for i in range(10)],
+        forward='nat',
+        ip_network_address='10.109.{0}.1'.format(num % 256),
+        ip_network_prefixlen='24',
+        has_pxe_server=True,
+        dhcp=True,
+        dhcp_range_start='10.109.{0}.2'.format(num % 256),
+        dhcp_range_end='10.109.{0}.254'.format(num % 256),
+        tftp_root_dir='/tmp')
+
+
+def build_environment(nodes):
+    xmls = []
+    for num in range(nodes):
+        xmls.append(build_node(num))
+        xmls.append(build_volume(num))
+        xmls.append(build_snapshot(num))
+    for num in range(max(1, nodes // 10)):
+        xmls.append(build_network(num))
+    return xmls
+
+
+def legacy(func):
+    def wrapper(*args, **kwargs):
+        with mock.patch.object(libvirt_xml_builder, 'XMLGenerator',
+                               LegacyXMLGenerator):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def main():
+    # XML should be the same
+    assert build_environment(20) == legacy(build_environment)(20)
+
+    for nodes in SIZES:
+        benchmarks = []
+        for name, func in (('node', build_node),
+                           ('volume', build_volume),
+                           ('snapshot', build_snapshot),
+                           ('network', build_network)):
+            benchmarks.append((
+                'legacy {0} XML x{1}'.format(name, nodes),
+                legacy(lambda func=func: [func(n) for n in range(nodes)])))
+            benchmarks.append((
+                '{0} XML x{1}'.format(name, nodes),
+                lambda func=func: [func(n) for n in range(nodes)]))
+        benchmarks.append((
+            'legacy environment x{0}'.format(nodes),
+            legacy(lambda: build_environment(nodes))))
+        benchmarks.append((
+            'environment x{0}'.format(nodes),
+            lambda: build_environment(nodes)))
+        run(benchmarks, number=max(1, 1000 // nodes), repeat=3)
+
+
+if __name__ == '__main__':
+    main()
@@ -12,11 +12,13 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import shutil
+import tempfile
 
+from django.conf import settings
 from django.test import TestCase
 import mock
 
-from devops.driver.libvirt.libvirt_driver import LibvirtDriver
 from devops.driver.libvirt.libvirt_driver import LibvirtManager
 
 CAPS_XML = """
@@ -88,13 +90,23 @@ class LibvirtTestCase(TestCase):
         return m
 
     def setUp(self):
-        # reset device names
-        LibvirtDriver._device_name_generators = {}
+        # reset reserved device names
+        device_names_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, device_names_dir)
+        patcher = mock.patch.object(
+            settings, 'LIBVIRT_DEVICE_NAMES_DIR', device_names_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        LibvirtManager.device_names.clear()
+        LibvirtManager.host_infos.clear()
 
         self.libvirt_vol_up_mock = self.patch('libvirt.virStorageVol.upload')
         self.libvirt_vol_resize_mock = self.patch(
             'libvirt.virStorageVol.resize')
         self.libvirt_stream_snd_mock = self.patch('libvirt.virStream.sendAll')
+        self.libvirt_stream_send_mock = self.patch('libvirt.virStream.send')
+        self.libvirt_stream_hole_mock = self.patch(
+            'libvirt.virStream.sendHole')
         self.libvirt_stream_fin_mock = self.patch('libvirt.virStream.finish')
 
         self.libvirt_nwfilter_define_mock = self.patch(
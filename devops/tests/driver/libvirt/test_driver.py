@@ -12,6 +12,9 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+from threading import Event
+from threading import Thread
+import time
 import xml.etree.ElementTree as ET
 
 from django.test import TestCase
@@ -19,8 +22,13 @@ import libvirt
 import mock
 from netaddr import IPNetwork
 
+from devops.driver.libvirt.libvirt_device_names import LibvirtDeviceNames
+from devops.driver.libvirt.libvirt_driver import _HandleCache
 from devops.driver.libvirt.libvirt_driver import _LibvirtManager
 from devops.driver.libvirt.libvirt_driver import LibvirtDriver
+from devops.error import DevopsError
+from devops.error import TimeoutError
+from devops.models import Driver
 from devops.models import Environment
 from devops.tests.driver.libvirt.base import LibvirtTestCase
 
@@ -40,24 +48,24 @@ class TestLibvirtManager(TestCase):
 
     def test_init(self):
         self.libvirt_mock.virInitialize.assert_called_once_with()
-        assert self.manager.connections == {}
+        assert self.manager.pools == {}
 
     def test_get_connection(self):
-        assert self.manager.connections == {}
+        assert self.manager.pools == {}
 
         # get connection
         c = self.manager.get_connection('qemu:///system')
 
         self.libvirt_mock.open.assert_called_once_with('qemu:///system')
         assert c is self.libvirt_mock.open.return_value
-        assert self.manager.connections == {'qemu:///system': c}
+        assert list(self.manager.pools.keys()) == ['qemu:///system']
 
         # get the same connection
         c2 = self.manager.get_connection('qemu:///system')
 
         self.libvirt_mock.open.assert_called_once_with('qemu:///system')
         assert c2 is c
-        assert self.manager.connections == {'qemu:///system': c}
+        assert list(self.manager.pools.keys()) == ['qemu:///system']
 
         self.libvirt_mock.open.reset_mock()
 
@@ -65,9 +73,142 @@ class TestLibvirtManager(TestCase):
         c3 = self.manager.get_connection('test:///default')
 
         self.libvirt_mock.open.assert_called_once_with('test:///default')
-        assert c is self.libvirt_mock.open.return_value
-        assert self.manager.connections == {'qemu:///system': c,
-                                            'test:///default': c3}
+        assert c3 is self.libvirt_mock.open.return_value
+        assert sorted(self.manager.pools.keys()) == ['qemu:///system',
+                                                     'test:///default']
+
+    def test_reconnect(self):
+        cache = self.manager.get_handle_cache('qemu:///system')
+        cache.put('domain', 'uuid1', mock.Mock())
+
+        c = self.manager.get_connection('qemu:///system')
+        c.isAlive.return_value = 0
+        self.libvirt_mock.open.return_value = mock.Mock()
+
+        c2 = self.manager.get_connection('qemu:///system')
+        assert c2 is not c
+        c.close.assert_called_once_with()
+        assert len(cache) == 0
+        stats = self.manager.get_pool('qemu:///system').stats
+        assert stats['opened'] == 2
+        assert stats['reconnects'] == 1
+
+    @mock.patch('devops.driver.libvirt.libvirt_driver.settings')
+    def test_pool(self, settings_mock):
+        settings_mock.LIBVIRT_POOL_SIZE = 2
+        self.libvirt_mock.open.side_effect = lambda uri: mock.Mock()
+        pool = self.manager.get_pool('qemu:///system')
+        assert pool.size == 2
+
+        conns = []
+        threads = [Thread(target=lambda: conns.append(pool.get()))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        assert conns[0] is conns[2]
+        assert conns[1] is conns[3]
+        assert conns[0] is not conns[1]
+
+        with pool.checkout() as c1:
+            with pool.checkout() as c2:
+                assert c1 is not c2
+                assert pool.stats['in_use'] == 2
+        assert pool.stats == {
+            'size': 2, 'connected': 2, 'in_use': 0, 'opened': 2,
+            'reconnects': 0, 'checkouts': 2}
+
+        pool.close()
+        assert pool.stats['connected'] == 0
+
+    def test_get_handle_cache(self):
+        cache = self.manager.get_handle_cache('qemu:///system')
+        assert isinstance(cache, _HandleCache)
+        assert self.manager.get_handle_cache('qemu:///system') is cache
+        assert self.manager.get_handle_cache('test:///default') is not cache
+
+    def test_wait_for_domain(self):
+        predicate = mock.Mock(side_effect=[False, True])
+        left = self.manager.wait_for_domain(
+            'qemu:///system', 'uuid1', predicate, timeout=5, interval=0.01)
+        assert 0 < left <= 5
+        assert predicate.call_count == 2
+        assert self.manager._domain_waiters == {}
+
+    def test_wait_for_domain_timeout(self):
+        predicate = mock.Mock(return_value=False)
+        with self.assertRaises(TimeoutError):
+            self.manager.wait_for_domain(
+                'qemu:///system', 'uuid1', predicate, timeout=0.05,
+                interval=0.01, timeout_msg='not ready')
+        assert self.manager._domain_waiters == {}
+
+    def test_notify_domain_waiters(self):
+        ready = Event()
+        waiting = Event()
+
+        def predicate():
+            waiting.set()
+            return ready.is_set()
+
+        def notify():
+            waiting.wait(5)
+            ready.set()
+            self.manager._notify_domain_waiters('qemu:///system', 'uuid1')
+
+        self.manager._event_connections.add('qemu:///system')
+        thread = Thread(target=notify)
+        thread.start()
+        start = time.time()
+        self.manager.wait_for_domain(
+            'qemu:///system', 'uuid1', predicate, timeout=60, interval=30)
+        thread.join()
+        assert time.time() - start < 30
+
+
+class TestHandleCache(TestCase):
+
+    def test_get(self):
+        cache = _HandleCache()
+        lookup = mock.Mock()
+
+        h1 = cache.get('domain', 'uuid1', lookup)
+        lookup.assert_called_once_with('uuid1')
+        assert h1 is lookup.return_value
+        assert cache.get('domain', 'uuid1', lookup) is h1
+        assert lookup.call_count == 1
+
+        cache.get('network', 'uuid1', lookup)
+        assert lookup.call_count == 2
+        assert cache.stats == {
+            'size': 2, 'hits': 1, 'misses': 2, 'invalidations': 0}
+
+    def test_lookup_error(self):
+        cache = _HandleCache()
+        lookup = mock.Mock(side_effect=libvirt.libvirtError('not found'))
+
+        with self.assertRaises(libvirt.libvirtError):
+            cache.get('volume', 'key1', lookup)
+        assert len(cache) == 0
+
+    def test_put_invalidate(self):
+        cache = _HandleCache()
+        lookup = mock.Mock()
+        handle = mock.Mock()
+
+        cache.put('domain', 'uuid1', handle)
+        assert cache.get('domain', 'uuid1', lookup) is handle
+        assert lookup.called is False
+
+        cache.invalidate('domain', 'uuid1')
+        cache.invalidate('domain', 'uuid2')
+        assert cache.get('domain', 'uuid1', lookup) is lookup.return_value
+
+        cache.put('volume', 'key1', handle)
+        cache.clear()
+        assert len(cache) == 0
+        assert cache.stats == {
+            'size': 0, 'hits': 1, 'misses': 1, 'invalidations': 3}
 
 
 class TestLibvirtDriver(LibvirtTestCase):
@@ -119,6 +260,37 @@ class TestLibvirtDriver(LibvirtTestCase):
     def test_get_capabilities(self):
         assert isinstance(self.d.get_capabilities(), ET.Element)
 
+    def test_capabilities_shared_by_drivers(self):
+        other_driver = Driver.objects.get(pk=self.d.pk)
+        assert other_driver is not self.d
+        assert self.d.capabilities is other_driver.capabilities
+        assert self.caps_mock.call_count == 1
+
+        other_driver.refresh_host_info()
+        assert self.d.capabilities is not None
+        assert self.caps_mock.call_count == 2
+
+    def test_capabilities_ttl(self):
+        self.d.host_info.ttl = 0
+        self.d.get_capabilities()
+        self.d.get_capabilities()
+        assert self.caps_mock.call_count == 2
+
+    def test_get_emulator(self):
+        emulator = '/usr/bin/test-emulator'
+        assert self.d.get_emulator('x86_64', 'test') == emulator
+        assert self.d.get_emulator('x86_64', 'test') == emulator
+        assert self.caps_mock.call_count == 1
+        with self.assertRaises(DevopsError):
+            self.d.get_emulator('x86_64', 'kvm')
+
+    def test_get_version_cached(self):
+        version = self.patch('libvirt.virConnect.getLibVersion',
+                             return_value=3004000)
+        assert self.d.get_libvirt_version() == 3004000
+        assert self.d.get_libvirt_version() == 3004000
+        assert version.call_count == 1
+
     def test_get_node_list(self):
         assert self.d.node_list() == []
         self.node = self.group.add_node(
@@ -147,6 +319,133 @@ class TestLibvirtDriver(LibvirtTestCase):
     def test_get_version(self):
         assert isinstance(self.d.get_libvirt_version(), int)
 
+    def test_inventory(self):
+        assert self.d.inventory() == {}
+        self.node = self.group.add_node(
+            name='test_node',
+            role='default',
+            architecture='i686',
+            hypervisor='test',
+        )
+        self.node.define()
+
+        inventory = self.d.inventory()
+        assert list(inventory.keys()) == [self.node.uuid]
+        dom = inventory[self.node.uuid]
+        assert dom.uuid == self.node.uuid
+        assert dom.name == 'test_env_test_node'
+        assert dom.state == libvirt.VIR_DOMAIN_SHUTOFF
+        assert dom.active is False
+        assert dom.vnc_port == '-1'
+        assert dom.vcpu == 1
+        assert dom.memory == 1024
+
+        self.node.start()
+        dom = self.d.inventory()[self.node.uuid]
+        assert dom.state == libvirt.VIR_DOMAIN_RUNNING
+        assert dom.active is True
+
+    def test_inventory_stats(self):
+        dom = mock.Mock(spec=libvirt.virDomain)
+        dom.UUIDString.return_value = 'uuid1'
+        dom.name.return_value = 'dom1'
+        dom.XMLDesc.return_value = (
+            '<domain><devices>'
+            '<graphics type="vnc" port="5900"/>'
+            '</devices></domain>')
+        with mock.patch.object(self.d.conn, 'getAllDomainStats') as stats:
+            stats.return_value = [(dom, {
+                'state.state': libvirt.VIR_DOMAIN_RUNNING,
+                'balloon.maximum': 2097152,
+                'vcpu.current': 2,
+                'block.count': 1,
+                'block.0.name': 'sda',
+                'block.0.allocation': 100,
+                'net.count': 1,
+                'net.0.name': 'vnet0',
+                'net.0.rx.bytes': 10,
+            })]
+            inventory = self.d.inventory()
+
+        # domain XML is requested on access to the VNC port only
+        assert dom.XMLDesc.called is False
+        assert inventory['uuid1'].vnc_port == '5900'
+        assert inventory['uuid1'].vnc_port == '5900'
+        dom.XMLDesc.assert_called_once_with(0)
+        assert inventory['uuid1'].memory == 2048
+        assert inventory['uuid1'].vcpu == 2
+        assert inventory['uuid1'].block == {'sda': {'allocation': 100}}
+        assert inventory['uuid1'].interfaces == {'vnet0': {'rx.bytes': 10}}
+        assert self.d.handles.get('domain', 'uuid1', mock.Mock()) is dom
+
+    def test_has_snapshot(self):
+        self.node = self.group.add_node(
+            name='test_node',
+            role='default',
+            architecture='i686',
+            hypervisor='test',
+        )
+        self.node.define()
+        self.node.start()
+        self.node.snapshot(name='test1')
+        group2 = self.env.add_group(
+            group_name='test_group2',
+            driver_name='devops.driver.libvirt',
+            connection_string='test:///default')
+        group2.driver = self.group.driver
+        with mock.patch.object(
+                self.env, 'get_groups', return_value=[self.group, group2]):
+            with mock.patch.object(
+                    LibvirtDriver, 'inventory', autospec=True,
+                    side_effect=LibvirtDriver.inventory) as inventory:
+                with mock.patch.object(libvirt.virDomain, 'XMLDesc') as xml:
+                    assert self.env.has_snapshot('test2') is False
+                    assert self.env.has_snapshot('test1') is True
+        # one request per driver for every has_snapshot() call
+        assert inventory.call_count == 2
+        assert xml.called is False
+
+    def test_synchronize_all(self):
+        self.node = self.group.add_node(
+            name='test_node',
+            role='default',
+            architecture='i686',
+            hypervisor='test',
+        )
+        self.node.define()
+        node2 = self.group.add_node(
+            name='test_node2',
+            role='default',
+            architecture='i686',
+            hypervisor='test',
+        )
+        assert self.env.has_snapshot('test1') is False
+
+        Environment.synchronize_all()
+
+        assert list(self.env.get_nodes()) == [self.node]
+        assert not self.env.get_nodes().filter(pk=node2.pk).exists()
+
+    def test_handles(self):
+        assert self.d.handles is self.d.handles
+        self.node = self.group.add_node(
+            name='test_node',
+            role='default',
+            architecture='i686',
+            hypervisor='test',
+        )
+        self.node.define()
+
+        stats = self.d.handles.stats
+        with mock.patch.object(self.d.conn, 'lookupByUUIDString') as lookup:
+            assert self.node._libvirt_node.name() == 'test_env_test_node'
+            assert self.node._libvirt_node.name() == 'test_env_test_node'
+            assert lookup.called is False
+        assert self.d.handles.stats['hits'] == stats['hits'] + 2
+
+        self.node.remove()
+        assert self.node._libvirt_node is None
+
 
 class TestLibvirtDriverDeviceNames(LibvirtTestCase):
 
@@ -253,3 +552,35 @@ class TestLibvirtDriverDeviceNames(LibvirtTestCase):
         assert self.d.get_available_device_name('other') == 'other0'
         assert self.d.get_available_device_name('other') == 'other1'
         assert self.d.get_available_device_name('other') == 'other2'
+
+    def test_get_allocated_device_names_incremental(self):
+        self.libvirt_list_all_devs_mock.return_value = [
+            self.dev_mock, self.dev2_mock]
+        assert self.d.get_allocated_device_names() == ['virnet1']
+        assert self.d.get_allocated_device_names() == ['virnet1']
+        assert self.dev_mock.XMLDesc.call_count == 1
+        assert self.dev2_mock.XMLDesc.call_count == 1
+
+        self.l2_net_dev.define()
+        bridge_name = self.l2_net_dev.bridge_name()
+        assert self.d.get_allocated_device_names() == [
+            'virnet1', bridge_name]
+
+        self.libvirt_list_all_devs_mock.return_value = []
+        assert self.d.get_allocated_device_names() == [bridge_name]
+
+    def test_get_available_device_name_reserved_by_other_process(self):
+        other = LibvirtDeviceNames(
+            self.d.connection_pool,
+            lock_dir=self.d.device_names.lock_dir)
+        self.libvirt_list_all_devs_mock.return_value = []
+        assert other.reserve('virbr') == 'virbr0'
+        assert self.d.get_available_device_name('virbr') == 'virbr1'
+        other.release('virbr0')
+        assert self.d.get_available_device_name('virbr') == 'virbr0'
+
+    def test_get_available_device_name_reservation_expired(self):
+        self.libvirt_list_all_devs_mock.return_value = []
+        self.d.device_names.ttl = 0
+        assert self.d.get_available_device_name('virbr') == 'virbr0'
+        assert self.d.get_available_device_name('virbr') == 'virbr0'
@@ -0,0 +1,210 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+import xml.etree.ElementTree as ET
+
+import libvirt
+import mock
+
+from devops.driver.libvirt.libvirt_image_cache import LibvirtImageCache
+
+
+class FakeVolume(object):
+
+    def __init__(self, pool, name, capacity, backing_store=None):
+        self.pool = pool
+        self._name = name
+        self.capacity = capacity
+        self.backing_store = backing_store
+
+    def name(self):
+        return self._name
+
+    def path(self):
+        return '/pool/' + self._name
+
+    def info(self):
+        return [0, self.capacity, self.capacity]
+
+    def XMLDesc(self, flags):
+        xml = '<volume><name>{0}</name>'.format(self._name)
+        if self.backing_store:
+            xml += '<backingStore><path>{0}</path></backingStore>'.format(
+                self.backing_store)
+        return xml + '</volume>'
+
+    def delete(self, flags):
+        self.pool.volumes.pop(self._name)
+
+
+class FakePool(object):
+
+    def __init__(self, capacity, available):
+        self.capacity = capacity
+        self.available = available
+        self.volumes = {}
+        self.created = []
+
+    def add(self, name, capacity, backing_store=None):
+        volume = FakeVolume(self, name, capacity, backing_store)
+        self.volumes[name] = volume
+        return volume
+
+    def createXML(self, xml, flags):
+        xml = ET.fromstring(xml)
+        name = xml.findtext('name')
+        self.created.append((name, xml.findtext('target/permissions/mode')))
+        return self.add(name, int(xml.findtext('capacity')))
+
+    def storageVolLookupByName(self, name):
+        if name not in self.volumes:
+            raise libvirt.libvirtError('Volume not found')
+        return self.volumes[name]
+
+    def listAllVolumes(self, flags):
+        return list(self.volumes.values())
+
+    def refresh(self, flags):
+        pass
+
+    def info(self):
+        allocation = self.capacity - self.available
+        return [0, self.capacity, allocation, self.available]
+
+
+class TestLibvirtImageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+        self.image = os.path.join(self.tmp_dir, 'image.qcow2')
+        with open(self.image, 'wb') as f:
+            f.write(b'image_data')
+        self.digest = hashlib.sha256(b'image_data').hexdigest()
+
+        self.pool = FakePool(capacity=1000, available=500)
+        self.conn = mock.Mock()
+        self.conn.getURI.return_value = 'qemu:///system'
+        self.conn.storagePoolLookupByName.return_value = self.pool
+
+        uploader_patcher = mock.patch(
+            'devops.driver.libvirt.libvirt_image_cache.LibvirtVolumeUploader')
+        self.uploader_mock = uploader_patcher.start()
+        self.addCleanup(uploader_patcher.stop)
+
+        self.cache = LibvirtImageCache(
+            self.conn, 'default',
+            cache_dir=os.path.join(self.tmp_dir, 'cache'), min_free=10,
+            upload_kwargs={'buffer_size': 1024})
+
+    def test_digest(self):
+        assert self.cache.digest(self.image) == self.digest
+        with mock.patch('hashlib.sha256') as sha_mock:
+            assert self.cache.digest(self.image) == self.digest
+        assert sha_mock.called is False
+
+        # file is changed
+        with open(self.image, 'wb') as f:
+            f.write(b'new_image_data')
+        assert self.cache.digest(self.image) == hashlib.sha256(
+            b'new_image_data').hexdigest()
+
+    def test_get_image(self):
+        name = 'devops_image_{0}_qcow2'.format(self.digest[:32])
+
+        volume = self.cache.get_image(self.image)
+        assert volume.name() == name
+        assert self.pool.created == [(name, '0444')]
+        self.uploader_mock.assert_called_once_with(volume, buffer_size=1024)
+        self.uploader_mock.return_value.upload.assert_called_once_with(
+            mock.ANY, 10)
+
+        # the image is uploaded once
+        self.uploader_mock.reset_mock()
+        assert self.cache.get_image(self.image) is volume
+        assert self.pool.created == [(name, '0444')]
+        assert self.uploader_mock.called is False
+
+        images = self.cache.list_images()
+        assert len(images) == 1
+        assert images[0].name == name
+        assert images[0].refcount == 0
+        assert images[0].last_used > 0
+
+    def test_get_image_upload_error(self):
+        self.uploader_mock.return_value.upload.side_effect = (
+            libvirt.libvirtError('Upload failed'))
+        with self.assertRaises(libvirt.libvirtError):
+            self.cache.get_image(self.image)
+        assert self.pool.volumes == {}
+
+    def test_get_image_incomplete(self):
+        name = 'devops_image_{0}_qcow2'.format(self.digest[:32])
+        incomplete = self.pool.add(name, 10)
+
+        volume = self.cache.get_image(self.image)
+        assert volume is not incomplete
+        assert self.uploader_mock.return_value.upload.called
+
+    def test_get_image_referenced(self):
+        name = 'devops_image_{0}_qcow2'.format(self.digest[:32])
+        volume = self.pool.add(name, 10)
+        self.pool.add('env_node_system', 10, backing_store=volume.path())
+
+        assert self.cache.get_image(self.image) is volume
+        assert self.uploader_mock.called is False
+        assert self.cache.list_images()[0].refcount == 1
+
+    def test_evict(self):
+        used = self.pool.add('devops_image_used_qcow2', 100)
+        self.pool.add('env_node_system', 10, backing_store=used.path())
+        self.pool.add('devops_image_old_qcow2', 100)
+        self.pool.add('devops_image_new_qcow2', 100)
+        self.cache._touch(self.cache._image_key('devops_image_old_qcow2'))
+        self.cache._touch(self.cache._image_key('devops_image_new_qcow2'))
+
+        # enough free space
+        assert self.cache.evict(required=400) == []
+
+        # 100 bytes of free space and 50 bytes more are required
+        self.pool.available = 100
+        assert self.cache.evict(required=50) == ['devops_image_old_qcow2']
+        assert sorted(self.pool.volumes) == [
+            'devops_image_new_qcow2', 'devops_image_used_qcow2',
+            'env_node_system']
+
+        # referenced image is never removed
+        self.pool.available = 0
+        assert self.cache.evict(required=1000) == ['devops_image_new_qcow2']
+        assert sorted(self.pool.volumes) == [
+            'devops_image_used_qcow2', 'env_node_system']
+
+    def test_evict_locked(self):
+        self.pool.add('devops_image_old_qcow2', 100)
+        self.pool.add('devops_image_new_qcow2', 100)
+        self.cache._touch(self.cache._image_key('devops_image_old_qcow2'))
+        self.cache._touch(self.cache._image_key('devops_image_new_qcow2'))
+        self.pool.available = 100
+
+        # image locked by another process is skipped without waiting
+        with self.cache._lock('devops_image_old_qcow2'):
+            assert self.cache.evict(required=50) == [
+                'devops_image_new_qcow2']
+        assert sorted(self.pool.volumes) == ['devops_image_old_qcow2']
@@ -19,6 +19,8 @@ import libvirt
 import mock
 import pytest
 
+from devops.error import DevopsError
+from devops.error import TimeoutError
 from devops.helpers.helpers import xml_tostring
 from devops.models import Environment
 from devops.tests.driver.libvirt.base import LibvirtTestCase
@@ -193,6 +195,20 @@ class TestLibvirtNode(LibvirtTestCase):
 
         assert not self.node.exists()
 
+    def test_wait_for_state(self):
+        self.node.define()
+
+        assert self.node.wait_for_state('shutoff', timeout=1) > 0
+        self.node.start()
+        assert self.node.wait_for_state('running', timeout=1) > 0
+        self.node.suspend()
+        assert self.node.wait_for_state('paused', timeout=1) > 0
+
+        with pytest.raises(TimeoutError):
+            self.node.wait_for_state('shutoff', timeout=0.1)
+        with pytest.raises(DevopsError):
+            self.node.wait_for_state('unknown')
+
     def test_attrs(self):
         self.node.define()
 
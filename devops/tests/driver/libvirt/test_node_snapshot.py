@@ -238,6 +238,49 @@ class TestLibvirtNodeSnapshot(TestLibvirtNodeSnapshotBase):
         assert self.node.has_snapshot('test3') is False
         assert len(self.node.get_snapshots()) == 0
 
+    def test_snapshot_cache(self):
+        self.node.snapshot(name='test1')
+        self.node.snapshot(name='test2')
+
+        snapshots = {snap.name: snap for snap in self.node.get_snapshots()}
+        assert snapshots['test1'].children_num == 1
+        assert snapshots['test1'].parent_name is None
+        assert snapshots['test2'].children_num == 0
+        assert snapshots['test2'].parent_name == 'test1'
+        assert self.node._get_snapshot('test1') is snapshots['test1']
+
+        with mock.patch('libvirt.virDomainSnapshot.getXMLDesc') as xml_mock:
+            snapshot = self.node._get_snapshot('test2')
+            assert snapshot.info.name == 'test2'
+            assert snapshot.created == snapshot.info.created
+            assert snapshot.state == snapshot.info.state
+            assert xml_mock.called is False
+
+        self.node.snapshot(name='test3')
+        snapshot = self.node._get_snapshot('test2')
+        assert snapshot is not snapshots['test2']
+        assert snapshot.children_num == 1
+
+        snapshot.invalidate()
+        with mock.patch('libvirt.virDomainSnapshot.getXMLDesc') as xml_mock:
+            xml_mock.return_value = snapshots['test2'].xml
+            assert snapshot.state == snapshots['test2'].state
+            xml_mock.assert_called_once_with(0)
+
+    def test_env_snapshot_revert(self):
+        self.node.start()
+
+        durations = self.env.snapshot(name='test1', suspend=True)
+        assert list(durations) == ['tnode']
+        assert self.node.has_snapshot('test1')
+        assert self.node._get_snapshot('test1').state == 'paused'
+        assert self.node._libvirt_node.info()[0] == libvirt.VIR_DOMAIN_RUNNING
+
+        with mock.patch('libvirt.virDomain.revertToSnapshot') as rev_mock:
+            durations = self.env.revert(name='test1')
+            assert rev_mock.called
+        assert list(durations) == ['tnode']
+
     def test_remove_node_with_snapshot(self):
         self.node.snapshot(name='test1')
         assert self.node.has_snapshot('test1')
@@ -14,6 +14,7 @@
 
 import collections
 
+import libvirt
 import mock
 import pytest
 
@@ -168,15 +169,53 @@ class TestLibvirtVolume(LibvirtTestCase):
         assert volume.capacity is None
         assert volume.get_format() == 'qcow2'
 
-        volume.upload('/tmp/admin.iso')
+        with self.settings(LIBVIRT_UPLOAD_SPARSE=False):
+            volume.upload('/tmp/admin.iso')
         assert self.libvirt_vol_resize_mock.called is False
+        # image is uploaded by 1Gb segments, mocked file ends earlier
         self.libvirt_vol_up_mock.assert_has_calls((
-            mock.call(flags=0, length=5368709120, offset=0, stream=mock.ANY),
-            mock.call(flags=0, length=5368709120, offset=0, stream=mock.ANY),
+            mock.call(flags=0, length=1073741824, offset=0, stream=mock.ANY),
         ))
+        self.libvirt_stream_send_mock.assert_called_with('image_data')
         assert volume.capacity is None
         assert volume.get_format() == 'qcow2'
 
+    def test_upload_retry(self):
+        volume = self.node.add_volume(
+            name='test_volume',
+            source_image='/tmp/admin.iso',
+        )
+        volume.define()
+        libvirt_volume = volume._libvirt_volume
+
+        self.libvirt_vol_up_mock.side_effect = [
+            libvirt.libvirtError('connection reset'), None]
+        with self.settings(LIBVIRT_UPLOAD_SPARSE=False):
+            volume.upload('/tmp/admin.iso')
+
+        # failed segment is uploaded again with a new handle of the volume
+        assert self.libvirt_vol_up_mock.call_count == 2
+        assert volume._libvirt_volume is not libvirt_volume
+        assert volume._libvirt_volume.name() == libvirt_volume.name()
+        self.libvirt_stream_send_mock.assert_called_once_with('image_data')
+
+    def test_upload_retries_exceeded(self):
+        volume = self.node.add_volume(
+            name='test_volume',
+            source_image='/tmp/admin.iso',
+        )
+        volume.define()
+
+        self.libvirt_vol_up_mock.side_effect = libvirt.libvirtError(
+            'connection reset')
+        with self.settings(LIBVIRT_UPLOAD_SPARSE=False):
+            with pytest.raises(libvirt.libvirtError):
+                volume.upload('/tmp/admin.iso')
+
+        # the failed segment is retried by the uploader only, the whole
+        # upload is not restarted
+        assert self.libvirt_vol_up_mock.call_count == 4
+
     def test_upload_resize(self):
         volume = self.node.add_volume(
             name='test_volume',
@@ -190,3 +229,24 @@ class TestLibvirtVolume(LibvirtTestCase):
         volume.upload('/tmp/admin2.iso')
         self.libvirt_vol_resize_mock.assert_called_once_with(6442000000)
         assert volume.capacity is None
+
+    def test_source_image_cache(self):
+        volume = self.node.add_volume(
+            name='test_volume',
+            source_image='/tmp/admin.iso',
+        )
+        base_image = mock.Mock()
+        base_image.path.return_value = '/default-pool/devops_image_qcow2'
+        base_image.info.return_value = [0, 10 * 1024 ** 3, 1024 ** 3]
+        image_cache_mock = self.patch(
+            'devops.driver.libvirt.libvirt_driver.LibvirtDriver.image_cache',
+            new_callable=mock.PropertyMock)
+        image_cache_mock.return_value.get_image.return_value = base_image
+
+        with self.settings(LIBVIRT_IMAGE_CACHE=True):
+            volume.define()
+
+        image_cache_mock.return_value.get_image.assert_called_once_with(
+            '/tmp/admin.iso', 'qcow2')
+        assert self.libvirt_vol_up_mock.called is False
+        assert volume.get_capacity() == 10 * 1024 ** 3
@@ -0,0 +1,138 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import io
+import unittest
+
+import libvirt
+import mock
+
+from devops.driver.libvirt.libvirt_volume_upload import LibvirtVolumeUploader
+
+CHUNK = LibvirtVolumeUploader.CHUNK_SIZE
+
+
+class TestLibvirtVolumeUploader(unittest.TestCase):
+
+    def setUp(self):
+        self.volume = mock.Mock(spec=libvirt.virStorageVol)
+        self.volume.name.return_value = 'vol'
+        self.stream = self.volume.connect.return_value.newStream.return_value
+        self.sent = []
+        self.stream.send.side_effect = self.sent.append
+        self.stream.sendHole.side_effect = (
+            lambda length, flags: self.sent.append(length))
+
+    def test_upload(self):
+        data = b'\1' * (CHUNK * 3 + 10)
+        progress = mock.Mock()
+        uploader = LibvirtVolumeUploader(
+            self.volume, buffer_size=CHUNK * 2, segment_size=0,
+            progress=progress)
+
+        assert uploader.upload(io.BytesIO(data), len(data)) == len(data)
+
+        self.volume.upload.assert_called_once_with(
+            stream=self.stream, offset=0, length=len(data), flags=0)
+        assert b''.join(self.sent) == data
+        assert [len(chunk) for chunk in self.sent] == [CHUNK] * 3 + [10]
+        self.stream.finish.assert_called_once_with()
+        progress.assert_called_with(len(data), len(data))
+        assert progress.call_count == 2
+
+    def test_upload_sparse(self):
+        data = b'\1' * CHUNK + b'\0' * (CHUNK * 2) + b'\0\1'
+        uploader = LibvirtVolumeUploader(
+            self.volume, buffer_size=CHUNK * 4, segment_size=0, sparse=True)
+
+        assert uploader.upload(io.BytesIO(data), len(data)) == len(data)
+
+        self.volume.upload.assert_called_once_with(
+            stream=self.stream, offset=0, length=len(data),
+            flags=libvirt.VIR_STORAGE_VOL_UPLOAD_SPARSE_STREAM)
+        self.stream.sendHole.assert_has_calls([
+            mock.call(CHUNK, 0), mock.call(CHUNK, 0)])
+        assert self.stream.send.call_args_list == [
+            mock.call(b'\1' * CHUNK), mock.call(b'\0\1')]
+
+    def test_upload_segments(self):
+        data = b'\1' * (CHUNK * 3)
+        uploader = LibvirtVolumeUploader(
+            self.volume, segment_size=CHUNK * 2)
+
+        assert uploader.upload(io.BytesIO(data), len(data)) == len(data)
+
+        assert self.volume.upload.call_args_list == [
+            mock.call(stream=self.stream, offset=0, length=CHUNK * 2,
+                      flags=0),
+            mock.call(stream=self.stream, offset=CHUNK * 2, length=CHUNK,
+                      flags=0),
+        ]
+        assert self.stream.finish.call_count == 2
+        assert b''.join(self.sent) == data
+
+    def test_upload_resume(self):
+        data = b'\1' * CHUNK + b'\2' * CHUNK
+        self.stream.finish.side_effect = [
+            None, libvirt.libvirtError('connection reset'), None]
+        uploader = LibvirtVolumeUploader(
+            self.volume, segment_size=CHUNK)
+
+        assert uploader.upload(io.BytesIO(data), len(data)) == len(data)
+
+        assert self.volume.upload.call_args_list == [
+            mock.call(stream=self.stream, offset=0, length=CHUNK, flags=0),
+            mock.call(stream=self.stream, offset=CHUNK, length=CHUNK,
+                      flags=0),
+            mock.call(stream=self.stream, offset=CHUNK, length=CHUNK,
+                      flags=0),
+        ]
+        self.stream.abort.assert_called_once_with()
+        assert self.sent == [b'\1' * CHUNK, b'\2' * CHUNK, b'\2' * CHUNK]
+
+    def test_upload_retry_lookup(self):
+        data = b'\1' * 10
+        self.stream.finish.side_effect = libvirt.libvirtError('reset')
+        new_volume = mock.Mock(spec=libvirt.virStorageVol)
+        new_volume.name.return_value = 'vol'
+        new_stream = new_volume.connect.return_value.newStream.return_value
+        lookup = mock.Mock(return_value=new_volume)
+        uploader = LibvirtVolumeUploader(self.volume, lookup=lookup)
+
+        assert uploader.upload(io.BytesIO(data), len(data)) == len(data)
+
+        lookup.assert_called_once_with()
+        self.volume.upload.assert_called_once_with(
+            stream=self.stream, offset=0, length=len(data), flags=0)
+        self.stream.abort.assert_called_once_with()
+        new_volume.upload.assert_called_once_with(
+            stream=new_stream, offset=0, length=len(data), flags=0)
+        new_stream.send.assert_called_once_with(data)
+        new_stream.finish.assert_called_once_with()
+
+    def test_upload_retries_exceeded(self):
+        data = b'\1' * 10
+        self.stream.finish.side_effect = libvirt.libvirtError('fail')
+        uploader = LibvirtVolumeUploader(self.volume, retries=2)
+
+        with self.assertRaises(libvirt.libvirtError):
+            uploader.upload(io.BytesIO(data), len(data))
+        assert self.volume.upload.call_count == 3
+
+    def test_upload_short_file(self):
+        uploader = LibvirtVolumeUploader(self.volume, segment_size=CHUNK)
+
+        assert uploader.upload(io.BytesIO(b'\1' * 10), CHUNK * 3) == 10
+        self.volume.upload.assert_called_once_with(
+            stream=self.stream, offset=0, length=CHUNK, flags=0)
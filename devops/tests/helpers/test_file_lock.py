@@ -0,0 +1,44 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from devops.error import TimeoutError
+from devops.helpers.file_lock import FileLock
+
+
+class TestFileLock(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+        self.path = os.path.join(self.tmp_dir, 'locks', 'test.lock')
+
+    def test_lock(self):
+        lock = FileLock(self.path)
+        with lock:
+            assert lock.locked
+            assert os.path.exists(self.path)
+        assert not lock.locked
+        # released lock can be taken again
+        with FileLock(self.path, timeout=0):
+            pass
+
+    def test_timeout(self):
+        with FileLock(self.path):
+            with self.assertRaises(TimeoutError):
+                FileLock(self.path, timeout=0.2, interval=0.05).acquire()
@@ -20,6 +20,7 @@ import unittest
 
 from netaddr import IPNetwork
 
+from devops.helpers.network import AllocatedNetworks
 from devops.helpers.network import IpNetworksPool
 
 
@@ -47,3 +48,52 @@ class TestNetworkHelpers(unittest.TestCase):
         assert (IPNetwork('10.1.1.0/24') not in networks) is True
         assert (IPNetwork('10.1.2.0/24') in networks) is True
         assert (IPNetwork('10.1.3.0/24') not in networks) is True
+
+    def test_getting_subnetworks_skips_large_allocated(self):
+        pool = IpNetworksPool(
+            networks=[IPNetwork('10.0.0.0/8')], prefix=24,
+            allocated_networks=[
+                IPNetwork('10.0.0.0/9'),
+                IPNetwork('10.128.0.0/25'),
+                IPNetwork('fd00::/8'),
+            ])
+        networks = iter(pool)
+        assert next(networks) == IPNetwork('10.128.1.0/24')
+        assert next(networks) == IPNetwork('10.128.2.0/24')
+
+    def test_allocate_shared(self):
+        allocated_networks = AllocatedNetworks([IPNetwork('10.1.0.0/24')])
+        pool1 = IpNetworksPool(
+            networks=[IPNetwork('10.1.0.0/22')], prefix=24,
+            allocated_networks=allocated_networks)
+        pool2 = IpNetworksPool(
+            networks=[IPNetwork('10.1.0.0/22')], prefix=23,
+            allocated_networks=allocated_networks)
+        networks = iter(pool1)
+        assert next(networks) == IPNetwork('10.1.1.0/24')
+        pool1.allocate(IPNetwork('10.1.1.0/24'))
+        pool1.allocate(IPNetwork('10.1.2.0/24'))
+        assert next(networks) == IPNetwork('10.1.3.0/24')
+        assert list(pool2) == []
+
+
+class TestAllocatedNetworks(unittest.TestCase):
+
+    def test_add_merges_ranges(self):
+        allocated = AllocatedNetworks([
+            IPNetwork('10.1.2.0/24'),
+            IPNetwork('10.1.0.0/24'),
+        ])
+        assert allocated.overlaps(IPNetwork('10.1.0.0/22')) is True
+        assert allocated.overlaps(IPNetwork('10.1.1.0/24')) is False
+        allocated.add(IPNetwork('10.1.1.0/24'))
+        assert allocated.find_overlap(
+            4, IPNetwork('10.1.1.0/24').first,
+            IPNetwork('10.1.1.0/24').last) == IPNetwork('10.1.2.0/24').last
+        assert repr(allocated) == (
+            "AllocatedNetworks([IPRange('10.1.0.0', '10.1.2.255')])")
+
+    def test_versions(self):
+        allocated = AllocatedNetworks([IPNetwork('::/96')])
+        assert allocated.overlaps(IPNetwork('10.1.0.0/24')) is False
+        assert allocated.overlaps(IPNetwork('::10.1.0.0/120')) is True
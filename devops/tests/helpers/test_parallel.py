@@ -0,0 +1,108 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import unicode_literals
+
+from threading import Event
+from threading import Lock
+import unittest
+
+from devops.error import DevopsError
+from devops.helpers.parallel import TaskGraph
+
+
+class TestTaskGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.lock = Lock()
+        self.calls = []
+
+    def record(self, name):
+        with self.lock:
+            self.calls.append(name)
+
+    def test_serial_keeps_order(self):
+        graph = TaskGraph(workers=1)
+        self.assertTrue(graph.serial)
+        graph.add('node', self.record, phase='domains',
+                  deps=['vol', 'net'], args=('node',))
+        graph.add('net', self.record, phase='networks', args=('net',))
+        graph.add('vol', self.record, phase='volumes', args=('vol',))
+        graph.run()
+        self.assertEqual(self.calls, ['net', 'vol', 'node'])
+        self.assertEqual(list(graph.timings.keys()),
+                         ['domains', 'networks', 'volumes'])
+
+    def test_duplicate_key(self):
+        graph = TaskGraph()
+        self.assertTrue(graph.add('a', self.record, args=('a',)))
+        self.assertFalse(graph.add('a', self.record, args=('b',)))
+        self.assertEqual(len(graph), 1)
+        self.assertIn('a', graph)
+        graph.run()
+        self.assertEqual(self.calls, ['a'])
+
+    def test_unknown_deps_ignored(self):
+        graph = TaskGraph(workers=4)
+        graph.add('a', self.record, deps=['missing'], args=('a',))
+        graph.run()
+        self.assertEqual(self.calls, ['a'])
+
+    def test_parallel_dependencies(self):
+        graph = TaskGraph(workers=4)
+        self.assertFalse(graph.serial)
+        graph.add('base', self.record, phase='volumes', args=('base',))
+        for i in range(8):
+            graph.add(('child', i), self.record, phase='volumes',
+                      deps=['base'], args=('child',))
+        graph.add('node', self.record, phase='domains',
+                  deps=[('child', i) for i in range(8)], args=('node',))
+        graph.run()
+        self.assertEqual(self.calls[0], 'base')
+        self.assertEqual(self.calls[1:9], ['child'] * 8)
+        self.assertEqual(self.calls[-1], 'node')
+        self.assertEqual(set(graph.timings), {'volumes', 'domains'})
+        self.assertEqual(len(graph.durations), 10)
+        self.assertEqual(list(graph.durations)[0], 'base')
+
+    def test_parallel_overlaps(self):
+        started = Event()
+
+        def first():
+            self.assertTrue(started.wait(5))
+
+        graph = TaskGraph(workers=2)
+        graph.add('first', first)
+        graph.add('second', started.set)
+        graph.run()
+
+    def test_parallel_error(self):
+        def fail():
+            raise ValueError('fail')
+
+        graph = TaskGraph(workers=4)
+        graph.add('fail', fail)
+        graph.add('next', self.record, deps=['fail'], args=('next',))
+        with self.assertRaises(ValueError):
+            graph.run()
+        self.assertEqual(self.calls, [])
+
+    def test_circular(self):
+        for workers in (1, 4):
+            graph = TaskGraph(workers=workers)
+            graph.add('a', self.record, deps=['b'], args=('a',))
+            graph.add('b', self.record, deps=['a'], args=('b',))
+            with self.assertRaises(DevopsError):
+                graph.run()
+        self.assertEqual(self.calls, [])
@@ -18,13 +18,22 @@ from __future__ import unicode_literals
 
 import base64
 from contextlib import closing
+import io
+import os
 from os.path import basename
 import posixpath
+import shutil
 import stat
+import tarfile
+import tempfile
+import time
+from unittest import skipIf
 from unittest import TestCase
 
 import mock
+from netaddr import IPNetwork
 import paramiko
+import six
 # noinspection PyUnresolvedReferences
 from six.moves import cStringIO
 
@@ -820,6 +829,20 @@ class TestSSHClientInit(TestCase):
         ssh004 = SSHAuth(host)
         self.assertFalse(ssh01 is ssh004)
 
+    def test_close_connections_networks(self, client, policy, logger,
+                                        sleep):
+        ssh1 = SSHClient(host='10.1.0.5')
+        SSHClient(host='10.2.0.5')
+        SSHClient(host='fuel.local')
+
+        with mock.patch.object(SSHClient, 'close', autospec=True) as close:
+            SSHClient.close_connections(networks=[IPNetwork('10.1.0.0/24')])
+        close.assert_called_once_with(ssh1)
+
+        with mock.patch.object(SSHClient, 'close', autospec=True) as close:
+            SSHClient.close_connections(networks=[])
+        close.assert_not_called()
+
     @mock.patch('devops.helpers.ssh_client.warn')
     def test_init_memorize_close_unused(
             self, warn, client, policy, logger, sleep):
@@ -831,23 +854,21 @@ class TestSSHClientInit(TestCase):
         # New connection on the same host:port with different auth
         ssh1 = SSHClient(host=host, auth=SSHAuth(username=username))
         logger.assert_has_calls((
-            mock.call.debug('Closing {} as unused'.format(text)),
+            mock.call.debug('Removing {} from cache: credentials changed'
+                            ''.format(text)),
         ))
         client.assert_has_calls((
             mock.call().close(),
         ))
-        text = str(ssh1)
         del ssh1  # remove reference - now it's cached and unused
         client.reset_mock()
         logger.reset_mock()
         SSHClient._clear_cache()
-        logger.assert_has_calls((
-            mock.call.debug('Closing {} as unused'.format(text)),
-        ))
         client.assert_has_calls((
             mock.call().close(),
         ))
 
+    @mock.patch.object(SSHClient, 'cache_check_interval', 0)
     @mock.patch(
         'devops.helpers.ssh_client.SSHClient.execute')
     def test_init_memorize_reconnect(
@@ -860,6 +881,45 @@ class TestSSHClientInit(TestCase):
         SSHClient(host=host)
         client.assert_called_once()
         policy.assert_called_once()
+        self.assertEqual(SSHClient.cache_stats()['reconnects'], 1)
+
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute')
+    def test_init_memorize_check_interval(
+            self, execute, client, policy, logger, sleep):
+        ssh = SSHClient(host=host)
+        self.assertIs(SSHClient(host=host), ssh)
+        self.assertFalse(execute.called)
+        with mock.patch('time.time', return_value=time.time() + 10):
+            self.assertIs(SSHClient(host=host), ssh)
+        execute.assert_called_once_with('cd ~', timeout=5)
+        stats = SSHClient.cache_stats()
+        self.assertEqual(stats['connects'], 1)
+        self.assertEqual(stats['reuses'], 2)
+        self.assertEqual(stats['reconnects'], 0)
+        self.assertEqual(stats['size'], 1)
+
+    @mock.patch.object(SSHClient, 'cache_max_size', 2)
+    def test_init_memorize_lru(self, client, policy, logger, sleep):
+        ssh1 = SSHClient(host='127.0.0.1')
+        ssh2 = SSHClient(host='127.0.0.2')
+        self.assertIs(SSHClient(host='127.0.0.1'), ssh1)
+        SSHClient(host='127.0.0.3')  # 127.0.0.2 is least recently used
+        self.assertIs(SSHClient(host='127.0.0.1'), ssh1)
+        self.assertIsNot(SSHClient(host='127.0.0.2'), ssh2)
+        stats = SSHClient.cache_stats()
+        self.assertEqual(stats['evictions'], 2)
+        self.assertEqual(stats['size'], 2)
+
+    @mock.patch.object(SSHClient, 'cache_idle_timeout', 60)
+    def test_init_memorize_idle(self, client, policy, logger, sleep):
+        ssh1 = SSHClient(host='127.0.0.1')
+        with mock.patch('time.time', return_value=time.time() + 30):
+            ssh2 = SSHClient(host='127.0.0.2')
+        with mock.patch('time.time', return_value=time.time() + 70):
+            self.assertIs(SSHClient(host='127.0.0.2'), ssh2)
+            self.assertIsNot(SSHClient(host='127.0.0.1'), ssh1)
+        self.assertEqual(SSHClient.cache_stats()['evictions'], 1)
 
     @mock.patch('devops.helpers.ssh_client.warn')
     def test_init_clear(self, warn, client, policy, logger, sleep):
@@ -1308,11 +1368,187 @@ class TestExecute(TestCase):
             mock.call.status_event.is_set(),
             mock.call.close()))
 
+    @mock.patch('select.select', autospec=True)
     @mock.patch(
         'devops.helpers.ssh_client.SSHClient.execute_async')
-    def test_execute_together(self, execute_async, client, policy, logger):
-        chan, _stdin, stderr, stdout = self.get_patched_execute_async_retval()
-        execute_async.return_value = chan, _stdin, stderr, stdout
+    def test_execute_stream(
+            self, execute_async, select, client, policy, logger):
+        chan = mock.Mock()
+        chan.configure_mock(**{
+            'exit_status_ready.side_effect': [False, True],
+            'recv_ready.side_effect': [True, True, False, True, False],
+            'recv.side_effect': [b'1\n2', b'\n3\n4\n', b'5\n6'],
+            'recv_stderr_ready.side_effect': [True, False, False],
+            'recv_stderr.return_value': b'error\n',
+            'recv_exit_status.return_value': 0,
+        })
+        execute_async.return_value = chan, '', None, None
+        callback = mock.Mock()
+        tee = io.BytesIO()
+
+        ssh = self.get_ssh()
+        # noinspection PyTypeChecker
+        result = ssh.execute(
+            command=command, callback=callback, tee=tee, max_lines=3)
+
+        execute_async.assert_called_once_with(command)
+        select.assert_called_once_with(mock.ANY, [], [], 1.0)
+        self.assertEqual(
+            result,
+            ExecResult(cmd=command, stdout=[b'1\n', b'...\n', b'5\n', b'6'],
+                       stderr=[b'error\n'], exit_code=0))
+        self.assertEqual(
+            callback.mock_calls,
+            [mock.call(b'1\n', stderr=False),
+             mock.call(b'2\n', stderr=False),
+             mock.call(b'3\n', stderr=False),
+             mock.call(b'4\n', stderr=False),
+             mock.call(b'error\n', stderr=True),
+             mock.call(b'5\n', stderr=False),
+             mock.call(b'6', stderr=False)])
+        self.assertEqual(tee.getvalue(), b'1\n2\n3\n4\nerror\n5\n6')
+        chan.close.assert_called_once_with()
+
+    @mock.patch('select.select', autospec=True)
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_stream_timeout(
+            self, execute_async, select, client, policy, logger):
+        chan = self.get_patched_channel(stdout=b'1\n', finished=False)
+        execute_async.return_value = chan, '', None, None
+
+        ssh = self.get_ssh()
+        with self.assertRaises(TimeoutError):
+            # noinspection PyTypeChecker
+            ssh.execute(command=command, timeout=0, max_lines=10)
+
+        self.assertFalse(select.called)
+        self.assertFalse(chan.recv_exit_status.called)
+        chan.close.assert_called_once_with()
+
+    @staticmethod
+    def get_patched_channel(ec=0, stdout=b'', stderr=b'', finished=True):
+        chan = mock.Mock()
+        chan.configure_mock(**{
+            'exit_status_ready.return_value': finished,
+            'recv_ready.side_effect': [bool(stdout), False, False],
+            'recv.return_value': stdout,
+            'recv_stderr_ready.side_effect': [bool(stderr), False, False],
+            'recv_stderr.return_value': stderr,
+            'recv_exit_status.return_value': ec,
+        })
+        return chan
+
+    @mock.patch('select.select', autospec=True)
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_concurrent(
+            self, execute_async, select, client, policy, logger):
+        ssh = self.get_ssh()
+        # noinspection PyTypeChecker
+        ssh2 = SSHClient(
+            host='127.0.0.2',
+            port=port,
+            auth=SSHAuth(
+                username=username,
+                password=password
+            ))
+        chan = self.get_patched_channel(
+            stdout=b'1\n2\n', stderr=b'error\n')
+        chan2 = self.get_patched_channel(ec=1)
+        execute_async.side_effect = [
+            (chan, '', None, None), (chan2, '', None, None)]
+
+        # noinspection PyTypeChecker
+        results = SSHClient.execute_concurrent(
+            remotes=[ssh, ssh2, ssh], command=command, get_pty=True)
+
+        self.assertEqual(execute_async.call_count, 2)
+        execute_async.assert_called_with(command, get_pty=True)
+        self.assertEqual(select.call_count, 1)
+        self.assertEqual(
+            results,
+            {
+                ssh: ExecResult(cmd=command, stdout=[b'1\n', b'2\n'],
+                                stderr=[b'error\n'], exit_code=0),
+                ssh2: ExecResult(cmd=command, exit_code=1),
+            })
+        chan.close.assert_called_once_with()
+        chan2.close.assert_called_once_with()
+
+    @mock.patch('select.select', autospec=True)
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_concurrent_max_workers(
+            self, execute_async, select, client, policy, logger):
+        remotes = [self.get_ssh()]
+        for num in range(2, 5):
+            # noinspection PyTypeChecker
+            remotes.append(SSHClient(
+                host='127.0.0.{}'.format(num),
+                port=port,
+                auth=SSHAuth(
+                    username=username,
+                    password=password
+                )))
+        channels = [self.get_patched_channel() for _ in remotes]
+        execute_async.side_effect = [
+            (chan, '', None, None) for chan in channels]
+
+        def check_running(running, *args):
+            self.assertEqual(len(running), 2)
+            return running, [], []
+
+        select.side_effect = check_running
+
+        # noinspection PyTypeChecker
+        results = SSHClient.execute_concurrent(
+            remotes=remotes, command=command, max_workers=2)
+
+        self.assertEqual(select.call_count, 2)
+        self.assertEqual(set(results), set(remotes))
+        for result in results.values():
+            self.assertEqual(result.exit_code, 0)
+
+    @mock.patch('select.select', autospec=True)
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_concurrent_timeout(
+            self, execute_async, select, client, policy, logger):
+        ssh = self.get_ssh()
+        # noinspection PyTypeChecker
+        ssh2 = SSHClient(
+            host='127.0.0.2',
+            port=port,
+            auth=SSHAuth(
+                username=username,
+                password=password
+            ))
+        chan = self.get_patched_channel(stdout=b'1\n', finished=False)
+        execute_async.return_value = chan, '', None, None
+
+        # noinspection PyTypeChecker
+        results = SSHClient.execute_concurrent(
+            remotes=[ssh, ssh2], command=command, timeout=0, max_workers=1)
+
+        execute_async.assert_called_once_with(command)
+        select.assert_called_once_with(mock.ANY, [], [], 0)
+        self.assertEqual(
+            results,
+            {
+                ssh: ExecResult(cmd=command, stdout=[b'1\n']),
+                ssh2: ExecResult(cmd=command),
+            })
+        self.assertFalse(chan.recv_exit_status.called)
+        chan.close.assert_called_once_with()
+
+    @mock.patch('select.select', autospec=True)
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_execute_together(
+            self, execute_async, select, client, policy, logger):
+        execute_async.side_effect = lambda *args, **kwargs: (
+            self.get_patched_channel(), '', None, None)
 
         host2 = '127.0.0.2'
 
@@ -1329,16 +1565,11 @@ class TestExecute(TestCase):
         remotes = [ssh, ssh2]
 
         # noinspection PyTypeChecker
-        SSHClient.execute_together(
+        results = SSHClient.execute_together(
             remotes=remotes, command=command)
 
         self.assertEqual(execute_async.call_count, len(remotes))
-        chan.assert_has_calls((
-            mock.call.recv_exit_status(),
-            mock.call.close(),
-            mock.call.recv_exit_status(),
-            mock.call.close()
-        ))
+        self.assertEqual(set(results), set(remotes))
 
         # noinspection PyTypeChecker
         SSHClient.execute_together(
@@ -1453,6 +1684,117 @@ class TestExecute(TestCase):
             error_info=None, raise_on_err=raise_on_err)
 
 
+@skipIf(six.PY2, 'asyncio is not available')
+@mock.patch('devops.helpers.ssh_client.logger', autospec=True)
+@mock.patch(
+    'paramiko.AutoAddPolicy', autospec=True, return_value='AutoAddPolicy')
+@mock.patch('paramiko.SSHClient', autospec=True)
+class TestAsyncExecute(TestCase):
+    def setUp(self):
+        import asyncio
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+
+    def tearDown(self):
+        SSHClient._clear_cache()
+
+    @staticmethod
+    def get_ssh(host_name=host):
+        """SSHClient object builder for execution tests
+
+        :rtype: SSHClient
+        """
+        # noinspection PyTypeChecker
+        return SSHClient(
+            host=host_name,
+            port=port,
+            auth=SSHAuth(
+                username=username,
+                password=password
+            ))
+
+    def get_patched_channel(self, ec=0, stdout=b'', finished=True):
+        """Channel mock with pipe, which is readable if command is finished
+
+        :rtype: mock.Mock
+        """
+        read_fd, write_fd = os.pipe()
+        self.addCleanup(os.close, read_fd)
+        self.addCleanup(os.close, write_fd)
+        if finished:
+            os.write(write_fd, b'x')
+        chan = mock.Mock()
+        chan.configure_mock(**{
+            'fileno.return_value': read_fd,
+            'exit_status_ready.return_value': finished,
+            'recv_ready.side_effect': [bool(stdout), False, False],
+            'recv.return_value': stdout,
+            'recv_stderr_ready.return_value': False,
+            'recv_exit_status.return_value': ec,
+        })
+        return chan
+
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_aexecute(self, execute_async, client, policy, logger):
+        chan = self.get_patched_channel(stdout=b'1\n2\n')
+        execute_async.return_value = chan, '', None, None
+
+        ssh = self.get_ssh()
+        result = self.loop.run_until_complete(
+            ssh.aexecute(command, loop=self.loop, get_pty=True))
+
+        execute_async.assert_called_once_with(command, get_pty=True)
+        self.assertEqual(
+            result,
+            ExecResult(cmd=command, stdout=[b'1\n', b'2\n'], exit_code=0))
+        chan.close.assert_called_once_with()
+
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async')
+    def test_aexecute_timeout(self, execute_async, client, policy, logger):
+        chan = self.get_patched_channel(finished=False)
+        execute_async.return_value = chan, '', None, None
+
+        ssh = self.get_ssh()
+        with self.assertRaises(TimeoutError):
+            self.loop.run_until_complete(
+                ssh.aexecute(command, timeout=0.01, loop=self.loop))
+        self.assertFalse(chan.recv_exit_status.called)
+        chan.close.assert_called_once_with()
+
+    @mock.patch(
+        'devops.helpers.ssh_client.SSHClient.execute_async', autospec=True)
+    def test_agather(self, execute_async, client, policy, logger):
+        ssh = self.get_ssh()
+        ssh2 = self.get_ssh('127.0.0.2')
+        ssh3 = self.get_ssh('127.0.0.3')
+        chan = self.get_patched_channel(stdout=b'1\n')
+        chan2 = self.get_patched_channel(stdout=b'2\n', finished=False)
+        channels = {ssh: chan, ssh2: chan2}
+
+        def execute_async_side_effect(remote, cmd):
+            if remote is ssh3:
+                raise paramiko.SSHException('No existing session')
+            return channels[remote], '', None, None
+
+        execute_async.side_effect = execute_async_side_effect
+
+        results = self.loop.run_until_complete(SSHClient.agather(
+            [ssh, ssh2, ssh3, ssh], command, timeout=0.1, loop=self.loop))
+
+        self.assertEqual(execute_async.call_count, 3)
+        self.assertEqual(
+            results,
+            {
+                ssh: ExecResult(cmd=command, stdout=[b'1\n'], exit_code=0),
+                ssh2: ExecResult(cmd=command, stdout=[b'2\n']),
+                ssh3: ExecResult(cmd=command),
+            })
+        chan.close.assert_called_once_with()
+        chan2.close.assert_called_once_with()
+
+
 @mock.patch('devops.helpers.ssh_client.logger', autospec=True)
 @mock.patch(
     'paramiko.AutoAddPolicy', autospec=True, return_value='AutoAddPolicy')
@@ -1784,13 +2126,15 @@ class TestSftp(TestCase):
         fopen.assert_called_once_with(path, mode)
         self.assertTrue(result)
 
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute')
     @mock.patch('devops.helpers.ssh_client.SSHClient.exists')
     @mock.patch('os.path.exists', autospec=True)
     @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
     @mock.patch('os.path.isdir', autospec=True)
     def test_download(
             self,
-            isdir, remote_isdir, exists, remote_exists, client, policy, logger
+            isdir, remote_isdir, exists, remote_exists, execute,
+            client, policy, logger
     ):
         ssh, _sftp = self.prepare_sftp_file_tests(client)
         isdir.return_value = True
@@ -1827,19 +2171,14 @@ class TestSftp(TestCase):
         ))
         self.assertFalse(result)
 
-        logger.reset_mock()
+        # Directory
+        _sftp.reset_mock()
         # noinspection PyTypeChecker
         ssh.download(destination=dst, target=target)
-        logger.assert_has_calls((
-            mock.call.debug(
-                "Copying '%s' -> '%s' from remote to local host",
-                '/etc/environment',
-                '/tmp/environment'),
-            mock.call.debug(
-                "Can't download %s because it is a directory",
-                '/etc/environment'
-            ),
-        ))
+        execute.assert_called_once_with(
+            "find /etc/environment -printf '%y %s %T@ %P\\0'",
+            callback=mock.ANY, max_lines=10)
+        self.assertFalse(_sftp.get.called)
 
     @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
     @mock.patch('os.path.isdir', autospec=True)
@@ -1860,34 +2199,151 @@ class TestSftp(TestCase):
             mock.call.put(source, target),
         ))
 
-    @mock.patch('devops.helpers.ssh_client.SSHClient.exists')
-    @mock.patch('devops.helpers.ssh_client.SSHClient.mkdir')
-    @mock.patch('os.walk')
+    def make_tree(self):
+        """Local directory: bashrc, sub/file
+
+        :rtype: str
+        """
+        source = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, source)
+        os.mkdir(os.path.join(source, 'sub'))
+        for name in ('bashrc', os.path.join('sub', 'file')):
+            with open(os.path.join(source, name), 'w') as f:
+                f.write(name)
+            os.utime(os.path.join(source, name), (1000000000, 1000000000))
+        return source
+
+    @staticmethod
+    def patch_listing(execute, entries):
+        """Make execute() pass find output to callback
+
+        :param entries: list of find -printf '%y %s %T@ %P\\0' entries
+        """
+        def listing(cmd, callback, max_lines):
+            for entry in entries:
+                callback(entry.encode('utf-8') + b'\0', stderr=False)
+            callback(b'find: Permission denied\n', stderr=True)
+        execute.side_effect = listing
+
+    @mock.patch('devops.helpers.ssh_client.SSHClient.check_call')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute')
     @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
-    @mock.patch('os.path.isdir', autospec=True)
     def test_upload_dir(
             self,
-            isdir, remote_isdir, walk, mkdir, exists,
+            remote_isdir, execute, check_call,
             client, policy, logger
     ):
         ssh, _sftp = self.prepare_sftp_file_tests(client)
-        isdir.return_value = True
         remote_isdir.return_value = True
-        exists.return_value = True
+        source = self.make_tree()
         target = '/etc'
-        source = '/tmp/bash'
-        filename = 'bashrc'
-        walk.return_value = (source, '', [filename]),
         expected_path = posixpath.join(target, basename(source))
-        expected_file = posixpath.join(expected_path, filename)
+        # bashrc is not changed
+        self.patch_listing(execute, [
+            'd 4096 1000000000.5 ',
+            'f 6 1000000000.5 bashrc',
+        ])
 
         # noinspection PyTypeChecker
-        ssh.upload(source=source, target=target)
-        isdir.assert_called_once_with(source)
+        ssh.upload(source=source, target=target, tar=False)
         remote_isdir.assert_called_once_with(target)
-        mkdir.assert_called_once_with(expected_path)
-        exists.assert_called_once_with(expected_file)
+        execute.assert_called_once_with(
+            "find {} -printf '%y %s %T@ %P\\0'".format(expected_path),
+            callback=mock.ANY, max_lines=10)
+        check_call.assert_called_once_with(
+            'mkdir -p {}'.format(posixpath.join(expected_path, 'sub')))
+        expected_file = posixpath.join(expected_path, 'sub/file')
         _sftp.assert_has_calls((
-            mock.call.unlink(expected_file),
-            mock.call.put(posixpath.join(source, filename), expected_file),
+            mock.call.put(os.path.join(source, 'sub', 'file'), expected_file),
+            mock.call.utime(expected_file, (1000000000, 1000000000)),
         ))
+        self.assertEqual(_sftp.put.call_count, 1)
+
+    @mock.patch('devops.helpers.ssh_client.SSHClient.check_call')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
+    def test_upload_dir_channels(
+            self,
+            remote_isdir, execute, check_call,
+            client, policy, logger
+    ):
+        ssh, _sftp = self.prepare_sftp_file_tests(client)
+        remote_isdir.return_value = False
+        source = self.make_tree()
+        self.patch_listing(execute, [])
+
+        # noinspection PyTypeChecker
+        ssh.upload(source=source, target='/tmp/dst', channels=2, tar=False)
+        check_call.assert_called_once_with('mkdir -p /tmp/dst /tmp/dst/sub')
+        self.assertEqual(
+            sorted(c[1][0] for c in _sftp.put.mock_calls),
+            sorted([os.path.join(source, 'bashrc'),
+                    os.path.join(source, 'sub', 'file')]))
+        # SFTP session per worker
+        self.assertEqual(_sftp.close.call_count, 2)
+
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute_async')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.check_call')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
+    def test_upload_dir_tar(
+            self,
+            remote_isdir, execute, check_call, execute_async,
+            client, policy, logger
+    ):
+        ssh, _sftp = self.prepare_sftp_file_tests(client)
+        remote_isdir.return_value = False
+        source = self.make_tree()
+        self.patch_listing(execute, ['d 4096 1000000000.5 '])
+        chan, stdout, stderr = mock.Mock(), mock.Mock(), mock.Mock()
+        chan.configure_mock(**{'exit_status': 0,
+                               'status_event.is_set.return_value': True})
+        stdout.readlines.return_value = []
+        stderr.readlines.return_value = []
+        stdin = io.BytesIO()
+        stdin.close = mock.Mock()
+        execute_async.return_value = chan, stdin, stderr, stdout
+
+        # noinspection PyTypeChecker
+        ssh.upload(source=source, target='/tmp/dst', tar=True)
+        check_call.assert_called_once_with('mkdir -p /tmp/dst/sub')
+        execute_async.assert_called_once_with(
+            'tar --no-same-owner -xf - -C /tmp/dst')
+        chan.shutdown_write.assert_called_once_with()
+        self.assertFalse(_sftp.put.called)
+        stdin.seek(0)
+        with closing(tarfile.open(fileobj=stdin)) as tar:
+            self.assertEqual(
+                [(member.name, member.mtime) for member in tar],
+                [('bashrc', 1000000000), ('sub/file', 1000000000)])
+
+    @mock.patch('devops.helpers.ssh_client.SSHClient.execute')
+    @mock.patch('devops.helpers.ssh_client.SSHClient.isdir')
+    def test_download_dir(self, remote_isdir, execute, client, policy, logger):
+        ssh, _sftp = self.prepare_sftp_file_tests(client)
+        remote_isdir.return_value = True
+        tree = self.make_tree()
+        # sub/file is not changed
+        self.patch_listing(execute, [
+            'd 4096 1000000000.5 ',
+            'd 4096 1000000000.5 sub',
+            'd 4096 1000000000.5 new dir',
+            'f 7 1000000000.5 bashrc',
+            'f 8 1000000000.5 sub/file',
+        ])
+
+        def get(source, path):
+            with open(path, 'w') as f:
+                f.write('remote')
+        _sftp.get.side_effect = get
+
+        # noinspection PyTypeChecker
+        self.assertTrue(ssh.download(
+            destination=posixpath.join('/etc', basename(tree)),
+            target=os.path.dirname(tree), tar=False))
+        self.assertTrue(os.path.isdir(os.path.join(tree, 'new dir')))
+        _sftp.get.assert_called_once_with(
+            posixpath.join('/etc', basename(tree), 'bashrc'),
+            os.path.join(tree, 'bashrc'))
+        self.assertEqual(
+            os.stat(os.path.join(tree, 'bashrc')).st_mtime, 1000000000)
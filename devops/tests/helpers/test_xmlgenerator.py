@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+# pylint: disable=no-self-use
+
+import unittest
+from xml.dom import minidom
+from xml.etree import ElementTree as ET
+
+import six
+
+from devops.helpers.xmlgenerator import tostring_pretty
+from devops.helpers.xmlgenerator import XMLGenerator
+
+
+def minidom_pretty(root):
+    rough_string = ET.tostring(root, encoding='utf-8')
+    reparsed = minidom.parseString(rough_string)
+    s = reparsed.toprettyxml(indent='    ', encoding='utf-8')
+    if six.PY2:
+        return s.decode('utf-8')
+    return str(s, encoding='utf-8')
+
+
+class TestXMLGenerator(unittest.TestCase):
+
+    def test_generator(self):
+        xml = XMLGenerator('domain', type='kvm')
+        xml.name('node')
+        with xml.devices:
+            xml.emulator('/usr/bin/kvm')
+            xml.graphics(type='vnc')
+        assert str(xml) == (
+            '<?xml version="1.0" encoding="utf-8"?>\n'
+            '<domain type="kvm">\n'
+            '    <name>node</name>\n'
+            '    <devices>\n'
+            '        <emulator>/usr/bin/kvm</emulator>\n'
+            '        <graphics type="vnc"/>\n'
+            '    </devices>\n'
+            '</domain>\n'
+        )
+
+    def test_same_as_minidom(self):
+        root = ET.Element('root', name='a "quoted" & <escaped>')
+        root.text = 'text\r\nof root'
+        child = ET.SubElement(root, 'child', attr='\ttab\n')
+        child.text = 'x < y & y > z'
+        child.tail = 'tail\r'
+        ET.SubElement(child, 'empty')
+        leaf = ET.SubElement(root, 'leaf')
+        leaf.text = u'привет'
+        ET.SubElement(root, 'empty', b='2', a='1')
+        assert tostring_pretty(root) == minidom_pretty(root)
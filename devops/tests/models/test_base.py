@@ -15,8 +15,10 @@
 # pylint: disable=no-self-use
 
 from django.test import TestCase
+import mock
 
 from devops.error import DevopsError
+from devops.models.base import ParamedModelMetadata
 from devops.models.base import ParamField
 from devops.models.base import ParamMultiField
 from devops.models import Driver
@@ -186,6 +188,74 @@ class TestParamedModel(TestCase):
         with self.assertRaises(Node.DoesNotExist):
             g.node_set.get(role='qqq', hypervisor='kvm')
 
+    def test_metadata(self):
+        meta = MyModel._paramed_meta
+        assert sorted(meta.param_names) == [
+            '_class', 'field', 'multi', 'number']
+        assert MyModel.get_defined_params() == meta.param_names
+        assert meta.defaults == {'_class': None, 'field': 10, 'number': None}
+        assert {'id', 'name', 'params', 'group'} <= meta.field_names
+        assert 'field' not in meta.field_names
+        assert ParamedModelMetadata.classes[
+            'devops.tests.models.test_base:MyModel'] is MyModel
+
+        assert meta.get_param_field(['multi', 'sub2']).default_value == 15
+        assert meta.get_param_field(['multi']) is None
+        assert meta.get_param_field(['multi', 'unknown']) is None
+        # params of subclasses are found for the base model
+        driver_meta = Driver._paramed_meta
+        assert driver_meta.get_param_field(['field']) is MyModel.__dict__[
+            'field']
+        assert driver_meta.get_param_field(['unknown']) is None
+
+    def _create_lookup_models(self):
+        MyLookupModel(name='t1', size=1, tags=['a', 'b'], label='abc').save()
+        MyLookupModel(name='t2', size=5, tags=['b'], label='bcd').save()
+        MyLookupModel(name='t3', size=10, tags=[], label=None).save()
+
+    def _lookup_names(self, **kwargs):
+        return sorted(m.name for m in MyLookupModel.objects.filter(**kwargs))
+
+    def _check_lookups(self):
+        assert self._lookup_names(size=5) == ['t2']
+        assert self._lookup_names(size__gt=1) == ['t2', 't3']
+        assert self._lookup_names(size__gte=5) == ['t2', 't3']
+        assert self._lookup_names(size__lt=5) == ['t1']
+        assert self._lookup_names(size__lte=5) == ['t1', 't2']
+        assert self._lookup_names(size__in=[1, 10]) == ['t1', 't3']
+        assert self._lookup_names(size__in=[]) == []
+        assert self._lookup_names(label=None) == ['t3']
+        assert self._lookup_names(label__in=['abc', 'bcd']) == ['t1', 't2']
+        assert self._lookup_names(label__contains='bc') == ['t1', 't2']
+        assert self._lookup_names(label__contains='a') == ['t1']
+        assert self._lookup_names(tags__contains='b') == ['t1', 't2']
+        assert self._lookup_names(tags=['b']) == ['t2']
+        assert self._lookup_names(name='t1', size__lt=5,
+                                  tags__contains='a') == ['t1']
+        assert self._lookup_names(label__gt=1) == []
+        assert self._lookup_names(size__gt=1, label__contains='b') == ['t2']
+
+    def test_filter_lookups(self):
+        self._create_lookup_models()
+        self._check_lookups()
+
+        # lookups are processed by the database
+        with self.assertNumQueries(1):
+            list(MyLookupModel.objects.filter(size__gt=1, label='bcd'))
+
+    def test_filter_lookups_python(self):
+        self._create_lookup_models()
+        with mock.patch('devops.models.param_lookups.has_json_support',
+                        return_value=False):
+            self._check_lookups()
+
+
+class MyLookupModel(Driver):
+
+    size = ParamField(default=0)
+    tags = ParamField(default=None)
+    label = ParamField(default=None)
+
 
 class MyMultiModel(Driver):
 
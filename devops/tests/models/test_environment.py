@@ -0,0 +1,107 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from devops.error import DevopsObjNotFound
+from devops.helpers.queries import QueryCounter
+from devops.models import Environment
+from devops.tests.driver.driverless import DriverlessTestCase
+
+
+class TestEnvironmentGraph(DriverlessTestCase):
+
+    def setUp(self):
+        super(TestEnvironmentGraph, self).setUp()
+        self.group.add_volume(name='base')
+        for name in ('admin', 'slave-01', 'slave-02'):
+            self.group.add_node(
+                name=name, role='default',
+                interfaces=[
+                    {'label': 'eth0', 'l2_network_device': 'admin'},
+                    {'label': 'eth1', 'l2_network_device': 'public'},
+                    {'label': 'eth2'},
+                ],
+                volumes=[
+                    {'name': 'system', 'backing_store': 'base'},
+                    {'name': 'cinder'},
+                ])
+
+    def test_get_graph(self):
+        with self.assertNumQueries(11):
+            env = Environment.get_graph(name='test')
+
+        with self.assertNumQueries(0):
+            nodes = env.get_nodes()
+            assert [node.name for node in nodes] == [
+                'admin', 'slave-01', 'slave-02']
+            assert nodes.count() == 3
+            group = env.get_groups()[0]
+            assert group.driver.name == 'devops.driver.empty'
+            assert len(group.get_l2_network_devices()) == 5
+            for node in nodes:
+                assert node.group.environment.name == 'test'
+                assert node.driver is group.driver
+                assert [iface.label for iface in node.interfaces] == [
+                    'eth0', 'eth1', 'eth2']
+                ip = node.get_ip_address_by_network_name('admin')
+                assert ip == node.interfaces[0].addresses[0].ip_address
+                assert [disk.volume.name for disk in node.disk_devices] == [
+                    'system', 'cinder']
+                for volume in node.get_volumes():
+                    assert volume.node is node
+
+            admin_l2_dev = group.get_l2_network_devices()[0]
+            assert admin_l2_dev.address_pool.name == 'fuelweb_admin-pool01'
+            assert [iface.node.name for iface in admin_l2_dev.interfaces] == [
+                'admin', 'slave-01', 'slave-02']
+
+    def test_get_graph_same_instances(self):
+        env = Environment.get_graph(name='test')
+        group = env.get_groups()[0]
+        base = group.get_volumes()[0]
+        l2_devs = list(group.get_l2_network_devices())
+        for node in env.get_nodes():
+            volumes = list(node.get_volumes())
+            disks = list(node.disk_devices)
+            assert disks[0].volume is volumes[0]
+            assert disks[1].volume is volumes[1]
+            assert volumes[0].backing_store is base
+            assert node.interfaces[0].l2_network_device is l2_devs[0]
+            assert node.interfaces[1].l2_network_device is l2_devs[1]
+            assert node.interfaces[2].l2_network_device is None
+
+    def test_get_graph_not_found(self):
+        with self.assertRaises(DevopsObjNotFound):
+            Environment.get_graph(name='unknown')
+
+    def test_queries_do_not_depend_on_nodes(self):
+        env = Environment.get(name='test')
+        with QueryCounter() as counter:
+            env.define()
+        self.group.add_node(
+            name='slave-03', role='default',
+            interfaces=[{'label': 'eth0', 'l2_network_device': 'admin'}],
+            volumes=[{'name': 'system'}])
+        with QueryCounter() as counter_more_nodes:
+            env.define()
+        # only saves of the new node, its interface and volume are added
+        assert counter_more_nodes.count - counter.count == 3
+
+    def test_list_all_graphs(self):
+        Environment.create(name='test2')
+        with self.assertNumQueries(11):
+            envs = Environment.list_all_graphs()
+        with self.assertNumQueries(0):
+            assert [env.name for env in envs] == ['test', 'test2']
+            assert len(envs[0].get_nodes()) == 3
+            assert len(envs[1].get_nodes()) == 0
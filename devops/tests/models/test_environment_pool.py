@@ -0,0 +1,161 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from django.test import TestCase
+import mock
+
+from devops.error import DevopsError
+from devops.models import Environment
+from devops.models import PooledEnvironment
+
+
+class TestPooledEnvironment(TestCase):
+
+    def setUp(self):
+        super(TestPooledEnvironment, self).setUp()
+        self.config = {
+            'template': {
+                'devops_settings': {
+                    'env_name': 'template_env',
+                    'groups': [],
+                    'address_pools': {},
+                },
+            },
+        }
+        for method in ('define', 'start', 'snapshot', 'revert', 'resume'):
+            patcher = mock.patch.object(Environment, method)
+            setattr(self, method + '_mock', patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def test_fill(self):
+        prepare = mock.Mock()
+        created = PooledEnvironment.fill('ci', self.config, 2,
+                                         prepare=prepare)
+        assert [entry.env_name for entry in created] == [
+            'ci_pool_1', 'ci_pool_2']
+        assert self.define_mock.call_count == 2
+        assert self.start_mock.call_count == 2
+        assert prepare.call_count == 2
+        self.snapshot_mock.assert_called_with('ready', suspend=True)
+        # template is not changed
+        assert (self.config['template']['devops_settings']['env_name'] ==
+                'template_env')
+
+        # pool is already full
+        assert PooledEnvironment.fill('ci', self.config, 2) == []
+        assert PooledEnvironment.fill('ci', self.config, 3)[0].env_name == (
+            'ci_pool_3')
+
+    def test_fill_error(self):
+        self.start_mock.side_effect = DevopsError('Failed to start')
+        with self.assertRaises(DevopsError):
+            PooledEnvironment.fill('ci', self.config, 1)
+        assert Environment.objects.count() == 0
+        assert PooledEnvironment.objects.count() == 0
+
+    def test_checkout_release(self):
+        PooledEnvironment.fill('ci', self.config, 2)
+
+        env = PooledEnvironment.checkout('ci', name='job_1',
+                                         claimed_by='worker_1')
+        assert env.name == 'ci_pool_1'
+        entry = PooledEnvironment.objects.get(environment=env)
+        assert entry.status == PooledEnvironment.CHECKED_OUT
+        assert entry.claimed_by == 'worker_1'
+        assert entry.claimed_at is not None
+        assert entry.label == 'job_1'
+        assert PooledEnvironment.get_environment('job_1') == env
+        assert PooledEnvironment.get_environment('ci_pool_1') == env
+
+        env2 = PooledEnvironment.checkout('ci')
+        assert env2.name == 'ci_pool_2'
+        with self.assertRaises(DevopsError):
+            PooledEnvironment.checkout('ci')
+
+        PooledEnvironment.release(env)
+        self.revert_mock.assert_called_once_with('ready', flag=False)
+        self.resume_mock.assert_called_once_with()
+        assert Environment.get(id=env.id).name == 'ci_pool_1'
+        entry = PooledEnvironment.objects.get(environment=env)
+        assert entry.status == PooledEnvironment.READY
+        assert entry.claimed_by is None
+        assert entry.label is None
+
+        with self.assertRaises(DevopsError):
+            PooledEnvironment.release(env)
+
+    def test_checkout_label_exists(self):
+        PooledEnvironment.fill('ci', self.config, 2)
+        PooledEnvironment.checkout('ci', name='job_1')
+
+        with self.assertRaises(DevopsError):
+            PooledEnvironment.checkout('ci', name='job_1')
+        # claim is rolled back
+        entry = PooledEnvironment.objects.get(env_name='ci_pool_2')
+        assert entry.status == PooledEnvironment.READY
+        assert entry.label is None
+
+    def test_revert_erase_labeled(self):
+        PooledEnvironment.fill('ci', self.config, 1)
+        env = PooledEnvironment.checkout('ci', name='job_1')
+
+        # objects derived from the environment name are still found
+        def check_name(*args, **kwargs):
+            assert Environment.get(id=env.id).name == 'ci_pool_1'
+
+        self.revert_mock.side_effect = check_name
+        PooledEnvironment.release(env)
+        assert self.revert_mock.call_count == 1
+
+        env = PooledEnvironment.checkout('ci', name='job_2')
+        env.add_group(group_name='rack-01',
+                      driver_name='devops.driver.empty')
+
+        def check_group_env(group, graph):
+            assert group.environment.name == 'ci_pool_1'
+
+        with mock.patch('devops.models.group.Group.schedule_erase',
+                        autospec=True,
+                        side_effect=check_group_env) as erase_mock:
+            PooledEnvironment.get_environment('job_2').erase()
+        assert erase_mock.call_count == 1
+        assert Environment.objects.count() == 0
+        assert PooledEnvironment.objects.count() == 0
+
+    def test_checkout_concurrent(self):
+        PooledEnvironment.fill('ci', self.config, 2)
+        first = PooledEnvironment.objects.order_by('id')[0]
+        values_list = PooledEnvironment.objects.filter(
+            pool_name='ci').order_by('id').values_list('id', flat=True)
+
+        # the first entry is claimed by another process after the list of
+        # candidates has been read
+        def claimed_list(*args, **kwargs):
+            ids = list(values_list)
+            PooledEnvironment.objects.filter(id=first.id).update(
+                status=PooledEnvironment.CHECKED_OUT)
+            return ids
+
+        with mock.patch('django.db.models.query.QuerySet.values_list',
+                        side_effect=claimed_list):
+            env = PooledEnvironment.checkout('ci')
+        assert env.name == 'ci_pool_2'
+
+    def test_get_pool(self):
+        PooledEnvironment.fill('ci', self.config, 2)
+        PooledEnvironment.fill('nightly', self.config, 1)
+        assert len(PooledEnvironment.get_pool()) == 3
+        assert [entry.env_name
+                for entry in PooledEnvironment.get_pool('ci')] == [
+            'ci_pool_1', 'ci_pool_2']
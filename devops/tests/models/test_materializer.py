@@ -0,0 +1,228 @@
+#    Copyright 2016 Mirantis, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from copy import deepcopy
+import itertools
+
+from django.test import TestCase
+import mock
+
+from devops.error import DevopsError
+from devops.helpers.queries import QueryCounter
+from devops import models
+from devops.models import Environment
+
+ENV_TMPLT = {
+    'template': {
+        'devops_settings': {
+            'env_name': 'test_env',
+            'address_pools': {
+                'admin-pool01': {
+                    'net': '10.109.0.0/16:24',
+                    'params': {
+                        'ip_reserved': {'gateway': 1, 'l2_network_device': 1},
+                        'ip_ranges': {'default': [2, -2]},
+                    },
+                },
+                'public-pool01': {
+                    'net': '10.109.0.0/16:24',
+                    'params': {'vlan_start': 100},
+                },
+            },
+            'groups': [{
+                'name': 'rack-01',
+                'driver': {'name': 'devops.driver.empty'},
+                'network_pools': {
+                    'fuelweb_admin': 'admin-pool01',
+                    'public': 'public-pool01',
+                },
+                'l2_network_devices': {
+                    'admin': {'address_pool': 'admin-pool01'},
+                    'public': {'address_pool': 'public-pool01'},
+                    'private': {},
+                },
+                'group_volumes': [{'name': 'base'}],
+                'nodes': [{
+                    'name': 'slave-{:02d}'.format(i),
+                    'role': 'fuel_slave',
+                    'params': {
+                        'interfaces': [
+                            {'label': 'eth0', 'l2_network_device': 'admin'},
+                            {'label': 'eth1', 'l2_network_device': 'public',
+                             'interface_model': 'virtio'},
+                            {'label': 'eth2', 'l2_network_device': 'private',
+                             'features': ['dpdk']},
+                        ],
+                        'network_config': {
+                            'eth0': {'networks': ['fuelweb_admin']},
+                            'eth1': {'networks': ['public']},
+                        },
+                        'volumes': [
+                            {'name': 'system', 'backing_store': 'base'},
+                            {'name': 'cinder'},
+                        ],
+                    },
+                } for i in range(1, 4)],
+            }, {
+                'name': 'rack-02',
+                'driver': {'name': 'devops.driver.empty'},
+                'l2_network_devices': {
+                    'admin2': {'address_pool': 'admin-pool01'},
+                },
+                'nodes': [{
+                    'name': 'slave-04',
+                    'role': 'fuel_slave',
+                    'params': {
+                        'interfaces': [
+                            {'label': 'eth0', 'l2_network_device': 'admin2',
+                             'mac_address': '64:00:00:00:00:01'},
+                        ],
+                        'volumes': [{'name': 'system'}],
+                    },
+                }],
+            }],
+        },
+    },
+}
+
+MODELS = (models.Environment, models.Driver, models.Group, models.AddressPool,
+          models.NetworkPool, models.L2NetworkDevice, models.Node,
+          models.Interface, models.Address, models.network.NetworkConfig,
+          models.Volume, models.DiskDevice)
+
+
+def create_environment_by_objects(full_config):
+    """Create environment the way it was done before bulk creation"""
+    config = full_config['template']['devops_settings']
+    environment = Environment.create(config['env_name'])
+    environment.add_groups(config['groups'])
+    environment.add_address_pools(config['address_pools'])
+    for group_data in config['groups']:
+        group = environment.get_group(name=group_data['name'])
+        group.add_l2_network_devices(
+            group_data.get('l2_network_devices', {}))
+        group.add_network_pools(group_data.get('network_pools', {}))
+    for group_data in config['groups']:
+        group = environment.get_group(name=group_data['name'])
+        for vol_params in group_data.get('group_volumes', []):
+            group.add_volume(**vol_params)
+        group.add_nodes(group_data.get('nodes', []))
+    return environment
+
+
+def dump_database():
+    """Rows of devops tables with ids replaced by positions of rows"""
+    positions = {}
+    rows = {}
+    for model in MODELS:
+        rows[model] = list(model.objects.order_by('id').values())
+        positions[model] = {row['id']: i for i, row in enumerate(rows[model])}
+    dump = {}
+    for model in MODELS:
+        dump[model.__name__] = table = []
+        for row in rows[model]:
+            row.pop('created', None)
+            row['id'] = positions[model][row['id']]
+            for field in model._meta.concrete_fields:
+                if field.is_relation and row[field.attname] is not None:
+                    related = field.related_model
+                    related_positions = positions.get(related, {})
+                    row[field.attname] = related_positions.get(
+                        row[field.attname], row[field.attname])
+            table.append(row)
+    return dump
+
+
+class TestTemplateMaterializer(TestCase):
+
+    def setUp(self):
+        super(TestTemplateMaterializer, self).setUp()
+        self.patch_mac()
+
+    def patch_mac(self):
+        counter = itertools.count(1)
+        patcher = mock.patch(
+            'devops.models.materializer.generate_mac',
+            side_effect=lambda: '64:00:00:00:01:{:02x}'.format(next(counter)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch(
+            'devops.models.network.generate_mac',
+            side_effect=lambda: '64:00:00:00:01:{:02x}'.format(next(counter)))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_objects(self):
+        config = deepcopy(ENV_TMPLT)
+        create_environment_by_objects(config)
+        expected = dump_database()
+        expected_config = config
+        for model in reversed(MODELS):
+            model.objects.all().delete()
+
+        self.patch_mac()
+        config = deepcopy(ENV_TMPLT)
+        Environment.create_environment(config)
+        assert dump_database() == expected
+        # IPs translated from indexes are stored to the template
+        assert config == expected_config
+
+    def test_queries(self):
+        with QueryCounter() as counter:
+            Environment.create_environment(deepcopy(ENV_TMPLT))
+        config = deepcopy(ENV_TMPLT)
+        settings = config['template']['devops_settings']
+        settings['env_name'] = 'test_env2'
+        settings['groups'][1]['nodes'][0]['params']['interfaces'][0][
+            'mac_address'] = '64:00:00:00:00:02'
+        nodes = settings['groups'][0]['nodes']
+        for i in range(4, 20):
+            node = deepcopy(nodes[0])
+            node['name'] = 'slave-{:02d}'.format(i)
+            nodes.append(node)
+        with QueryCounter() as counter_more_nodes:
+            Environment.create_environment(config)
+        assert counter.count == counter_more_nodes.count
+
+    def test_validate(self):
+        config = deepcopy(ENV_TMPLT)
+        settings = config['template']['devops_settings']
+        settings['address_pools']['public-pool01']['net'] = '10.109.0.0/16'
+        group = settings['groups'][0]
+        group['l2_network_devices']['public']['address_pool'] = 'unknown'
+        group['nodes'][1]['name'] = 'slave-01'
+        group['nodes'][2]['params']['volumes'][0]['backing_store'] = 'none'
+        group['nodes'][2]['params']['interfaces'][0][
+            'l2_network_device'] = 'admin2x'
+
+        with self.assertRaises(DevopsError) as context:
+            Environment.create_environment(config)
+        message = str(context.exception)
+        assert "Address pool 'public-pool01'" in message
+        assert "address pool 'unknown' of l2 network device" in message
+        assert "node 'slave-01' is duplicated" in message
+        assert "backing store 'none' of volume 'system'" in message
+        assert "l2 network device 'admin2x' of interface 'eth0'" in message
+        # nothing is created
+        assert Environment.objects.count() == 0
+        assert models.Driver.objects.count() == 0
+
+    def test_rollback(self):
+        config = deepcopy(ENV_TMPLT)
+        with mock.patch.object(models.DiskDevice.objects.__class__,
+                               'bulk_create', side_effect=DevopsError):
+            with self.assertRaises(DevopsError):
+                Environment.create_environment(config)
+        for model in MODELS:
+            assert model.objects.count() == 0
@@ -21,6 +21,8 @@ import pytest
 
 from devops.error import DevopsError
 from devops.helpers.network import IpNetworksPool
+from devops.helpers.queries import QueryCounter
+from devops.helpers.ssh_client import SSHClient
 from devops.models import Address
 from devops.models import AddressPool
 from devops.models import Environment
@@ -53,6 +55,67 @@ class TestManager(TestCase):
                                interface=interface)
         assert str(address_pool.next_ip()) == '10.1.0.5'
 
+    def test_next_ips(self):
+        environment = Environment.create('test_env')
+        node = Node.objects.create(
+            group=None,
+            name='test_node',
+            role='default',
+        )
+        pool = IpNetworksPool(networks=[IPNetwork('10.1.0.0/29')], prefix=29)
+        address_pool = AddressPool.address_pool_create(
+            environment=environment, name='internal', pool=pool)
+        l2_net_dev = L2NetworkDevice.objects.create(
+            group=None, address_pool=address_pool, name='test_l2_dev')
+        interface = Interface.interface_create(l2_network_device=l2_net_dev,
+                                               node=node, label='eth0')
+        # 10.1.0.2 is taken by the interface
+        Address.objects.create(ip_address='10.1.0.4', interface=interface)
+
+        with QueryCounter() as counter:
+            address_pool.next_ips(1)
+        with QueryCounter() as counter_more_ips:
+            ips = address_pool.next_ips(3)
+        assert [str(ip) for ip in ips] == ['10.1.0.3', '10.1.0.5', '10.1.0.6']
+        assert counter.count == counter_more_ips.count
+        assert address_pool.next_ips(0) == []
+        with pytest.raises(DevopsError):
+            address_pool.next_ips(4)
+
+    def test_node_close_remotes(self):
+        environment = Environment.create('test_env')
+        node = Node.objects.create(
+            group=None,
+            name='test_node',
+            role='default',
+        )
+        pool = IpNetworksPool(networks=[IPNetwork('10.1.0.0/24')], prefix=24)
+        address_pool = AddressPool.address_pool_create(
+            environment=environment, name='internal', pool=pool)
+        l2_net_dev = L2NetworkDevice.objects.create(
+            group=None, address_pool=address_pool, name='test_l2_dev')
+        Interface.interface_create(l2_network_device=l2_net_dev,
+                                   node=node, label='eth0')
+
+        with mock.patch.object(SSHClient, 'close_connections') as close:
+            node.destroy()
+        close.assert_called_once_with(hostname='10.1.0.2')
+
+    @mock.patch('paramiko.SSHClient')
+    def test_environment_close_remotes(self, client):
+        environment = Environment.create('test_env')
+        pool = IpNetworksPool(networks=[IPNetwork('10.1.0.0/24')], prefix=24)
+        AddressPool.address_pool_create(
+            environment=environment, name='internal', pool=pool)
+        self.addCleanup(SSHClient._clear_cache)
+        # address given by DHCP of the master node, no Address row
+        ssh = SSHClient(host='10.1.0.50')
+        SSHClient(host='10.2.0.50')
+
+        with mock.patch.object(SSHClient, 'close', autospec=True) as close:
+            environment.revert(flag=False)
+        close.assert_called_once_with(ssh)
+
     def test_network_model(self):
         environment = Environment.create('test_env')
         node = Node.objects.create(
@@ -92,6 +155,36 @@ class TestManager(TestCase):
         self.assertEqual('10.0.5.0/24', str(AddressPool.address_pool_create(
             environment=environment, name='private', pool=None).ip_network))
 
+    def test_allocation_snapshot(self):
+        environment = Environment.create('test_env')
+        with mock.patch.object(
+                Environment, 'get_allocated_networks',
+                return_value=[IPNetwork('10.0.0.0/24')]) as get_allocated:
+            environment.add_address_pools({
+                'internal': {'net': '10.0.0.0/16:24'},
+                'external': {'net': '10.0.0.0/16:24'},
+                'private': {'net': '10.0.0.0/16:23'},
+            })
+            assert get_allocated.call_count == 1
+            nets = sorted(str(ap.net) for ap in
+                          environment.get_address_pools())
+            assert nets == ['10.0.1.0/24', '10.0.2.0/24', '10.0.4.0/23']
+
+            with environment.allocation_snapshot() as allocated_networks:
+                with environment.allocation_snapshot() as nested:
+                    assert nested is allocated_networks
+                # address pool loads another instance of the environment
+                same_env = Environment.get(id=environment.id)
+                with same_env.allocation_snapshot() as nested:
+                    assert nested is allocated_networks
+                assert allocated_networks.overlaps(IPNetwork('10.0.0.0/24'))
+            assert get_allocated.call_count == 2
+
+            # snapshot is dropped with the transaction
+            with environment.allocation_snapshot():
+                pass
+            assert get_allocated.call_count == 3
+
     def test_node_creation(self):
         environment = Environment.create('test_env3')
         pool = IpNetworksPool(networks=[IPNetwork('10.1.0.0/24')], prefix=24)
@@ -162,3 +255,61 @@ class TestManager(TestCase):
                 environment=environment, name='test_ap1', pool=pool)
         assert str(e.value) == \
             'AddressPool with name "test_ap1" already exists'
+
+
+class TestEnvironmentSnapshot(TestCase):
+
+    def setUp(self):
+        self.env = Environment.create('test_env')
+        self.calls = mock.Mock()
+        self.nodes = []
+        for num, active in enumerate((True, False)):
+            node = getattr(self.calls, 'node{}'.format(num))
+            node.id = num
+            node.name = 'node{}'.format(num)
+            node.is_active.return_value = active
+            self.nodes.append(node)
+        patcher = mock.patch.object(Environment, 'get_nodes',
+                                    return_value=self.nodes)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_snapshot(self):
+        durations = self.env.snapshot(name='snap1')
+        assert list(durations) == ['node0', 'node1']
+        for node in self.nodes:
+            node.snapshot.assert_called_once_with(
+                name='snap1', description=None, force=False, external=False)
+            assert node.suspend.called is False
+            assert node.resume.called is False
+
+    def test_snapshot_suspend(self):
+        self.env.snapshot(name='snap1', suspend=True)
+        node0, node1 = self.nodes
+        assert node1.suspend.called is False
+        assert node1.resume.called is False
+        calls = [c for c in self.calls.mock_calls
+                 if not c[0].endswith('is_active')]
+        assert calls == [
+            mock.call.node0.suspend(),
+            mock.call.node0.snapshot(
+                name='snap1', description=None, force=False,
+                external=False),
+            mock.call.node1.snapshot(
+                name='snap1', description=None, force=False,
+                external=False),
+            mock.call.node0.resume(),
+        ]
+
+    def test_snapshot_error_resumes(self):
+        node0, node1 = self.nodes
+        node1.snapshot.side_effect = DevopsError('no space')
+        with pytest.raises(DevopsError):
+            self.env.snapshot(name='snap1', suspend=True)
+        node0.resume.assert_called_once_with()
+
+    def test_revert(self):
+        durations = self.env.revert(name='snap1', flag=False)
+        assert list(durations) == ['node0', 'node1']
+        for node in self.nodes:
+            node.revert.assert_called_once_with(name='snap1')
@@ -90,3 +90,27 @@ class TestDoSnapshot(BaseShellTestCase):
             node.snapshot.assert_called_once_with(
                 force=mock.ANY, description=mock.ANY,
                 name="test-snapshot-name", external=False)
+
+
+class TestPool(BaseShellTestCase):
+
+    @mock.patch.object(shell, 'get_devops_config')
+    @mock.patch.object(models.PooledEnvironment, 'fill')
+    def test_fill(self, mock_fill, mock_get_config):
+        self.execute('pool', 'fill', 'ci', 'default.yaml', '--count', '3')
+        mock_get_config.assert_called_once_with('default.yaml')
+        mock_fill.assert_called_once_with(
+            pool_name='ci', config=mock_get_config.return_value, count=3,
+            snapshot_name='ready')
+
+    @mock.patch.object(models.PooledEnvironment, 'checkout')
+    def test_checkout(self, mock_checkout):
+        self.execute('pool', 'checkout', 'ci', '--env-name', 'job_1')
+        mock_checkout.assert_called_once_with(pool_name='ci', name='job_1')
+
+    @mock.patch.object(models.PooledEnvironment, 'release')
+    @mock.patch.object(models.PooledEnvironment, 'get_environment')
+    def test_return(self, mock_get_env, mock_release):
+        self.execute('pool', 'return', 'job_1')
+        mock_get_env.assert_called_once_with('job_1')
+        mock_release.assert_called_once_with(mock_get_env.return_value)